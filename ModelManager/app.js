@@ -22,6 +22,39 @@ function buildModelDictFromFile(file) {
     return modelDict;
 }
 
+function buildModelDictFromIndexRecord(record) {
+    // Records in the run index already contain the hyperparameters, so there's no need to parse
+    // the directory name
+    let modelDict = [];
+
+    modelDict["type"] = record["type"];
+    modelDict["timestamp"] = record["run"];
+    modelDict["title"] = record["modelName"];
+
+    Object.keys(record["hyperParams"]).forEach(key => {
+        modelDict[key] = record["hyperParams"][key];
+    });
+
+    return modelDict;
+}
+
+function parseRunIndex(text) {
+    // The index is append only, so later records for a run override earlier ones
+    let runs = {};
+    text.split("\n").forEach(line => {
+        line = line.trim();
+        if (line.length === 0) {
+            return;
+        }
+
+        const record = JSON.parse(line);
+        const key = record["modelName"] + "/" + record["run"];
+        runs[key] = Object.assign(runs[key] || {}, record);
+    });
+
+    return Object.keys(runs).map(key => runs[key]);
+}
+
 function buildTensorboardCommand(matchingModels) {
     // TODO: remove duplicate logdirs
     // Build the tensorboard command
@@ -135,19 +168,36 @@ let filter = {
     }
 }
 
-const main = function() {
+const loadModels = function(models) {
+    const $filtersRow = $("#filtersRow");
+    $filtersRow.empty();
+    $filtersRow.append("<h3>Filter by:</h3>");
 
-    let modelFiles;
-    let models = [];
+    filter.models = models;
+
+    // Now we build the checkboxes, one column at a time
+    const allModelColumns = Object.keys(models[0]);
+
+    // The timestamp and title wouldn't be very useful here
+    filter.modelColumns = allModelColumns.filter(element => {
+        return element !== "timestamp" && element !== "title";
+    });
+
+    filter.buildCheckboxes($filtersRow);
+
+    // Now show the models that match the selected criteria
+    $(".filterCheckbox").change(() => {filter.onFilterUpdate()});
+    filter.onFilterUpdate();
+}
+
+const main = function() {
 
     // Activate the first button and preview when a file is selected
     $("#modelDirInput").change(function(event) {
-        const $filtersRow = $("#filtersRow");
-        $filtersRow.empty();
-        $filtersRow.append("<h3>Filter by:</h3>");
+        let models = [];
 
         // Load the directory
-        modelFiles = Array.from(event.currentTarget.files);
+        const modelFiles = Array.from(event.currentTarget.files);
 
         // Each directory will contain multiple files so this array will have multiple entries.
         // We'll just filter by this file to prevent duplicates
@@ -159,21 +209,20 @@ const main = function() {
             }
         });
 
-        filter.models = models;
-
-        // Now we build the checkboxes, one column at a time
-        const allModelColumns = Object.keys(models[0]);
-
-        // The timestamp and title wouldn't be very useful here
-        filter.modelColumns = allModelColumns.filter(element => {
-            return element !== "timestamp" && element !== "title";
-        });
+        loadModels(models);
+    });
 
-        filter.buildCheckboxes($filtersRow);
+    // The run index is a single file, so this is much faster than loading the whole directory
+    $("#runIndexInput").change(function(event) {
+        const reader = new FileReader();
+        reader.onload = () => {
+            const records = parseRunIndex(reader.result).filter(record => {
+                return record["hyperParams"] !== undefined;
+            });
 
-        // Now show the models that match the selected criteria
-        $(".filterCheckbox").change(() => {filter.onFilterUpdate()});
-        filter.onFilterUpdate();
+            loadModels(records.map(buildModelDictFromIndexRecord));
+        };
+        reader.readAsText(event.currentTarget.files[0]);
     });
 }
 
@@ -0,0 +1,218 @@
+"""
+Tools for measuring the throughput of models, and for choosing settings that make best use of the
+machine they are running on.
+"""
+
+import time
+from typing import Any, Dict, List
+import warnings
+
+import numpy as np
+
+import tensorflow as tf
+
+from TFHelpers.LogAggregation import formatLeaderboard
+from TFHelpers.ScikitWrapper import StepCallables
+from TFHelpers.TrainingHelpers import getCurrentRSSBytes, getPeakRSSBytes, resetPeakRSS
+
+class BatchSizeReport:
+    """
+    The results of BatchSizeTuner.tune, with one entry in results for each batch size that was
+    measured.
+    """
+    def __init__(self,
+                 results: List[Dict[str, Any]],
+                 recommendedTrainingBatchSize: int,
+                 recommendedInferenceBatchSize: int):
+        self.results = results
+        self.recommendedTrainingBatchSize = recommendedTrainingBatchSize
+        self.recommendedInferenceBatchSize = recommendedInferenceBatchSize
+
+    def __str__(self) -> str:
+        table = formatLeaderboard(self.results, ["batchSize",
+                                                 "trainSamplesPerSec",
+                                                 "predictSamplesPerSec",
+                                                 "peakBytes",
+                                                 "withinBudget"])
+
+        return table + "\nRecommended training batch size: {0}" \
+                       "\nRecommended inference batch size: {1}".format(
+                           self.recommendedTrainingBatchSize, self.recommendedInferenceBatchSize)
+
+class BatchSizeTuner:
+    """
+    Measures the training and prediction throughput of a TFRegressor for several batch sizes, and
+    recommends the batch sizes with the highest throughput that fit within a memory budget.
+
+    Each batch size is measured using a fresh graph built by the estimator's _buildGraph, so no model
+    files are written and the estimator itself is not modified.
+    """
+    def __init__(self,
+                 estimator,
+                 candidateBatchSizes: List[int]=None,
+                 memoryBudgetBytes: int=None,
+                 warmupSteps: int=3,
+                 measureSteps: int=20):
+        self._estimator = estimator
+        self._candidateBatchSizes = [2 ** power for power in range(5, 14)] \
+                                    if candidateBatchSizes is None else candidateBatchSizes
+        self._memoryBudgetBytes = memoryBudgetBytes
+        self._warmupSteps = warmupSteps
+        self._measureSteps = measureSteps
+
+    def _timeSteps(self, runStep, numRows: int, batchSize: int) -> float:
+        """Runs warm-up steps and then returns the samples per second over the measured steps"""
+        batches = [np.random.randint(0, numRows, batchSize)
+                   for _ in range(self._warmupSteps + self._measureSteps)]
+
+        for indicies in batches[:self._warmupSteps]:
+            runStep(indicies)
+
+        start = time.time()
+        for indicies in batches[self._warmupSteps:]:
+            runStep(indicies)
+
+        return self._measureSteps * batchSize / (time.time() - start)
+
+    def _measureBatchSize(self, X, y, batchSize: int) -> Dict[str, Any]:
+        """Builds a fresh graph and measures training and prediction with the given batch size"""
+        if not resetPeakRSS():
+            warnings.warn("The peak resident set size could not be reset, so peakBytes is only "
+                          "measured when the steps exceed the previous peak of the process",
+                          RuntimeWarning)
+
+        baselineBytes = getCurrentRSSBytes()
+        baselinePeakBytes = getPeakRSSBytes()
+
+        graph = tf.Graph()
+        with graph.as_default():
+            tensors = self._estimator._buildGraph(X.shape[1])
+            init = tf.global_variables_initializer()
+
+        with tf.Session(graph=graph) as sess:
+            sess.run(init)
+
+            def trainStep(indicies):
+                sess.run(tensors.trainingOp,
+                         feed_dict={tensors.X_in: self._estimator._featureFeed(X[indicies]),
+                                    tensors.y_in: y[indicies],
+                                    tensors.dropoutKeepProb: 1 - self._estimator.dropoutRate})
+
+            def predictStep(indicies):
+                sess.run(tensors.logits,
+                         feed_dict={tensors.X_in: self._estimator._featureFeed(X[indicies])})
+
+            trainSamplesPerSec = self._timeSteps(trainStep, X.shape[0], batchSize)
+            predictSamplesPerSec = self._timeSteps(predictStep, X.shape[0], batchSize)
+            endBytes = getCurrentRSSBytes()
+
+        # If the peak wasn't reset and the steps didn't exceed it, the true peak of the steps is
+        # unknown so the memory still in use at the end of the steps is used instead
+        peakBytes = getPeakRSSBytes()
+        if peakBytes > baselinePeakBytes:
+            peakBytes -= baselineBytes
+        else:
+            peakBytes = max(endBytes, baselineBytes) - baselineBytes
+
+        return {"batchSize": batchSize,
+                "trainSamplesPerSec": trainSamplesPerSec,
+                "predictSamplesPerSec": predictSamplesPerSec,
+                "peakBytes": peakBytes,
+                "withinBudget": self._memoryBudgetBytes is None or
+                                peakBytes <= self._memoryBudgetBytes}
+
+    def tune(self, X, y) -> BatchSizeReport:
+        """
+        Measures each candidate batch size in increasing order using samples drawn from X and y.
+        Candidates larger than the number of rows in X are skipped, and no larger candidates are
+        measured once one has exceeded the memory budget.
+        """
+        results = []
+        for batchSize in sorted(self._candidateBatchSizes):
+            if batchSize > X.shape[0]:
+                break
+
+            results.append(self._measureBatchSize(X, y, batchSize))
+            print("Batch size: {0}\tTrain: {1:.1f} samples/s\tPredict: {2:.1f} samples/s".format(
+                batchSize, results[-1]["trainSamplesPerSec"], results[-1]["predictSamplesPerSec"]))
+
+            if not results[-1]["withinBudget"]:
+                break
+
+        withinBudget = [result for result in results if result["withinBudget"]]
+        if not withinBudget:
+            raise RuntimeError("None of the candidate batch sizes fit within the memory budget")
+
+        return BatchSizeReport(
+            results,
+            max(withinBudget, key=lambda result: result["trainSamplesPerSec"])["batchSize"],
+            max(withinBudget, key=lambda result: result["predictSamplesPerSec"])["batchSize"])
+
+def measureStepOverhead(estimator,
+                        X,
+                        y,
+                        batchSize: int=None,
+                        warmupSteps: int=10,
+                        measureSteps: int=200) -> List[Dict[str, Any]]:
+    """
+    Measures the median time of a training, loss and prediction step when fed through sess.run with
+    a feed_dict, as TFRegressor did before using StepCallables, and through StepCallables. Both are
+    timed on the same batches in a fresh graph built by the estimator's _buildGraph, so the
+    difference is the overhead per step that the callables remove.
+
+    batchSize defaults to the estimator's batch size. Small batches show the overhead most clearly.
+    """
+    BATCH_SIZE = min(estimator.batchSize if batchSize is None else batchSize, X.shape[0])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tensors = estimator._buildGraph(X.shape[1])
+        init = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+
+    # The training step of the callables also updates the model's streaming metrics
+    trainFetches = [tensors.trainingOp] + ([] if tensors.metrics is None else [tensors.metrics.updateOp])
+
+    X, y = X.astype(np.float32), y.astype(np.float32)
+    batches = [np.random.randint(0, X.shape[0], BATCH_SIZE) for _ in range(warmupSteps + measureSteps)]
+    dropoutKeepProb = 1 - estimator.dropoutRate
+
+    with tf.Session(graph=graph) as sess:
+        sess.run(init)
+        callables = StepCallables(sess, tensors, tensors.trainingOp)
+
+        steps = {"train": (lambda indicies: sess.run(trainFetches,
+                                                     feed_dict={tensors.X_in: X[indicies],
+                                                                tensors.y_in: y[indicies],
+                                                                tensors.dropoutKeepProb: dropoutKeepProb}),
+                           lambda indicies: callables.train(X[indicies], y[indicies], dropoutKeepProb)),
+                 "loss": (lambda indicies: tensors.loss.eval(feed_dict={tensors.X_in: X[indicies],
+                                                                        tensors.y_in: y[indicies]},
+                                                             session=sess),
+                          lambda indicies: callables.loss(X[indicies], y[indicies])),
+                 "predict": (lambda indicies: tensors.logits.eval(feed_dict={tensors.X_in: X[indicies]},
+                                                                  session=sess),
+                             lambda indicies: callables.logits(X[indicies]))}
+
+        results = []
+        for name, (feedDictStep, callableStep) in steps.items():
+            feedDictSeconds = _medianStepSeconds(feedDictStep, batches, warmupSteps)
+            callableSeconds = _medianStepSeconds(callableStep, batches, warmupSteps)
+            results.append({"step": name,
+                            "feedDictSeconds": feedDictSeconds,
+                            "callableSeconds": callableSeconds,
+                            "savedSeconds": feedDictSeconds - callableSeconds})
+            print("{0}: {1:.6f}s with feed_dict, {2:.6f}s with callable".format(
+                name, feedDictSeconds, callableSeconds))
+
+    return results
+
+def _medianStepSeconds(runStep, batches, warmupSteps: int) -> float:
+    """Runs a step on each batch and returns the median time of the steps after the warm-up"""
+    times = []
+    for step, indicies in enumerate(batches):
+        start = time.perf_counter()
+        runStep(indicies)
+        if step >= warmupSteps:
+            times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
@@ -2,68 +2,542 @@
 Utilities for writing and managing files for models and their logs.
 """
 
+from contextlib import contextmanager
 from datetime import datetime
+import json
+import os
 import pathlib
-from typing import List
+import pickle
+from typing import Any, Dict, List
+import warnings
 
 import tensorflow as tf
 
+try:
+    import fcntl
+except ImportError:
+    # Windows locks with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+# Add expensive summaries, eg. histograms of large variables, to this collection rather than
+# tf.GraphKeys.SUMMARIES so that TensorboardLogHelper can write them less often
+HISTOGRAM_SUMMARIES = "histogram_summaries"
+
+class CheckpointRetentionPolicy:
+    """
+    Describes which checkpoints CheckpointAndRestoreHelper should keep when saving.
+
+    The best keepBestK checkpoints by validation loss are kept, along with the latest checkpoint if
+    keepLatest is True. If the checkpoints of a run exceed maxRunBytes, or all files in treeDir
+    exceed maxTreeBytes, further checkpoints are pruned. The best checkpoint of a run is never
+    pruned, and the tree budget only prunes other runs once they are marked as finished in the run
+    index.
+    """
+    def __init__(self,
+                 keepBestK: int=1,
+                 keepLatest: bool=True,
+                 maxRunBytes: int=None,
+                 maxTreeBytes: int=None,
+                 treeDir: str=None):
+        self.keepBestK = keepBestK
+        self.keepLatest = keepLatest
+        self.maxRunBytes = maxRunBytes
+        self.maxTreeBytes = maxTreeBytes
+        self.treeDir = treeDir
+
+def _readManifest(manifestPath: str) -> List[Dict[str, Any]]:
+    """Returns the checkpoints recorded in a manifest, in the order they were saved"""
+    if not os.path.isfile(manifestPath):
+        return []
+
+    with open(manifestPath, "r") as f:
+        return json.load(f)
+
+def _writeManifest(manifestPath: str, entries: List[Dict[str, Any]]) -> None:
+    """Writes a manifest to a temporary file first so a crash never leaves a partial manifest"""
+    tempPath = manifestPath + ".tmp"
+    with open(tempPath, "w") as f:
+        json.dump(entries, f)
+
+    os.replace(tempPath, manifestPath)
+
+def _checkpointFiles(checkpointPath: str) -> List[str]:
+    """Returns the data and index files of a checkpoint"""
+    return [str(path) for path in pathlib.Path(checkpointPath).parent.glob(
+        pathlib.Path(checkpointPath).name + ".*")]
+
+def _bestEntry(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Returns the entry with the lowest validation loss, or None if no entries have a loss"""
+    withLoss = [entry for entry in entries if entry["lossVal"] is not None]
+    return min(withLoss, key=lambda entry: entry["lossVal"]) if withLoss else None
+
+def _pruneCheckpoints(runDir: str,
+                      manifestPath: str,
+                      entries: List[Dict[str, Any]],
+                      pruned: List[Dict[str, Any]]) -> None:
+    """
+    Removes the pruned entries from a run. The manifest and the tensorflow checkpoint state are
+    updated before any files are deleted, so they never refer to a checkpoint that doesn't exist.
+    """
+    prunedPaths = set(entry["path"] for entry in pruned)
+    retained = [entry for entry in entries if entry["path"] not in prunedPaths]
+
+    _writeManifest(manifestPath, retained)
+    if retained:
+        tf.train.update_checkpoint_state(runDir,
+                                         os.path.join(runDir, retained[-1]["path"]),
+                                         [os.path.join(runDir, entry["path"]) for entry in retained])
+
+    for entry in pruned:
+        for path in _checkpointFiles(os.path.join(runDir, entry["path"])):
+            os.remove(path)
+
+@contextmanager
+def _lockFile(lockPath: str):
+    """
+    Holds an exclusive lock on the file at lockPath, which is created if needed, blocking until
+    other processes have released it
+    """
+    with open(lockPath, "a+") as lockFile:
+        if fcntl is not None:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+        else:
+            lockFile.seek(0)
+            msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+            else:
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+
+def findBestCheckpoint(modelRootPath: str) -> str:
+    """
+    Returns the path of the checkpoint with the lowest validation loss in a run's manifest, else the
+    run's latest checkpoint, or None if it has no checkpoints. modelRootPath is the run directory and
+    model prefix, as returned by FileManager.getModelDirAndPrefix.
+    """
+    runDir = str(pathlib.Path(modelRootPath).parents[0])
+    best = _bestEntry(_readManifest(modelRootPath + ".ckpt.manifest"))
+    if best is None:
+        return tf.train.latest_checkpoint(runDir)
+
+    return os.path.join(runDir, best["path"])
+
 class CheckpointAndRestoreHelper:
     """
     Provides functionality for saving the model during training (*.ckpt.*) and writing the number of
     epochs to a file.
+
+    Checkpoints can also be saved part way through an epoch with saveResumeState, along with the
+    state of the training loop (*.resume.state), so that a restarted run can continue from exactly
+    where it stopped. These are replaced by each save, and removed by the next saveCheckpoint.
+
+    If a CheckpointRetentionPolicy is provided, each save is written to a new checkpoint
+    (*.ckpt-<epoch>.*) which is recorded with its validation loss in a manifest (*.ckpt.manifest),
+    and checkpoints are pruned according to the policy.
     """
-    def __init__(self, modelRootPath: str, shouldRestore: bool, graph):
+    def __init__(self,
+                 modelRootPath: str,
+                 shouldRestore: bool,
+                 graph,
+                 retentionPolicy: CheckpointRetentionPolicy=None,
+                 varList=None):
+        """
+        Provide varList to save only those variables rather than every variable in the graph, for
+        example if several models share a graph.
+        """
         self.MODEL_ROOT_DIR = str(pathlib.Path(modelRootPath).parents[0])
         self.MODEL_CKPT_PATH = modelRootPath + ".ckpt"
         self.MODEL_EPOCH_PATH = self.MODEL_CKPT_PATH + ".epoch"
-        MODEL_META_PATH = self.MODEL_CKPT_PATH +".meta"
+        self.MODEL_MANIFEST_PATH = self.MODEL_CKPT_PATH + ".manifest"
+        self.MODEL_META_PATH = self.MODEL_CKPT_PATH +".meta"
+        self.MODEL_RESUME_PATH = modelRootPath + ".resume"
+        self.MODEL_RESUME_STATE_PATH = self.MODEL_RESUME_PATH + ".state"
+
+        self._modelRootPath = modelRootPath
+        self._retentionPolicy = retentionPolicy
+        self._resumeState = None
+
+        # Size of the files in the tree, which is only walked when it may be over budget
+        self._treeBytes = None
 
         with graph.as_default():
             if shouldRestore:
-                self._saver = tf.train.import_meta_graph(MODEL_META_PATH)
+                self._saver = tf.train.import_meta_graph(self.MODEL_META_PATH)
             else:
-                self._saver = tf.train.Saver()
+                self._saver = tf.train.Saver(var_list=varList)
+
+        if retentionPolicy is not None:
+            # Checkpoints are pruned by the policy, so stop the saver deleting them itself
+            self._saver.saver_def.max_to_keep = 0
+
+    def getBestCheckpointPath(self) -> str:
+        """
+        Returns the path of the checkpoint with the lowest validation loss if a manifest is
+        available, else the latest checkpoint.
+        """
+        return findBestCheckpoint(self._modelRootPath)
+
+    def restoreFromCheckpoint(self, sess, restoreBest: bool=True) -> int:
+        """
+        Attempts to restore from a checkpoint if one is available. Returns the epoch number to start
+        from.
+
+        If a checkpoint was saved part way through an epoch by saveResumeState it is more recent
+        than any other checkpoint, so is always restored and its state is available from
+        getResumeState.
+        """
+        resume = self._readResume()
+        if resume is not None:
+            print("Found mid-epoch checkpoint, continuing from epoch:", resume["epoch"])
+            self._saver.restore(sess, os.path.join(self.MODEL_ROOT_DIR, resume["path"]))
+            self._resumeState = resume["state"]
+
+            return resume["epoch"]
 
-    def restoreFromCheckpoint(self, sess) -> int:
-        """Attempts to restore from a checkpoint if one is available. Returns the epoch number to
-        start from"""
         with open(self.MODEL_EPOCH_PATH, "rb") as f:
             startEpoch = int(f.read())
 
+        checkpointPath = tf.train.latest_checkpoint(self.MODEL_ROOT_DIR)
+
+        best = _bestEntry(_readManifest(self.MODEL_MANIFEST_PATH))
+        if restoreBest and best is not None:
+            checkpointPath = os.path.join(self.MODEL_ROOT_DIR, best["path"])
+            startEpoch = best["epoch"] + 1
+
         print("Found checkpoint file, continuing from epoch:", startEpoch)
-        self._saver.restore(sess, tf.train.latest_checkpoint(self.MODEL_ROOT_DIR))
+        self._saver.restore(sess, checkpointPath)
 
         return startEpoch
 
-    def saveCheckpoint(self, sess, epoch: int) -> None:
+    def saveCheckpoint(self, sess, epoch: int, lossVal: float=None) -> None:
         """Saves the model with the .ckpt extension and updates the epoch counter."""
-        self._saver.save(sess, self.MODEL_CKPT_PATH)
+        if self._retentionPolicy is None:
+            self._saver.save(sess, self.MODEL_CKPT_PATH)
+        else:
+            self._saveRetainedCheckpoint(sess, epoch, lossVal)
+
         with open(self.MODEL_EPOCH_PATH, "wb") as f:
             f.write(b"%d" % (epoch + 1))
 
+        # The completed epoch supersedes any checkpoint saved part way through it
+        self._removeResume()
+
+    def saveResumeState(self, sess, epoch: int, globalStep: int, state: Dict[str, Any]) -> None:
+        """
+        Saves a checkpoint part way through an epoch along with the state of the training loop, eg.
+        the step within the epoch and the order of the batches. state can be anything that can be
+        pickled. globalStep must increase with each save, including across restarts.
+        """
+        previous = self._readResume()
+
+        checkpointPath = self._saver.save(sess,
+                                          self.MODEL_RESUME_PATH,
+                                          global_step=globalStep,
+                                          write_meta_graph=False,
+                                          write_state=False)
+
+        # The meta graph is needed to restore, and is otherwise only written at the end of an epoch
+        if not os.path.isfile(self.MODEL_META_PATH):
+            with sess.graph.as_default():
+                self._saver.export_meta_graph(self.MODEL_META_PATH)
+
+        # Written to a temporary file first so the state always refers to a complete checkpoint
+        tempPath = self.MODEL_RESUME_STATE_PATH + ".tmp"
+        with open(tempPath, "wb") as f:
+            pickle.dump({"path": os.path.basename(checkpointPath), "epoch": epoch, "state": state},
+                        f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, self.MODEL_RESUME_STATE_PATH)
+
+        if previous is not None and previous["path"] != os.path.basename(checkpointPath):
+            for path in _checkpointFiles(os.path.join(self.MODEL_ROOT_DIR, previous["path"])):
+                os.remove(path)
+
+    def getResumeState(self) -> Dict[str, Any]:
+        """
+        Returns the state provided to saveResumeState if restoreFromCheckpoint restored a mid-epoch
+        checkpoint, else None.
+        """
+        return self._resumeState
+
+    def _readResume(self) -> Dict[str, Any]:
+        """Returns the latest mid-epoch checkpoint and its state, or None if there isn't one"""
+        if not os.path.isfile(self.MODEL_RESUME_STATE_PATH):
+            return None
+
+        with open(self.MODEL_RESUME_STATE_PATH, "rb") as f:
+            return pickle.load(f)
+
+    def _removeResume(self) -> None:
+        """Removes the mid-epoch checkpoint, the state first so it never refers to missing files"""
+        resume = self._readResume()
+        if resume is None:
+            return
+
+        os.remove(self.MODEL_RESUME_STATE_PATH)
+        for path in _checkpointFiles(os.path.join(self.MODEL_ROOT_DIR, resume["path"])):
+            os.remove(path)
+
+    def _saveRetainedCheckpoint(self, sess, epoch: int, lossVal: float) -> None:
+        """Saves a new checkpoint, records it in the manifest, and then applies the policy"""
+        checkpointPath = self._saver.save(sess,
+                                          self.MODEL_CKPT_PATH,
+                                          global_step=epoch,
+                                          write_meta_graph=False,
+                                          write_state=False)
+        self._saver.export_meta_graph(self.MODEL_META_PATH)
+
+        entry = {"path": os.path.basename(checkpointPath),
+                 "epoch": epoch,
+                 "lossVal": None if lossVal is None else float(lossVal),
+                 "bytes": sum(os.path.getsize(path) for path in _checkpointFiles(checkpointPath))}
+
+        # The tree budget of another process may be pruning this run
+        with _lockFile(self.MODEL_MANIFEST_PATH + ".lock"):
+            # Saving the same epoch again replaces the previous checkpoint
+            entries = [existing for existing in _readManifest(self.MODEL_MANIFEST_PATH)
+                       if existing["path"] != entry["path"]]
+            entries.append(entry)
+
+            retained = self._selectRetained(entries)
+            pruned = [entry for entry in entries if entry not in retained]
+            _pruneCheckpoints(self.MODEL_ROOT_DIR, self.MODEL_MANIFEST_PATH, entries, pruned)
+
+        if self._retentionPolicy.maxTreeBytes is not None:
+            if self._treeBytes is not None:
+                self._treeBytes += entry["bytes"] - sum(prunedEntry["bytes"]
+                                                        for prunedEntry in pruned)
+
+            self._enforceTreeBudget()
+
+    def _selectRetained(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Returns the entries to keep, ordered from most to least important. The best entry is first
+        and is always kept.
+        """
+        policy = self._retentionPolicy
+
+        byLoss = sorted([entry for entry in entries if entry["lossVal"] is not None],
+                        key=lambda entry: entry["lossVal"])
+        retained = byLoss[:max(policy.keepBestK, 1)]
+
+        latest = entries[-1]
+        if policy.keepLatest and latest not in retained:
+            # Keep the latest just after the best so that the budget removes it last
+            retained.insert(1 if retained else 0, latest)
+
+        if not retained:
+            retained = [latest]
+
+        if policy.maxRunBytes is not None:
+            while len(retained) > 1 and \
+                  sum(entry["bytes"] for entry in retained) > policy.maxRunBytes:
+                retained.pop()
+
+        return retained
+
+    def _enforceTreeBudget(self) -> None:
+        """
+        Prunes checkpoints across the runs in the tree until the tree fits within maxTreeBytes.
+        Runs are pruned oldest first, and only checkpoints recorded in a manifest which are not the
+        best or latest checkpoint of their run are removed. Other runs are only pruned once they are
+        marked as finished in the run index, so checkpoints aren't removed from a run that is still
+        training.
+
+        The size of the tree is cached between saves and only walked again when the cached size
+        exceeds the budget.
+        """
+        budget = self._retentionPolicy.maxTreeBytes
+        if self._treeBytes is not None and self._treeBytes <= budget:
+            return
+
+        treeDir = self._retentionPolicy.treeDir
+        if treeDir is None:
+            treeDir = str(pathlib.Path(self.MODEL_ROOT_DIR).parents[1])
+
+        self._treeBytes = sum(os.path.getsize(os.path.join(dirPath, fileName))
+                              for dirPath, _, fileNames in os.walk(treeDir)
+                              for fileName in fileNames)
+        if self._treeBytes <= budget:
+            return
+
+        runIndex = RunIndex(os.path.join(treeDir, FileManager.RUN_INDEX_FILENAME))
+        finishedRuns = set(key for key, run in runIndex.readRuns().items()
+                           if run.get("finished") is True)
+
+        manifestPaths = sorted(pathlib.Path(treeDir).glob("**/*.ckpt.manifest"),
+                               key=lambda path: path.stat().st_mtime)
+
+        for manifestPath in manifestPaths:
+            runDir = manifestPath.parent
+            isThisRun = os.path.samefile(str(runDir), self.MODEL_ROOT_DIR)
+            if not isThisRun and runDir.relative_to(treeDir).as_posix() not in finishedRuns:
+                continue
+
+            with _lockFile(str(manifestPath) + ".lock"):
+                entries = _readManifest(str(manifestPath))
+                best = _bestEntry(entries)
+                candidates = [entry for entry in entries
+                              if entry is not best and entry is not entries[-1]]
+
+                # Remove the worst checkpoints first, those without a loss are treated as the worst
+                candidates.sort(key=lambda entry: -entry["lossVal"] if entry["lossVal"] is not None
+                                else -float("inf"))
+
+                pruned = []
+                for entry in candidates:
+                    if self._treeBytes <= budget:
+                        break
+
+                    pruned.append(entry)
+                    self._treeBytes -= entry["bytes"]
+
+                if pruned:
+                    _pruneCheckpoints(str(runDir), str(manifestPath), entries, pruned)
+
+            if self._treeBytes <= budget:
+                return
+
+        warnings.warn("The models tree is {0} bytes after pruning, over maxTreeBytes of {1}".format(
+                      self._treeBytes, budget),
+                      RuntimeWarning)
+
+class RunIndex:
+    """
+    Index of training runs stored as a JSON lines file, one record per line.
+
+    Records are appended, so a run can be updated every epoch without rewriting the file. When the
+    index is read, later records for a run are merged over earlier ones so the latest value of each
+    field wins. The index is compacted to a record per run whenever a run finishes, so it doesn't
+    grow with the number of epochs. Writes hold a lock file next to the index so that appends from
+    other processes aren't lost while it's compacted.
+    """
+    def __init__(self, indexPath: str):
+        self._indexPath = indexPath
+
+    def getPath(self) -> str:
+        """Returns the path of the index file"""
+        return self._indexPath
+
+    def updateRun(self, modelName: str, runName: str, fields: Dict[str, Any]) -> None:
+        """
+        Appends a record for the given run. Only the fields that have changed need to be provided.
+        """
+        record = {"modelName": modelName, "run": runName}
+        record.update(fields)
+
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with _lockFile(self._getLockPath()):
+            with open(self._indexPath, "a") as f:
+                f.write(line)
+
+            if fields.get("finished") is True:
+                self._compactLocked()
+
+    def readRuns(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns a dict of runs keyed by "<modelName>/<run>", each value is the merged record for
+        that run.
+        """
+        runs = {}
+
+        if os.path.isfile(self._indexPath):
+            with open(self._indexPath, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    record = json.loads(line)
+                    key = record["modelName"] + "/" + record["run"]
+                    runs.setdefault(key, {}).update(record)
+
+        return runs
+
+    def compact(self) -> None:
+        """Rewrites the index with a single merged record per run."""
+        with _lockFile(self._getLockPath()):
+            self._compactLocked()
+
+    def _getLockPath(self) -> str:
+        return self._indexPath + ".lock"
+
+    def _compactLocked(self) -> None:
+        """Compacts the index, must be called while holding the lock file"""
+        if not os.path.isfile(self._indexPath):
+            return
+
+        with open(self._indexPath, "r") as f:
+            numRecords = sum(1 for line in f if line.strip())
+
+        runs = self.readRuns()
+        if numRecords == len(runs):
+            return
+
+        tempPath = self._indexPath + ".tmp"
+        with open(tempPath, "w") as f:
+            for key in sorted(runs.keys()):
+                f.write(json.dumps(runs[key], sort_keys=True) + "\n")
+
+        os.replace(tempPath, self._indexPath)
+
 class FileManager:
     """
     Simple class to manage where model files will be written.
     Creates/expects a folder structure that looks like:
     ./models
+    ./models/runIndex.jsonl
     ./models/<modelName>
     ./models/<modelName>/<datetime>
     ./models/<modelName>/<datetime>/model*
     """
+    RUN_INDEX_FILENAME = "runIndex.jsonl"
+
     def __init__(self, modelName: str, restoreFrom: str=None):
         """
         Provide restoreFrom to reuse an existing model, this folder should contain the model files
         in the format:
             model.final.data-00000-of-00001, model.final.index, model.final.meta
         """
+        self._modelsDir = pathlib.Path.cwd() / "models"
+        self._modelName = modelName
 
         if restoreFrom is None:
-            self._modelDir = pathlib.Path.cwd() / "models" / modelName / \
-                             datetime.utcnow().strftime("%Y%m%d-%H%M")
+            self._runName = datetime.utcnow().strftime("%Y%m%d-%H%M")
+            self._modelDir = self._modelsDir / modelName / self._runName
             self._modelDir.mkdir(parents=True, exist_ok=True)
         else:
-            self._modelDir = pathlib.Path.cwd() / "models" / modelName / restoreFrom
+            self._runName = restoreFrom
+            self._modelDir = self._modelsDir / modelName / restoreFrom
+
+    def getModelName(self) -> str:
+        """
+        Returns the name of the model
+        eg: Seq2SeqRegressor-X-200-H-50_30_10-I-he-D-None
+        """
+        return self._modelName
+
+    def getRunName(self) -> str:
+        """
+        Returns the name of this run, which is the datetime it was started
+        eg: 20171116-2329
+        """
+        return self._runName
+
+    def getRunIndex(self) -> RunIndex:
+        """Returns the index of runs stored in the models directory"""
+        return RunIndex(str(self._modelsDir / self.RUN_INDEX_FILENAME))
+
+    def updateRunIndex(self, fields: Dict[str, Any]) -> None:
+        """Adds or updates the record for this run in the run index"""
+        self._modelsDir.mkdir(parents=True, exist_ok=True)
+        self.getRunIndex().updateRun(self._modelName, self._runName, fields)
 
     def getModelDir(self) -> str:
         """
@@ -89,16 +563,35 @@ class TensorboardLogHelper:
     validation data.
 
     Does a tf.summary.merge_all so any other summaries added to the graph will also get written to
-    the log when writeSummary is called.
+    the log when writeSummary is called. Summaries in the HISTOGRAM_SUMMARIES collection are merged
+    separately, and are only written every histogramEvery calls to writeSummary. Likewise the other
+    summaries are only written every scalarEvery calls.
 
     If you are restoring your graph using tf.train.import_meta_graph then this must be constructed
     after this has been done in order to restore summaries from the existing graph.
+
+    If several models share a graph, provide the name scope of a model in scope and only the
+    summaries within that scope will be written.
     """
-    def __init__(self, logDir, graph, summaryNames: List[str], shouldRestore: bool):
+    def __init__(self,
+                 logDir,
+                 graph,
+                 summaryNames: List[str],
+                 shouldRestore: bool,
+                 scope: str=None,
+                 scalarEvery: int=1,
+                 histogramEvery: int=1):
+        if scalarEvery < 1 or histogramEvery < 1:
+            raise ValueError("scalarEvery and histogramEvery must be larger than zero")
+
+        self._scalarEvery = scalarEvery
+        self._histogramEvery = histogramEvery
+
         with graph.as_default():
             self._fileWriter = tf.summary.FileWriter(logDir, graph)
 
-            THIS_NAMESCOPE = "TensorboardLogHelper"
+            THIS_NAMESCOPE = "TensorboardLogHelper" if scope is None \
+                             else scope + "/TensorboardLogHelper"
             with tf.name_scope(THIS_NAMESCOPE):
                 # If we are restoring from a previous run, get the existing placeholders and summary
                 # else add new placeholders and summaries to the graph
@@ -107,13 +600,29 @@ class TensorboardLogHelper:
                                                  for name in summaryNames]
                     self._summaries = tf.get_default_graph().get_tensor_by_name(
                         THIS_NAMESCOPE + "/Merge/MergeSummary:0")
+
+                    # Graphs without histograms, or saved before they were merged separately, won't
+                    # have this op
+                    histogramOps = [op for op in tf.get_default_graph().get_operations()
+                                    if op.type == "MergeSummary" and
+                                    op.name.startswith(THIS_NAMESCOPE + "/MergeHistograms")]
+                    self._histograms = histogramOps[0].outputs[0] if histogramOps else None
                 else:
                     self._summaryPlaceholders = [tf.placeholder(shape=(), dtype=tf.float32, name=name)
                                                  for name in summaryNames]
                     self._summaries = [tf.summary.scalar(name, placeholder)
                                        for name, placeholder in
                                        zip(summaryNames, self._summaryPlaceholders)]
-                    self._summaries = tf.summary.merge_all()
+                    if scope is None:
+                        self._summaries = tf.summary.merge_all()
+                    else:
+                        self._summaries = tf.summary.merge(
+                            tf.get_collection(tf.GraphKeys.SUMMARIES, scope=scope + "/"))
+
+                    histograms = tf.get_collection(HISTOGRAM_SUMMARIES,
+                                                   scope=None if scope is None else scope + "/")
+                    self._histograms = tf.summary.merge(histograms, name="MergeHistograms") \
+                                       if histograms else None
 
             self._iteration = 0
 
@@ -137,11 +646,29 @@ class TensorboardLogHelper:
         feed_dict = {placeholder: value
                      for placeholder, value in zip(self._summaryPlaceholders, summaryValues)}
 
-        summaryStrs = sess.run(self._summaries, feed_dict=feed_dict)
-        self._fileWriter.add_summary(summaryStrs, self._iteration)
+        # Only the summaries which are due are evaluated, so skipped histograms cost nothing
+        fetches = []
+        if self._iteration % self._scalarEvery == 0:
+            fetches.append(self._summaries)
+        if self._histograms is not None and self._iteration % self._histogramEvery == 0:
+            fetches.append(self._histograms)
+
+        if fetches:
+            for summaryStr in sess.run(fetches, feed_dict=feed_dict):
+                self._fileWriter.add_summary(summaryStr, self._iteration)
 
         self._iteration += 1
 
+    def writeValues(self, values: Dict[str, float]) -> None:
+        """
+        Writes scalar values which don't have a summary in the graph, eg. measurements made outside
+        of tensorflow, keyed by their tag. These are written for the current iteration, so call this
+        before writeSummary to log them for the same iteration.
+        """
+        summary = tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=float(value))
+                                    for tag, value in values.items() if value is not None])
+        self._fileWriter.add_summary(summary, self._iteration)
+
     def close(self) -> None:
         """Close the file writer"""
         self._fileWriter.close()
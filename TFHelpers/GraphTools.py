@@ -2,11 +2,22 @@
 Tools for manipulating model and graph files outside of training/inference.
 """
 
+import argparse
+from collections import OrderedDict
+import json
 import os
+import time
+from typing import Any, Dict, List
 
+import numpy as np
+
+from google.protobuf import text_format
 import tensorflow as tf
 from tensorflow.python.tools import freeze_graph
 
+from TFHelpers.LogAggregation import formatLeaderboard
+from TFHelpers.NumpyInference import NumpyRegressor, writeWeightFile
+
 def metaToProtoBufGraph(modelDir: str, modelBaseName: str, outFileName: str) -> None:
     """
     Converts model files to a protobuf graph def.
@@ -66,4 +77,590 @@ def removeTrainingNodesFromProtoBufGraph(modelDir: str,
                                                             OUT_GRAPH,
                                                             INPUTS,
                                                             OUTPUTS,
-                                                            TRANFORMS))
\ No newline at end of file
+                                                            TRANFORMS))
+
+# Ops which cost one operation per output element
+ELEMENTWISE_OPS = ["Add", "AddV2", "BiasAdd", "Elu", "Mul", "Relu", "Relu6", "Selu", "Sigmoid",
+                   "Softplus", "Sub", "Tanh"]
+
+def _elementsPerRow(tensor) -> int:
+    """Returns the number of elements in each row of a tensor, or 0 if its shape isn't known"""
+    dims = tensor.shape.as_list() if tensor.shape.ndims is not None else None
+    if not dims or any(dim is None for dim in dims[1:]):
+        return 0
+
+    return int(np.prod(dims[1:])) if len(dims) > 1 else 1
+
+def _opsBetween(inputTensors: List[tf.Tensor], outputTensor: tf.Tensor) -> List[tf.Operation]:
+    """Returns the ops which outputTensor depends on after inputTensors, in topological order"""
+    inputOps = set(tensor.op for tensor in inputTensors)
+    visited = set()
+    ordered = []
+
+    # Iterative depth first search so deep graphs don't hit the recursion limit
+    stack = [(outputTensor.op, False)]
+    while stack:
+        op, inputsDone = stack.pop()
+        if inputsDone:
+            ordered.append(op)
+            continue
+
+        if op in visited or op in inputOps:
+            continue
+
+        visited.add(op)
+        stack.append((op, True))
+        stack.extend((tensor.op, False) for tensor in op.inputs)
+
+    return ordered
+
+def _measureLatencies(session,
+                      inputTensor,
+                      outputTensor,
+                      batchSizes: List[int],
+                      warmupRuns: int,
+                      measureRuns: int) -> List[Dict[str, Any]]:
+    """Returns the median latency of predicting random batches of each size"""
+    return _measureCallLatencies(lambda X_batch: session.run(outputTensor,
+                                                             feed_dict={inputTensor: X_batch}),
+                                 inputTensor.shape.as_list()[1],
+                                 inputTensor.dtype.as_numpy_dtype,
+                                 batchSizes,
+                                 warmupRuns,
+                                 measureRuns)
+
+def _measureCallLatencies(predict,
+                          numFeatures: int,
+                          dtype,
+                          batchSizes: List[int],
+                          warmupRuns: int,
+                          measureRuns: int) -> List[Dict[str, Any]]:
+    """Returns the median latency of calling predict with random batches of each size"""
+    latencies = []
+    for batchSize in batchSizes:
+        X_batch = np.random.randn(batchSize, numFeatures).astype(dtype)
+
+        times = []
+        for run in range(warmupRuns + measureRuns):
+            start = time.time()
+            predict(X_batch)
+            if run >= warmupRuns:
+                times.append(time.time() - start)
+
+        latency = float(np.median(times))
+        latencies.append({"batchSize": batchSize,
+                          "latencyMs": latency * 1000,
+                          "rowsPerSec": batchSize / latency if latency > 0 else float("inf")})
+
+    return latencies
+
+def loadMetaGraph(metaGraphPath: str, checkpointPath: str=None):
+    """
+    Imports a meta graph into a new graph and restores its variables from checkpointPath, which
+    defaults to the latest checkpoint in the same directory. Returns the graph and a session.
+    """
+    graph = tf.Graph()
+    session = tf.Session(graph=graph)
+    with graph.as_default():
+        saver = tf.train.import_meta_graph(metaGraphPath)
+        if checkpointPath is None:
+            checkpointPath = tf.train.latest_checkpoint(os.path.dirname(metaGraphPath))
+        saver.restore(session, checkpointPath)
+
+    return graph, session
+
+def loadFrozenGraph(graphPath: str):
+    """
+    Imports a frozen graph into a new graph, files ending in .pbtxt are read as text and others as
+    binary. Returns the graph and a session.
+    """
+    graphDef = tf.GraphDef()
+    if graphPath.endswith(".pbtxt"):
+        with open(graphPath, "r") as f:
+            text_format.Merge(f.read(), graphDef)
+    else:
+        with open(graphPath, "rb") as f:
+            graphDef.ParseFromString(f.read())
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graphDef, name="")
+
+    return graph, tf.Session(graph=graph)
+
+class ModelCostReport:
+    """
+    Reports the cost of running a model: the parameters, FLOPs per row and activation size of each
+    layer, and the latency measured at several batch sizes.
+
+    The static costs are counted from the ops between the input and output tensors. Matrix
+    multiplications and elementwise ops are counted, which covers feedforward networks such as
+    BasicRegressor, and each layer is the name scope of its ops. Use fromRegressor, fromMetaGraph or
+    fromFrozenGraph to construct a report.
+    """
+    def __init__(self, graph, session, inputTensor, outputTensor, batchSize: int=1):
+        self._graph = graph
+        self._session = session
+        self._inputTensor = inputTensor
+        self._outputTensor = outputTensor
+        self._batchSize = batchSize
+        self._latencies = []
+
+        # A sparse input is made of several tensors
+        inputTensors = [inputTensor.indices, inputTensor.values, inputTensor.dense_shape] \
+                       if isinstance(inputTensor, tf.SparseTensor) else [inputTensor]
+        self._layers = self._countLayers(_opsBetween(inputTensors, outputTensor))
+
+    @classmethod
+    def fromRegressor(cls, estimator, batchSize: int=1):
+        """Builds a report for a fitted TFRegressor using its graph and session"""
+        return cls(estimator._graph,
+                   estimator._session,
+                   estimator._tensors.X_in,
+                   estimator._tensors.logits,
+                   batchSize)
+
+    @classmethod
+    def fromMetaGraph(cls,
+                      metaGraphPath: str,
+                      inputName: str,
+                      outputName: str,
+                      checkpointPath: str=None,
+                      batchSize: int=1):
+        """
+        Builds a report for a meta graph, eg. the .ckpt.meta file written by
+        CheckpointAndRestoreHelper. The variables are restored from checkpointPath, which defaults to
+        the latest checkpoint in the same directory.
+        """
+        graph, session = loadMetaGraph(metaGraphPath, checkpointPath)
+
+        return cls(graph,
+                   session,
+                   graph.get_tensor_by_name(inputName),
+                   graph.get_tensor_by_name(outputName),
+                   batchSize)
+
+    @classmethod
+    def fromFrozenGraph(cls, graphPath: str, inputName: str, outputName: str, batchSize: int=1):
+        """
+        Builds a report for a frozen graph, eg. written by freezeProtoBufGraph. Graphs ending in
+        .pbtxt are read as text, others as binary.
+        """
+        graph, session = loadFrozenGraph(graphPath)
+
+        return cls(graph,
+                   session,
+                   graph.get_tensor_by_name(inputName),
+                   graph.get_tensor_by_name(outputName),
+                   batchSize)
+
+    def _countLayers(self, ops: List[tf.Operation]) -> List[Dict[str, Any]]:
+        """Counts the parameters, FLOPs and activations of the ops, grouped by name scope"""
+        layers = OrderedDict()
+        for op in ops:
+            name = op.name.rsplit("/", 1)[0] if "/" in op.name else op.name
+            layer = layers.setdefault(name, {"layer": name,
+                                             "parameters": 0,
+                                             "parameterBytes": 0,
+                                             "flopsPerRow": 0,
+                                             "activationsPerRow": 0,
+                                             "activationBytesPerRow": 0})
+
+            weights = None
+            if op.type == "MatMul":
+                weights = op.inputs[1]
+                transpose = op.get_attr("transpose_b")
+            elif op.type == "SparseTensorDenseMatMul":
+                weights = op.inputs[3]
+                transpose = op.get_attr("adjoint_b")
+
+            if weights is not None:
+                dims = weights.shape.as_list()
+                inputSize, outputSize = (dims[1], dims[0]) if transpose else (dims[0], dims[1])
+
+                # Counts a multiply and an add for each weight, for sparse inputs this is the cost
+                # if every feature is non-zero
+                layer["flopsPerRow"] += 2 * inputSize * outputSize
+                layer["parameters"] += inputSize * outputSize
+                layer["parameterBytes"] += inputSize * outputSize * weights.dtype.size
+            elif op.type in ELEMENTWISE_OPS:
+                layer["flopsPerRow"] += _elementsPerRow(op.outputs[0])
+
+                if op.type == "BiasAdd":
+                    bias = op.inputs[1]
+                    layer["parameters"] += bias.shape.num_elements()
+                    layer["parameterBytes"] += bias.shape.num_elements() * bias.dtype.size
+            else:
+                continue
+
+            # The layer's activation is the output of its last counted op
+            layer["activationsPerRow"] = _elementsPerRow(op.outputs[0])
+            layer["activationBytesPerRow"] = layer["activationsPerRow"] * op.outputs[0].dtype.size
+
+        return [layer for layer in layers.values() if layer["flopsPerRow"] > 0]
+
+    def getLayers(self, batchSize: int=None) -> List[Dict[str, Any]]:
+        """Returns the cost of each layer, with FLOPs and activation bytes for batchSize rows"""
+        batchSize = self._batchSize if batchSize is None else batchSize
+        return [dict(layer,
+                     flops=layer["flopsPerRow"] * batchSize,
+                     activationBytes=layer["activationBytesPerRow"] * batchSize)
+                for layer in self._layers]
+
+    def getTotals(self, batchSize: int=None) -> Dict[str, Any]:
+        """
+        Returns the totals over every layer. estimatedMemoryBytes is the parameters plus every
+        activation for batchSize rows, so is an upper bound for inference.
+        """
+        batchSize = self._batchSize if batchSize is None else batchSize
+        layers = self.getLayers(batchSize)
+        totals = {key: sum(layer[key] for layer in layers)
+                  for key in ["parameters", "parameterBytes", "flopsPerRow", "flops", "activationBytes"]}
+        totals["batchSize"] = batchSize
+        totals["estimatedMemoryBytes"] = totals["parameterBytes"] + totals["activationBytes"]
+
+        return totals
+
+    def measureLatency(self,
+                       batchSizes: List[int]=[1, 32, 256],
+                       warmupRuns: int=3,
+                       measureRuns: int=20) -> List[Dict[str, Any]]:
+        """
+        Measures the median latency of predicting random batches of each size. The input must be
+        dense and have a known number of features.
+        """
+        if isinstance(self._inputTensor, tf.SparseTensor):
+            raise ValueError("Latency can only be measured for models with dense inputs")
+
+        self._latencies = _measureLatencies(self._session,
+                                            self._inputTensor,
+                                            self._outputTensor,
+                                            batchSizes,
+                                            warmupRuns,
+                                            measureRuns)
+
+        return self._latencies
+
+    def toDict(self) -> Dict[str, Any]:
+        """Returns the report, including any latencies that have been measured"""
+        return {"layers": self.getLayers(),
+                "totals": self.getTotals(),
+                "latency": self._latencies}
+
+    def toJSON(self) -> str:
+        """Returns the report from toDict formatted as JSON"""
+        return json.dumps(self.toDict(), indent=2)
+
+    def __str__(self) -> str:
+        table = formatLeaderboard(self.getLayers(), ["layer",
+                                                     "parameters",
+                                                     "flopsPerRow",
+                                                     "flops",
+                                                     "activationBytes"])
+
+        totals = self.getTotals()
+        table += "\n\nParameters: {0} ({1} bytes)\nFLOPs per row: {2}" \
+                 "\nEstimated memory for {3} rows: {4} bytes".format(totals["parameters"],
+                                                                   totals["parameterBytes"],
+                                                                   totals["flopsPerRow"],
+                                                                   totals["batchSize"],
+                                                                   totals["estimatedMemoryBytes"])
+
+        if self._latencies:
+            table += "\n\n" + formatLeaderboard(self._latencies, ["batchSize", "latencyMs", "rowsPerSec"])
+
+        return table
+
+# Activations which can follow a layer in a sparse or numpy export
+EXPORT_ACTIVATIONS = {"Elu": tf.nn.elu,
+                      "Relu": tf.nn.relu,
+                      "Relu6": tf.nn.relu6,
+                      "Selu": tf.nn.selu,
+                      "Sigmoid": tf.sigmoid,
+                      "Softplus": tf.nn.softplus,
+                      "Tanh": tf.tanh}
+
+# Elementwise ops which can be applied to the input before the first layer, eg. to normalize it, and
+# which are folded into the first layer when exporting
+EXPORT_INPUT_OPS = {"Add": np.add,
+                    "Sub": np.subtract,
+                    "Mul": np.multiply}
+
+def _extractDenseLayers(inputTensor, outputTensor) -> List[Dict[str, Any]]:
+    """
+    Returns the kernel and bias tensors, and the activation, of each layer of a feedforward network
+    made of MatMul, BiasAdd and activation ops. The first layer also has the Add, Sub and Mul ops
+    applied to the input before it in "inputOps", as pairs of the op type and its other operand.
+    Raises ValueError for any other op which depends on the input.
+    """
+    if isinstance(inputTensor, tf.SparseTensor):
+        raise ValueError("Only models with dense inputs can be exported")
+
+    layers = []
+    inputOps = []
+    current = inputTensor
+    dependsOnInput = set([inputTensor.op])
+    for op in _opsBetween([inputTensor], outputTensor):
+        # Ops which don't depend on the input produce the weights
+        if not any(tensor.op in dependsOnInput for tensor in op.inputs):
+            continue
+        dependsOnInput.add(op)
+
+        if op.inputs[0] is not current:
+            raise ValueError("{0} is not part of a chain of layers".format(op.name))
+
+        if op.type == "MatMul" and not op.get_attr("transpose_a") and not op.get_attr("transpose_b"):
+            layers.append({"kernel": op.inputs[1], "bias": None, "activation": ""})
+            if len(layers) == 1:
+                layers[0]["inputOps"] = inputOps
+        elif op.type in EXPORT_INPUT_OPS and not layers and op.inputs[1].op not in dependsOnInput:
+            inputOps.append((op.type, op.inputs[1]))
+        elif op.type == "BiasAdd" and layers and layers[-1]["bias"] is None:
+            layers[-1]["bias"] = op.inputs[1]
+        elif op.type in EXPORT_ACTIVATIONS and layers and not layers[-1]["activation"]:
+            layers[-1]["activation"] = op.type
+        else:
+            raise ValueError("{0} ops can't be exported, only MatMul, BiasAdd and activations can, "
+                             "and Add, Sub and Mul before the first layer".format(op.type))
+
+        current = op.outputs[0]
+
+    if current is not outputTensor:
+        raise ValueError("The output doesn't depend on the input through a chain of layers")
+
+    return layers
+
+def _evalDenseLayers(session, inputTensor, outputTensor) -> List[Dict[str, Any]]:
+    """
+    Returns the kernel and bias values, and the activation, of each layer as numpy arrays. The ops
+    applied to the input before the first layer, eg. normalizing it, are folded into the first
+    layer's kernel and bias.
+    """
+    layers = _extractDenseLayers(inputTensor, outputTensor)
+    kernels = session.run([layer["kernel"] for layer in layers])
+    biases = session.run([layer["bias"] for layer in layers if layer["bias"] is not None])
+
+    evaluated = [{"kernel": kernel,
+                  "bias": biases.pop(0) if layer["bias"] is not None else None,
+                  "activation": layer["activation"]}
+                 for layer, kernel in zip(layers, kernels)]
+
+    inputOps = layers[0]["inputOps"] if layers else []
+    if inputOps:
+        first = evaluated[0]
+        numFeatures = first["kernel"].shape[0]
+
+        # The input ops are an affine transform of each feature, x * scale + shift
+        scale = np.ones(numFeatures, dtype=np.float64)
+        shift = np.zeros(numFeatures, dtype=np.float64)
+        operands = session.run([operand for _, operand in inputOps])
+        for (opType, _), operand in zip(inputOps, operands):
+            operand = np.broadcast_to(np.asarray(operand, dtype=np.float64).reshape(-1),
+                                      (numFeatures,))
+            if opType == "Mul":
+                scale, shift = scale * operand, shift * operand
+            else:
+                shift = EXPORT_INPUT_OPS[opType](shift, operand)
+
+        kernel = first["kernel"]
+        bias = np.zeros(kernel.shape[1]) if first["bias"] is None else first["bias"]
+        first["kernel"] = (scale[:, None] * kernel).astype(kernel.dtype)
+        first["bias"] = (bias + shift.dot(kernel)).astype(kernel.dtype)
+
+    return evaluated
+
+def exportSparseModel(estimator, path: str) -> Dict[str, Any]:
+    """
+    Writes the kernels of a fitted TFRegressor to an .npz file in a sparse coordinate form, for
+    models which have been pruned. The model must be a chain of dense layers, eg. BasicRegressor.
+
+    Returns the shape and number of non-zero weights of each layer, along with the bytes needed to
+    store the kernels densely and sparsely.
+    """
+    layers = _evalDenseLayers(estimator._session, estimator._tensors.X_in, estimator._tensors.logits)
+
+    arrays = {"activations": np.array([layer["activation"] for layer in layers])}
+    summary = {"layers": [], "denseBytes": 0, "sparseBytes": 0}
+    for index, layer in enumerate(layers):
+        kernel = layer["kernel"]
+
+        # Stored transposed so the kernel is the sparse operand of tf.sparse_tensor_dense_matmul
+        rows, cols = np.nonzero(kernel.T)
+        arrays["kernelIndices{0}".format(index)] = np.stack([rows, cols], axis=1).astype(np.int32)
+        arrays["kernelValues{0}".format(index)] = kernel.T[rows, cols]
+        arrays["kernelShape{0}".format(index)] = np.array(kernel.T.shape, dtype=np.int64)
+        arrays["bias{0}".format(index)] = layer["bias"] if layer["bias"] is not None \
+                                          else np.zeros(0, dtype=kernel.dtype)
+
+        summary["layers"].append({"shape": list(kernel.shape),
+                                  "nonZero": int(len(rows)),
+                                  "density": len(rows) / kernel.size})
+        summary["denseBytes"] += kernel.nbytes
+        summary["sparseBytes"] += arrays["kernelIndices{0}".format(index)].nbytes + \
+                                  arrays["kernelValues{0}".format(index)].nbytes
+
+    # Written through a file object so numpy doesn't add .npz to the path
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+    return summary
+
+def loadSparseModel(path: str):
+    """
+    Builds a graph from a model written by exportSparseModel, which multiplies by each kernel as a
+    tf.SparseTensor. Returns the graph, a session, the input placeholder and the output tensor.
+    """
+    graph = tf.Graph()
+    with np.load(path) as arrays, graph.as_default():
+        activations = arrays["activations"]
+        numFeatures = int(arrays["kernelShape0"][1])
+        X_in = tf.placeholder(shape=(None, numFeatures), dtype=tf.float32, name="X_in")
+
+        output = X_in
+        for index, activation in enumerate(activations):
+            kernel = tf.SparseTensor(arrays["kernelIndices{0}".format(index)].astype(np.int64),
+                                     arrays["kernelValues{0}".format(index)],
+                                     arrays["kernelShape{0}".format(index)])
+            output = tf.transpose(tf.sparse_tensor_dense_matmul(kernel, output, adjoint_b=True))
+
+            bias = arrays["bias{0}".format(index)]
+            if bias.size:
+                output = tf.nn.bias_add(output, bias)
+
+            if activation:
+                output = EXPORT_ACTIVATIONS[str(activation)](output)
+
+        output = tf.identity(output, name="output")
+
+    return graph, tf.Session(graph=graph), X_in, output
+
+def _freezeRegressor(estimator):
+    """Returns a graph, session, input and output of a fitted TFRegressor with its variables frozen"""
+    graphDef = tf.graph_util.convert_variables_to_constants(estimator._session,
+                                                            estimator._graph.as_graph_def(),
+                                                            [estimator._tensors.logits.op.name])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graphDef, name="")
+
+    return graph, \
+           tf.Session(graph=graph), \
+           graph.get_tensor_by_name(estimator._tensors.X_in.name), \
+           graph.get_tensor_by_name(estimator._tensors.logits.name)
+
+def compareSparseExport(estimator,
+                        path: str,
+                        X,
+                        y=None,
+                        batchSizes: List[int]=[1, 32, 256],
+                        warmupRuns: int=3,
+                        measureRuns: int=20) -> Dict[str, Any]:
+    """
+    Compares the sparse model at path, written by exportSparseModel, with the estimator's frozen
+    dense graph. Both predict X, and the largest absolute difference between their predictions is
+    reported, along with the mean squared error of each if y is provided, and their latencies.
+    """
+    comparison = {}
+    predictions = {}
+    for name, (graph, session, X_in, output) in [("dense", _freezeRegressor(estimator)),
+                                                 ("sparse", loadSparseModel(path))]:
+        with session:
+            predictions[name] = np.reshape(session.run(output, feed_dict={X_in: X}), (X.shape[0], -1))
+            comparison[name] = {"latency": _measureLatencies(session,
+                                                             X_in,
+                                                             output,
+                                                             batchSizes,
+                                                             warmupRuns,
+                                                             measureRuns)}
+
+        if y is not None:
+            errors = predictions[name] - np.reshape(y, (X.shape[0], -1))
+            comparison[name]["mse"] = float(np.mean(np.square(errors)))
+
+    comparison["maxAbsDifference"] = float(np.max(np.abs(predictions["dense"] - predictions["sparse"])))
+
+    return comparison
+
+def exportNumpyWeights(session, inputTensor, outputTensor, path: str) -> Dict[str, Any]:
+    """
+    Writes the kernels, biases and activations of the network between inputTensor and outputTensor
+    to a weight file for NumpyInference.NumpyRegressor. The network must be a chain of dense layers.
+    The session may be from loadMetaGraph or loadFrozenGraph, or a fitted model's session.
+
+    Returns the shape of each kernel and the size of the file in bytes.
+    """
+    layers = _evalDenseLayers(session, inputTensor, outputTensor)
+
+    return {"layers": [{"shape": list(layer["kernel"].shape)} for layer in layers],
+            "fileBytes": writeWeightFile(path, layers)}
+
+def exportNumpyModel(estimator, path: str) -> Dict[str, Any]:
+    """Writes the weights of a fitted TFRegressor for NumpyInference.NumpyRegressor"""
+    return exportNumpyWeights(estimator._session, estimator._tensors.X_in, estimator._tensors.logits, path)
+
+def compareNumpyExport(estimator,
+                       path: str,
+                       X,
+                       tolerance: float=1e-4,
+                       batchSizes: List[int]=[1, 32, 256],
+                       warmupRuns: int=3,
+                       measureRuns: int=20) -> Dict[str, Any]:
+    """
+    Checks that the NumpyRegressor loaded from path predicts the same as the estimator's graph for
+    every row of X, to within tolerance relative to the size of the predictions, and measures the
+    latency of a sess.run and of the numpy forward pass at each batch size.
+    """
+    numpyModel = NumpyRegressor(path)
+    tensors = estimator._tensors
+
+    tfPredictions = estimator._session.run(tensors.logits, feed_dict={tensors.X_in: X})
+    numpyPredictions = numpyModel.predict(X)
+
+    maxAbsDifference = float(np.max(np.abs(tfPredictions - numpyPredictions)))
+    scale = max(float(np.max(np.abs(tfPredictions))), 1.0)
+
+    return {"maxAbsDifference": maxAbsDifference,
+            "withinTolerance": maxAbsDifference <= tolerance * scale,
+            "tensorflow": _measureLatencies(estimator._session,
+                                            tensors.X_in,
+                                            tensors.logits,
+                                            batchSizes,
+                                            warmupRuns,
+                                            measureRuns),
+            "numpy": _measureCallLatencies(numpyModel.predict,
+                                           numpyModel.getNumFeatures(),
+                                           np.float32,
+                                           batchSizes,
+                                           warmupRuns,
+                                           measureRuns)}
+
+def main() -> None:
+    """Prints the cost report of a meta graph or frozen graph"""
+    parser = argparse.ArgumentParser(description="Reports the cost of running a model")
+    parser.add_argument("graphPath", help="A .meta file, or a frozen .pb or .pbtxt file")
+    parser.add_argument("--input", default="inputs/X_in:0")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--batchSize", type=int, default=1)
+    parser.add_argument("--latencyBatchSizes", type=int, nargs="*", default=[1, 32, 256])
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--numpyExport", help="Also write a weight file for NumpyInference to this path")
+    args = parser.parse_args()
+
+    if args.graphPath.endswith(".meta"):
+        report = ModelCostReport.fromMetaGraph(args.graphPath, args.input, args.output,
+                                               batchSize=args.batchSize)
+    else:
+        report = ModelCostReport.fromFrozenGraph(args.graphPath, args.input, args.output,
+                                                 args.batchSize)
+
+    if args.latencyBatchSizes:
+        report.measureLatency(args.latencyBatchSizes)
+
+    print(report.toJSON() if args.json else str(report))
+
+    if args.numpyExport:
+        exportNumpyWeights(report._session, report._inputTensor, report._outputTensor, args.numpyExport)
+
+if __name__ == "__main__":
+    main()
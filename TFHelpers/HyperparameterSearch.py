@@ -0,0 +1,120 @@
+"""
+Searches over the hyperparameters of TFRegressor models, spending less time on configurations which
+are clearly performing badly.
+"""
+
+from typing import List
+
+import numpy as np
+
+from sklearn.base import clone
+
+from TFHelpers.LogAggregation import formatLeaderboard
+from TFHelpers.ScikitWrapper import TFRegressor
+
+class SuccessiveHalvingSearch:
+    """
+    Trains every model for a small number of epochs, keeps the best 1 / reductionFactor of them by
+    validation loss, and continues training the survivors from their checkpoints for
+    reductionFactor times as many epochs. This repeats until a single rung of training reaches
+    maxEpochs.
+
+    Survivors are continued by restoring their run directory, so no epochs are repeated and each
+    model keeps a single tensorboard log and run index entry. Each model must have different
+    hyperparameters so that each has its own run directory.
+    """
+    def __init__(self,
+                 estimators: List[TFRegressor],
+                 minEpochs: int=1,
+                 maxEpochs: int=27,
+                 reductionFactor: int=3):
+        if reductionFactor < 2:
+            raise ValueError("reductionFactor must be at least 2")
+
+        if minEpochs < 1 or maxEpochs < minEpochs:
+            raise ValueError("minEpochs must be at least 1 and no larger than maxEpochs")
+
+        if any(estimator.restoreFrom is not None for estimator in estimators):
+            raise ValueError("The models must not be restored from a previous run")
+
+        modelNames = [estimator._buildModelNameStr() for estimator in estimators]
+        if len(set(modelNames)) < len(modelNames):
+            raise ValueError("Each model must have different hyperparameters")
+
+        self._estimators = estimators
+        self._minEpochs = minEpochs
+        self._maxEpochs = maxEpochs
+        self._reductionFactor = reductionFactor
+
+        self.results = []
+        self.bestEstimator = None
+
+    def getRungEpochs(self) -> List[int]:
+        """Returns the total number of epochs each surviving model will have trained for by each rung"""
+        rungEpochs = []
+        numEpochs = self._minEpochs
+        while numEpochs < self._maxEpochs:
+            rungEpochs.append(numEpochs)
+            numEpochs *= self._reductionFactor
+
+        return rungEpochs + [self._maxEpochs]
+
+    def fit(self, X, y, X_valid, y_valid, **fitParams) -> TFRegressor:
+        """
+        Runs the search and returns the best model, which is also available as bestEstimator. Any
+        keyword arguments are passed to the fit method of each model.
+
+        The sessions of models which are pruned are closed to free their memory, but their files are
+        kept so they can be restored later.
+        """
+        self.results = []
+        active = list(self._estimators)
+
+        for rung, numEpochs in enumerate(self.getRungEpochs()):
+            losses = []
+            for index, estimator in enumerate(active):
+                if rung > 0:
+                    # Continue from the previous rung's checkpoint in the same run directory
+                    resumed = clone(estimator).set_params(
+                        restoreFrom=estimator._fileManager.getRunName())
+                    estimator._closeSession()
+                    estimator = active[index] = resumed
+
+                estimator.fit(X, y, X_valid, y_valid, numEpochs, **fitParams)
+
+                lossVal = self._getBestLossVal(estimator)
+                losses.append(lossVal)
+                self.results.append({"modelName": estimator._fileManager.getModelName(),
+                                     "run": estimator._fileManager.getRunName(),
+                                     "rung": rung,
+                                     "epochs": numEpochs,
+                                     "bestLossVal": lossVal})
+
+            order = np.argsort(losses, kind="stable")
+            numSurvivors = max(len(active) // self._reductionFactor, 1)
+            for index in order[numSurvivors:]:
+                active[index]._closeSession()
+
+            active = [active[index] for index in order[:numSurvivors]]
+            print("Rung {0} complete, {1} models continue".format(rung, len(active)))
+
+        self.bestEstimator = active[0]
+
+        return self.bestEstimator
+
+    def getTotalEpochs(self) -> int:
+        """Returns the number of epochs trained over every model, given no model stopped early"""
+        rungEpochs = self.getRungEpochs()
+        return sum(result["epochs"] - (rungEpochs[result["rung"] - 1] if result["rung"] > 0 else 0)
+                   for result in self.results)
+
+    def __str__(self) -> str:
+        return formatLeaderboard(self.results, ["modelName", "run", "rung", "epochs", "bestLossVal"])
+
+    def _getBestLossVal(self, estimator: TFRegressor) -> float:
+        """Returns the best validation loss of a run recorded in the run index"""
+        fileManager = estimator._fileManager
+        run = fileManager.getRunIndex().readRuns().get(
+            fileManager.getModelName() + "/" + fileManager.getRunName(), {})
+
+        return np.inf if run.get("bestLossVal") is None else run["bestLossVal"]
@@ -0,0 +1,219 @@
+"""
+Tools for comparing many training runs by reading their tensorboard logs directly, rather than
+loading every run into tensorboard.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+import tensorflow as tf
+
+DEFAULT_METRICS = ["LossTrain", "LossVal", "BatchTimeAvg"]
+
+def _normaliseTag(tag: str) -> str:
+    """
+    Strips the name scope and any suffix tensorflow added to make the summary name unique.
+    eg: TensorboardLogHelper/LossVal_1 -> LossVal
+    """
+    return re.sub(r"_\d+$", "", tag.split("/")[-1])
+
+def _parseEventFile(path: str, metrics: List[str]) -> Dict[str, List[List[float]]]:
+    """
+    Reads the scalar summaries in metrics from a single event file. Returns a dict of metric name to
+    a list of [step, value] pairs.
+    """
+    series = {metric: [] for metric in metrics}
+
+    try:
+        for event in tf.train.summary_iterator(path):
+            for value in event.summary.value:
+                if not value.HasField("simple_value"):
+                    continue
+
+                metric = _normaliseTag(value.tag)
+                if metric in series:
+                    series[metric].append([event.step, value.simple_value])
+    except tf.errors.DataLossError:
+        # The run may still be writing this file, keep whatever was complete
+        pass
+
+    return series
+
+class EventFileAggregator:
+    """
+    Reads the event files written by TensorboardLogHelper for every run in a models directory and
+    builds a leaderboard of the runs.
+
+    Event files are parsed in parallel worker processes, and the parsed results are cached by file
+    size and modification time so only new or changed files are read on subsequent calls.
+    """
+    CACHE_FILENAME = ".eventCache.json"
+
+    def __init__(self,
+                 modelsDir: str,
+                 metrics: List[str]=None,
+                 numWorkers: int=None,
+                 cachePath: str=None):
+        self._modelsDir = modelsDir
+        self._metrics = DEFAULT_METRICS if metrics is None else metrics
+        self._numWorkers = numWorkers
+        self._cachePath = os.path.join(modelsDir, self.CACHE_FILENAME) if cachePath is None \
+                          else cachePath
+
+    def _loadCache(self) -> Dict[str, Any]:
+        """Returns the cached parsed files, discarding the cache if it is unreadable"""
+        cache = {}
+        if os.path.isfile(self._cachePath):
+            try:
+                with open(self._cachePath, "r") as f:
+                    cache = json.load(f)
+            except ValueError:
+                cache = {}
+
+        return cache
+
+    def _saveCache(self, cache: Dict[str, Any]) -> None:
+        """Writes the cache to a temporary file first so a reader never sees a partial file"""
+        tempPath = self._cachePath + ".tmp"
+        with open(tempPath, "w") as f:
+            json.dump(cache, f)
+
+        os.replace(tempPath, self._cachePath)
+
+    def _parseEventFiles(self, eventFiles: List[str]) -> Dict[str, Dict[str, List[List[float]]]]:
+        """Returns the parsed series for each file, only reading files which have changed"""
+        cache = self._loadCache()
+
+        staleFiles = []
+        for path in eventFiles:
+            stat = os.stat(path)
+            cached = cache.get(path)
+            if cached is None or cached["size"] != stat.st_size or cached["mtime"] != stat.st_mtime:
+                staleFiles.append((path, stat))
+
+        if staleFiles:
+            with ProcessPoolExecutor(max_workers=self._numWorkers) as executor:
+                parsed = executor.map(_parseEventFile,
+                                      [path for path, _ in staleFiles],
+                                      [self._metrics] * len(staleFiles))
+
+                for (path, stat), series in zip(staleFiles, parsed):
+                    cache[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "series": series}
+
+        # Drop files which no longer exist
+        cache = {path: cache[path] for path in eventFiles}
+        self._saveCache(cache)
+
+        return {path: cache[path]["series"] for path in eventFiles}
+
+    def aggregate(self) -> List[Dict[str, Any]]:
+        """
+        Returns one row per run containing the run's location and a summary of its metrics. Rows are
+        not sorted, use sortLeaderboard for this.
+        """
+        eventFiles = sorted(glob.glob(os.path.join(self._modelsDir, "*", "*", "events.out.tfevents.*")))
+        parsedFiles = self._parseEventFiles(eventFiles)
+
+        # A restored run writes a new event file into the same directory, so group files by their
+        # directory and let later files override earlier ones for the same step
+        runSeries = {}
+        for path in eventFiles:
+            logDir = os.path.dirname(path)
+            merged = runSeries.setdefault(logDir, {metric: {} for metric in self._metrics})
+            for metric, points in parsedFiles[path].items():
+                if metric in merged:
+                    merged[metric].update({int(step): value for step, value in points})
+
+        return [self._buildRow(logDir, series) for logDir, series in runSeries.items()]
+
+    def _buildRow(self, logDir: str, series: Dict[str, Dict[int, float]]) -> Dict[str, Any]:
+        """Summarises the metrics of a single run"""
+        row = {"modelName": os.path.basename(os.path.dirname(logDir)),
+               "run": os.path.basename(logDir),
+               "logDir": logDir,
+               "epochs": max([len(points) for points in series.values()] + [0])}
+
+        for metric, points in series.items():
+            values = [points[step] for step in sorted(points.keys())]
+            row["final" + metric] = values[-1] if values else None
+
+            if metric.startswith("Loss"):
+                row["best" + metric] = min(values) if values else None
+            else:
+                row["mean" + metric] = float(np.mean(values)) if values else None
+
+        return row
+
+def sortLeaderboard(rows: List[Dict[str, Any]],
+                    sortKey: str="bestLossVal",
+                    descending: bool=False) -> List[Dict[str, Any]]:
+    """Sorts the rows by the given column, rows without a value for the column are placed last"""
+    present = [row for row in rows if row.get(sortKey) is not None]
+    missing = [row for row in rows if row.get(sortKey) is None]
+
+    return sorted(present, key=lambda row: row[sortKey], reverse=descending) + missing
+
+def filterLeaderboard(rows: List[Dict[str, Any]],
+                      predicate: Callable[[Dict[str, Any]], bool]=None,
+                      top: int=None) -> List[Dict[str, Any]]:
+    """Keeps the rows matching predicate, and then at most the first top rows"""
+    if predicate is not None:
+        rows = [row for row in rows if predicate(row)]
+
+    return rows if top is None else rows[:top]
+
+def formatLeaderboard(rows: List[Dict[str, Any]], columns: List[str]=None) -> str:
+    """Returns the rows formatted as a plain text table"""
+    if columns is None:
+        columns = ["modelName", "run", "epochs", "bestLossVal", "finalLossVal", "finalLossTrain",
+                   "meanBatchTimeAvg"]
+
+    def formatValue(value):
+        return "{0:.6g}".format(value) if isinstance(value, float) else str(value)
+
+    cells = [columns] + [[formatValue(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(line[index]) for line in cells) for index in range(len(columns))]
+
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths))
+                     for line in cells)
+
+def buildLogdirList(rows: List[Dict[str, Any]]) -> str:
+    """
+    Returns a value for tensorboard's --logdir argument containing only the given runs, with each
+    run named by its model name and run name.
+    """
+    return ",".join("{0}/{1}:{2}".format(row["modelName"], row["run"], row["logDir"])
+                    for row in rows)
+
+def main() -> None:
+    """Prints a leaderboard of the runs in a models directory"""
+    parser = argparse.ArgumentParser(description="Builds a leaderboard from tensorboard logs")
+    parser.add_argument("modelsDir", nargs="?", default="models")
+    parser.add_argument("--sort", default="bestLossVal")
+    parser.add_argument("--descending", action="store_true")
+    parser.add_argument("--top", type=int, default=None)
+    parser.add_argument("--model", default=None, help="Only include runs whose model name contains this")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    rows = EventFileAggregator(args.modelsDir, numWorkers=args.workers).aggregate()
+    rows = sortLeaderboard(rows, args.sort, args.descending)
+
+    predicate = None
+    if args.model is not None:
+        predicate = lambda row: args.model in row["modelName"]
+    rows = filterLeaderboard(rows, predicate, args.top)
+
+    print(formatLeaderboard(rows))
+    print()
+    print("tensorboard --logdir=" + buildLogdirList(rows))
+
+if __name__ == "__main__":
+    main()
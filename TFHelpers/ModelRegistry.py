@@ -0,0 +1,314 @@
+"""
+Serves predictions from many trained models, keeping the most recently used models loaded.
+"""
+
+from collections import OrderedDict
+import glob
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+import tensorflow as tf
+
+from TFHelpers.FilesAndLogging import FileManager, findBestCheckpoint, RunIndex
+from TFHelpers.GraphTools import loadFrozenGraph, loadMetaGraph
+
+class _LoadedModel:
+    """A model held by ModelRegistry, its session is closed once it's evicted and no longer in use"""
+    def __init__(self, key, graph, session, inputTensor, outputTensor, numBytes):
+        self.key = key
+        self.graph, self.session = graph, session
+        self.inputTensor, self.outputTensor = inputTensor, outputTensor
+        self.numBytes = numBytes
+        self.users = 0
+        self.evicted = False
+
+class _PendingLoad:
+    """A load in progress, which other threads requesting the same model wait for"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+        self.waiters = 0
+
+class ModelRegistry:
+    """
+    Serves predictions from many models, loading each on demand and keeping the most recently used
+    models loaded within a memory budget. The least recently used models are evicted when the budget
+    or maxModels is exceeded.
+
+    Models are found by key in the layout created by FileManager, where the key is
+    "<modelName>/<run>", or "<modelName>" for its latest run. The run's best checkpoint is loaded,
+    or a frozen .pb graph if the run has no checkpoints. Use register to serve a meta graph or
+    frozen graph from elsewhere.
+
+    The memory used by each model is estimated from the size of its files. Concurrent requests for a
+    model which isn't loaded share a single load, and models are only closed once no prediction is
+    using them, so the registry can be used from several threads.
+    """
+    def __init__(self,
+                 modelsDir: str="models",
+                 maxBytes: int=1024 ** 3,
+                 maxModels: int=None,
+                 inputName: str="inputs/X_in:0",
+                 outputName: str=None):
+        if maxBytes <= 0:
+            raise ValueError("maxBytes must be larger than zero")
+
+        if maxModels is not None and maxModels < 1:
+            raise ValueError("maxModels must be at least 1")
+
+        self._modelsDir = modelsDir
+        self._maxBytes = maxBytes
+        self._maxModels = maxModels
+        self._inputName = inputName
+        self._outputName = outputName
+
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+        self._pendingLoads = {}
+        self._registered = {}
+        self._currentBytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.sharedLoads = 0
+        self.evictions = 0
+        self.loadFailures = 0
+        self._loadSeconds = []
+
+    def register(self, key: str, path: str, inputName: str=None, outputName: str=None) -> None:
+        """
+        Serves the meta graph or frozen graph at path as key, restoring a meta graph from the latest
+        checkpoint in its directory. inputName and outputName default to the registry's.
+
+        A model already loaded for key is evicted. A load of key which is still in progress only
+        serves the requests already waiting for it, later requests load the model from path.
+        """
+        with self._lock:
+            self._registered[key] = (path, inputName, outputName)
+
+            # The loading thread checks whether its load is still pending before adding the model
+            self._pendingLoads.pop(key, None)
+
+            if key in self._models:
+                self._evictLocked(key)
+
+    def predict(self, key: str, X) -> np.ndarray:
+        """Returns the predictions of the model for X, loading the model first if needed"""
+        model = self._acquire(key)
+        try:
+            return model.session.run(model.outputTensor, feed_dict={model.inputTensor: X})
+        finally:
+            self._release(model)
+
+    def preload(self, key: str) -> None:
+        """Loads a model if it isn't already loaded, eg. to warm up the registry"""
+        self._release(self._acquire(key))
+
+    def isLoaded(self, key: str) -> bool:
+        """Returns whether the model is currently loaded"""
+        with self._lock:
+            return key in self._models
+
+    def evict(self, key: str) -> None:
+        """Unloads a model if it's loaded"""
+        with self._lock:
+            if key in self._models:
+                self._evictLocked(key)
+
+    def close(self) -> None:
+        """Unloads every model"""
+        with self._lock:
+            for key in list(self._models.keys()):
+                self._evictLocked(key)
+
+    def getStats(self) -> Dict[str, Any]:
+        """
+        Returns the counters, the time taken to load models, and the models currently loaded. Requests
+        which waited for another thread's load of the same model are counted in sharedLoads rather
+        than misses.
+        """
+        with self._lock:
+            requests = self.hits + self.misses + self.sharedLoads
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "sharedLoads": self.sharedLoads,
+                    "evictions": self.evictions,
+                    "loadFailures": self.loadFailures,
+                    "hitRate": self.hits / requests if requests else 0.0,
+                    "loads": len(self._loadSeconds),
+                    "meanLoadSeconds": float(np.mean(self._loadSeconds)) if self._loadSeconds else 0.0,
+                    "maxLoadSeconds": max(self._loadSeconds, default=0.0),
+                    "models": list(self._models.keys()),
+                    "bytes": self._currentBytes,
+                    "maxBytes": self._maxBytes}
+
+    def _acquire(self, key: str) -> _LoadedModel:
+        """Returns the model for key marked as in use, loading it or waiting for its load if needed"""
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                self._models.move_to_end(key)
+                model.users += 1
+                return model
+
+            pending = self._pendingLoads.get(key)
+            isLoader = pending is None
+            if isLoader:
+                self.misses += 1
+                pending = self._pendingLoads[key] = _PendingLoad()
+            else:
+                self.sharedLoads += 1
+                pending.waiters += 1
+
+        if isLoader:
+            return self._loadPending(key, pending)
+
+        # The loading thread marks the model as in use for each waiter
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+        return pending.model
+
+    def _loadPending(self, key: str, pending: _PendingLoad) -> _LoadedModel:
+        """
+        Loads a model outside of the registry's lock, adds it to the registry and returns it marked
+        as in use by this thread and every thread waiting for it
+        """
+        try:
+            start = time.perf_counter()
+            model = self._load(key)
+            loadSeconds = time.perf_counter() - start
+        except Exception as err:
+            with self._lock:
+                self.loadFailures += 1
+                if self._pendingLoads.get(key) is pending:
+                    del self._pendingLoads[key]
+            pending.error = err
+            pending.done.set()
+            raise
+
+        with self._lock:
+            self._loadSeconds.append(loadSeconds)
+
+            # No more threads can wait once the load is removed from the pending loads, so the
+            # model can't be closed before each of them has used it
+            model.users += 1 + pending.waiters
+
+            if self._pendingLoads.get(key) is not pending:
+                # The key was registered to a new path during the load, so the model is closed once
+                # the requests which were waiting for it have used it
+                model.evicted = True
+            else:
+                del self._pendingLoads[key]
+                self._models[key] = model
+                self._currentBytes += model.numBytes
+
+                # The new model is kept even if it's larger than the budget by itself
+                while len(self._models) > 1 and (self._currentBytes > self._maxBytes or
+                                                 (self._maxModels is not None and
+                                                  len(self._models) > self._maxModels)):
+                    self._evictLocked(next(iter(self._models)))
+
+        pending.model = model
+        pending.done.set()
+
+        return model
+
+    def _release(self, model: _LoadedModel) -> None:
+        """Marks a model as no longer in use by a caller, closing it if it has been evicted"""
+        with self._lock:
+            model.users -= 1
+            if model.evicted and model.users == 0:
+                model.session.close()
+
+    def _evictLocked(self, key: str) -> None:
+        """Removes a model from the registry, must be called while holding the lock"""
+        model = self._models.pop(key)
+        self._currentBytes -= model.numBytes
+        self.evictions += 1
+
+        model.evicted = True
+        if model.users == 0:
+            model.session.close()
+
+    def _load(self, key: str) -> _LoadedModel:
+        """Loads the graph and session of a model"""
+        path, checkpointPath, inputName, outputName = self._findModel(key)
+
+        if path.endswith(".meta"):
+            graph, session = loadMetaGraph(path, checkpointPath)
+            numBytes = os.path.getsize(path) + sum(os.path.getsize(filePath)
+                                                   for filePath in glob.glob(checkpointPath + ".*"))
+        else:
+            graph, session = loadFrozenGraph(path)
+            numBytes = os.path.getsize(path)
+
+        inputName = self._inputName if inputName is None else inputName
+        outputName = self._outputName if outputName is None else outputName
+        try:
+            inputTensor = graph.get_tensor_by_name(inputName)
+            if outputName is not None:
+                outputTensor = graph.get_tensor_by_name(outputName)
+            elif graph.get_collection("logits"):
+                outputTensor = graph.get_collection("logits")[0]
+            else:
+                raise ValueError("{0} has no logits collection, so an outputName must be "
+                                 "provided".format(key))
+        except Exception:
+            session.close()
+            raise
+
+        # Nothing is added to a served graph, which makes it safe to share between threads
+        graph.finalize()
+
+        return _LoadedModel(key, graph, session, inputTensor, outputTensor, numBytes)
+
+    def _findModel(self, key: str) -> Tuple[str, str, str, str]:
+        """
+        Returns the path to the meta graph or frozen graph for key, the checkpoint of a meta graph,
+        and the input and output names, which are None for the defaults
+        """
+        with self._lock:
+            registered = self._registered.get(key)
+
+        if registered is not None:
+            path, inputName, outputName = registered
+            checkpointPath = tf.train.latest_checkpoint(os.path.dirname(path)) \
+                             if path.endswith(".meta") else None
+            return path, checkpointPath, inputName, outputName
+
+        modelDir = os.path.join(self._modelsDir, key)
+        if "/" not in key.strip("/") and os.path.isdir(modelDir):
+            # The run directories are named by their start time, so the latest sorts last
+            runs = sorted(run for run in os.listdir(modelDir)
+                          if os.path.isdir(os.path.join(modelDir, run)))
+            if runs:
+                modelDir = os.path.join(modelDir, runs[-1])
+
+        # The prefix used by FileManager.getModelDirAndPrefix
+        modelRootPath = os.path.join(modelDir, "model")
+        if os.path.isfile(modelRootPath + ".ckpt.meta"):
+            checkpointPath = findBestCheckpoint(modelRootPath)
+            if checkpointPath is not None:
+                # Runs trained by a ReplicatedRegressorTrainer record which tensors are their own
+                runIndex = RunIndex(os.path.join(self._modelsDir, FileManager.RUN_INDEX_FILENAME))
+                run = runIndex.readRuns().get(
+                    pathlib.Path(os.path.relpath(modelDir, self._modelsDir)).as_posix(), {})
+
+                return modelRootPath + ".ckpt.meta", checkpointPath, run.get("inputName"), \
+                       run.get("outputName")
+
+        frozenGraphs = sorted(glob.glob(os.path.join(modelDir, "*.pb")))
+        if frozenGraphs:
+            return frozenGraphs[0], None, None, None
+
+        raise KeyError("No checkpoint or frozen graph was found for {0} in {1}".format(
+            key, self._modelsDir))
@@ -0,0 +1,153 @@
+"""
+Runs dense feedforward models exported by GraphTools.exportNumpyModel using only numpy, for
+latency critical predictions of a few rows where the overhead of a tensorflow session dominates.
+Tensorflow is not imported by this module.
+"""
+
+import json
+import os
+import struct
+from typing import Any, Dict, List
+
+import numpy as np
+
+# Identifies the file format, the last character is the version
+FILE_MAGIC = b"TFHNPY1\n"
+
+# Each array starts on a multiple of this many bytes from the start of the file
+ALIGNMENT = 64
+
+_HEADER_LENGTH_FORMAT = "<Q"
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+def _relu6(x):
+    return np.clip(x, 0, 6, out=x)
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(x))
+
+def _selu(x):
+    # The constants used by tf.nn.selu
+    return 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(x))
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def _softplus(x):
+    return np.logaddexp(0, x)
+
+# Keyed by the type of the tensorflow op each function replaces
+ACTIVATIONS = {"Elu": _elu,
+               "Relu": _relu,
+               "Relu6": _relu6,
+               "Selu": _selu,
+               "Sigmoid": _sigmoid,
+               "Softplus": _softplus,
+               "Tanh": np.tanh}
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def writeWeightFile(path: str, layers: List[Dict[str, Any]]) -> int:
+    """
+    Writes the layers of a feedforward network to a weight file, and returns its size in bytes.
+    Each layer is a dict of its "kernel", its "bias" or None, and the name of its "activation" in
+    ACTIVATIONS, or an empty string for none.
+
+    The file is the magic string, the length of a JSON header, the header, and then the float32
+    arrays each aligned to ALIGNMENT bytes so they can be memory mapped.
+    """
+    arrays = []
+    layerHeaders = []
+    offset = 0
+    for layer in layers:
+        if layer["activation"] and layer["activation"] not in ACTIVATIONS:
+            raise ValueError("Unsupported activation {0}".format(layer["activation"]))
+
+        layerHeader = {"activation": layer["activation"]}
+        for name in ["kernel", "bias"]:
+            if layer[name] is None:
+                layerHeader[name] = None
+                continue
+
+            array = np.ascontiguousarray(layer[name], dtype="<f4")
+            layerHeader[name] = {"offset": offset, "shape": list(array.shape)}
+            arrays.append((offset, array))
+            offset = _align(offset + array.nbytes)
+
+        layerHeaders.append(layerHeader)
+
+    header = json.dumps({"dtype": "<f4", "layers": layerHeaders}).encode()
+    dataStart = _align(len(FILE_MAGIC) + struct.calcsize(_HEADER_LENGTH_FORMAT) + len(header))
+
+    # Written to a temporary file first so a reader never maps a partial file
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as f:
+        f.write(FILE_MAGIC)
+        f.write(struct.pack(_HEADER_LENGTH_FORMAT, len(header)))
+        f.write(header)
+        for arrayOffset, array in arrays:
+            f.seek(dataStart + arrayOffset)
+            f.write(array.tobytes())
+
+        # Pads the file to the end of the last array
+        f.truncate(dataStart + offset)
+    os.replace(tempPath, path)
+
+    return dataStart + offset
+
+class NumpyRegressor:
+    """
+    Predicts with a model from a weight file written by writeWeightFile, usually through
+    GraphTools.exportNumpyModel. The file is memory mapped, so its pages are shared between
+    processes which load the same model and only read from disk when first used.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError("{0} is not a weight file written by writeWeightFile".format(path))
+
+            headerLength, = struct.unpack(_HEADER_LENGTH_FORMAT,
+                                          f.read(struct.calcsize(_HEADER_LENGTH_FORMAT)))
+            header = json.loads(f.read(headerLength).decode())
+
+        dataStart = _align(len(FILE_MAGIC) + struct.calcsize(_HEADER_LENGTH_FORMAT) + headerLength)
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+        def view(array):
+            if array is None:
+                return None
+
+            return np.ndarray(array["shape"],
+                              dtype=header["dtype"],
+                              buffer=self._buffer,
+                              offset=dataStart + array["offset"])
+
+        self._layers = [(view(layer["kernel"]),
+                         view(layer["bias"]),
+                         ACTIVATIONS[layer["activation"]] if layer["activation"] else None)
+                        for layer in header["layers"]]
+
+    def getNumFeatures(self) -> int:
+        """Returns the number of features the model expects"""
+        return self._layers[0][0].shape[0]
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Returns the predictions for each row of X as a float32 array with a column for each output.
+        A single row may be provided as a 1D array.
+        """
+        output = np.asarray(X, dtype=np.float32)
+        if output.ndim == 1:
+            output = output[np.newaxis, :]
+
+        for kernel, bias, activation in self._layers:
+            output = np.dot(output, kernel)
+            if bias is not None:
+                output += bias
+            if activation is not None:
+                output = activation(output)
+
+        return output
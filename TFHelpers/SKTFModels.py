@@ -4,7 +4,10 @@ Example implementations of tensorflow models using the Scikit Wrapper.
 
 import tensorflow as tf
 
-from TFHelpers.ScikitWrapper import RegressorTensors, TFRegressor
+from TFHelpers.FilesAndLogging import HISTOGRAM_SUMMARIES
+from TFHelpers.ScikitWrapper import GradientAccumulationTensors, ImportanceSamplingTensors, \
+                                    MultiStepTensors, NormalizationTensors, RegressorTensors, \
+                                    StreamingMetricsTensors, TFRegressor
 
 class BasicRegressor(TFRegressor):
     """
@@ -16,9 +19,20 @@ class BasicRegressor(TFRegressor):
                  initializer=tf.contrib.layers.variance_scaling_initializer(),
                  dropoutRate=0.01,
                  restoreFrom=None,
-                 hiddenNeuronsList=[10]):
+                 hiddenNeuronsList=[10],
+                 sparseInput=False,
+                 accumulationSteps=1,
+                 normalizeInputs=False,
+                 multiStepTraining=False,
+                 importanceSampling=False,
+                 applyDropout=False):
 
         self.hiddenNeuronsList = hiddenNeuronsList
+        self.sparseInput = sparseInput
+        self.normalizeInputs = normalizeInputs
+        self.multiStepTraining = multiStepTraining
+        self.importanceSampling = importanceSampling
+        self.applyDropout = applyDropout
 
         TFRegressor.__init__(self,
                              learningRate,
@@ -26,63 +40,352 @@ class BasicRegressor(TFRegressor):
                              initializer,
                              dropoutRate,
                              restoreFrom,
-                             1)
+                             1,
+                             accumulationSteps)
 
-    def _buildGraph(self, numFeatures):
-        """Builds the graph using the default graph"""
+    def _buildSparseDense(self, X, numFeatures, units, name):
+        """
+        Equivalent to tf.layers.dense for a tf.SparseTensor input, so that the cost scales with the
+        number of non-zero values rather than the number of features.
+        """
+        with tf.variable_scope(name, reuse=tf.AUTO_REUSE):
+            kernel = tf.get_variable("kernel",
+                                     shape=(numFeatures, units),
+                                     initializer=self.initializer)
+            bias = tf.get_variable("bias", shape=(units,), initializer=tf.zeros_initializer())
+
+        return tf.nn.bias_add(tf.sparse_tensor_dense_matmul(X, kernel), bias)
+
+    def _getNormalizationVariables(self, numFeatures):
+        """Returns the variables holding the mean and variance of each feature"""
+        with tf.variable_scope("normalization", reuse=tf.AUTO_REUSE):
+            mean = tf.get_variable("mean",
+                                   shape=(numFeatures,),
+                                   initializer=tf.zeros_initializer(),
+                                   trainable=False)
+            variance = tf.get_variable("variance",
+                                       shape=(numFeatures,),
+                                       initializer=tf.ones_initializer(),
+                                       trainable=False)
 
-        with tf.name_scope("inputs"):
-            X_in = tf.placeholder(shape=(None, numFeatures), dtype=tf.float32, name="X_in")
-            y_in = tf.placeholder(shape=(None), dtype=tf.float32, name="y_in")
+        return mean, variance
 
-        with tf.name_scope("dnn"):
-            # We don't implement dropout in this model, but we need to provide a placeholder for it
-            # anyway
-            dropoutKeepProb = tf.placeholder_with_default(1.0, shape=(), name="keep_prob")
+    def _getLayerNames(self):
+        """Returns the variable scope of each layer, the output layer is last"""
+        return ["dense" if layer == 0 else "dense_{0}".format(layer)
+                for layer in range(len(self.hiddenNeuronsList))] + ["logits"]
 
-            layerOutput = X_in
-            for numNeurons in self.hiddenNeuronsList:
+    def _getPrunableKernels(self, graph, scope=""):
+        """
+        Returns the kernel of each layer. They're found by name so that this also works for restored
+        graphs, where tf.get_variable can't find them.
+        """
+        variables = {var.op.name: var for var in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)}
+        return [variables[scope + name + "/kernel"] for name in self._getLayerNames()]
+
+    def _buildNetwork(self, X, numFeatures, keepProb=None):
+        """
+        Builds the layers of the network and returns the logits. If keepProb is provided, dropout is
+        applied with it to the output of each hidden layer. Calling this again reuses the existing
+        variables.
+        """
+        if self.normalizeInputs:
+            mean, variance = self._getNormalizationVariables(numFeatures)
+            X = (X - mean) * tf.rsqrt(variance + 1e-8)
+
+        layerSizes = self.hiddenNeuronsList + [1]
+
+        layerOutput = X
+        for layer, (name, numNeurons) in enumerate(zip(self._getLayerNames(), layerSizes)):
+            if layer == 0 and self.sparseInput:
+                layerOutput = self._buildSparseDense(layerOutput, numFeatures, numNeurons, name)
+            else:
                 layerOutput = tf.layers.dense(layerOutput,
                                               numNeurons,
-                                              kernel_initializer=self.initializer)
+                                              kernel_initializer=self.initializer,
+                                              name=name,
+                                              reuse=tf.AUTO_REUSE)
+
+            if keepProb is not None and layer < len(self.hiddenNeuronsList):
+                layerOutput = tf.nn.dropout(layerOutput, keepProb)
+
+        return layerOutput
+
+    def _buildGraph(self, numFeatures):
+        """Builds the graph using the default graph"""
+        if self.normalizeInputs and self.sparseInput:
+            raise ValueError("normalizeInputs can't be used with sparseInput, as centering the "
+                             "features would make them dense")
+
+        if self.multiStepTraining and self.sparseInput:
+            raise ValueError("multiStepTraining can't be used with sparseInput, as the multi step "
+                             "loop slices its input by rows")
+
+        X_in, y_in = self._buildInputs(numFeatures, self.sparseInput)
+
+        # Resource variables are needed so that each iteration of the multi step training loop
+        # reads the values written by the previous iteration
+        with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+            with tf.name_scope("dnn"):
+                # Defaults to no dropout, so only training and predict_distribution need to feed it
+                dropoutKeepProb = tf.placeholder_with_default(1.0, shape=(), name="keep_prob")
 
-            # Create histogram summaries
-            for layer in range(len(self.hiddenNeuronsList)):
-                path = "dense" if layer == 0 else "dense_{0}".format(layer)
+                # Predictions, exports and cost reports use the logits without any dropout ops
+                logits = self._buildNetwork(X_in, numFeatures)
 
-                tf.summary.histogram("dense_{0}/kernel".format(layer),
-                                     tf.get_default_graph().get_tensor_by_name(path + "/kernel:0"))
-                tf.summary.histogram("dense_{0}/bias".format(layer),
-                                     tf.get_default_graph().get_tensor_by_name(path + "/bias:0"))
+                # The output op's name depends on the layers, so store it to find when restoring
+                tf.add_to_collection("logits", logits)
 
-            logits = tf.layers.dense(layerOutput,
-                                     units=1,
-                                     kernel_initializer=self.initializer,
-                                     name="logits")
+                # A second copy of the network applies dropout for training, sharing its variables
+                dropoutLogits = None
+                if self.applyDropout:
+                    with tf.name_scope("dropout"):
+                        dropoutLogits = self._buildNetwork(X_in, numFeatures, dropoutKeepProb)
 
-        with tf.name_scope("loss"):
-            mse = tf.reduce_mean(tf.square(logits - y_in), name="mse")
+                    tf.add_to_collection("dropoutLogits", dropoutLogits)
 
-        with tf.name_scope("train"):
-            optimizer = tf.train.AdamOptimizer(learning_rate=self.learningRate)
-            trainingOp = optimizer.minimize(mse, name="trainingOp")
+                trainingLogits = logits if dropoutLogits is None else dropoutLogits
+
+                # Create histogram summaries. The variables are looked up relative to the current
+                # variable scope in case this model is sharing a graph with other models. These are
+                # expensive for large layers, so they're written less often than the scalars
+                for layer in range(len(self.hiddenNeuronsList)):
+                    path = "dense" if layer == 0 else "dense_{0}".format(layer)
+                    with tf.variable_scope(path, reuse=True):
+                        kernel, bias = tf.get_variable("kernel"), tf.get_variable("bias")
+
+                    tf.summary.histogram("dense_{0}/kernel".format(layer), kernel,
+                                         collections=[HISTOGRAM_SUMMARIES])
+                    tf.summary.histogram("dense_{0}/bias".format(layer), bias,
+                                         collections=[HISTOGRAM_SUMMARIES])
+
+            with tf.name_scope("loss"):
+                mse = tf.reduce_mean(tf.square(trainingLogits - y_in), name="mse")
+
+            metrics = self._buildMetricsGraph(mse, y_in, trainingLogits)
+
+            with tf.name_scope("train"):
+                optimizer = tf.train.AdamOptimizer(learning_rate=self.learningRate)
+                trainingOp = optimizer.minimize(mse, name="trainingOp")
+
+            # A second training op for the weighted loss, so it's only built for models which will
+            # use it
+            importance = None
+            if self.importanceSampling:
+                with tf.name_scope("importance"):
+                    exampleWeights = tf.placeholder(shape=(None,), dtype=tf.float32, name="exampleWeights")
+                    exampleLosses = tf.square(tf.reshape(trainingLogits, [-1]) - y_in,
+                                              name="exampleLosses")
+                    weightedTrainingOp = optimizer.minimize(tf.reduce_mean(exampleWeights * exampleLosses),
+                                                            name="trainingOp")
+                importance = ImportanceSamplingTensors(exampleWeights, exampleLosses, weightedTrainingOp)
+
+            # The loop holds a second copy of the network and its training op, so it's only built
+            # for models which will use it
+            multiStep = None
+            if self.multiStepTraining:
+                stepKeepProb = dropoutKeepProb if self.applyDropout else None
+                multiStep = self._buildMultiStepGraph(numFeatures, optimizer, stepKeepProb)
+
+            accumulation = None
+            if self.accumulationSteps > 1:
+                accumulation = self._buildAccumulationGraph(mse, optimizer)
+
+            normalization = None
+            if self.normalizeInputs:
+                with tf.name_scope("normalization"):
+                    meanIn = tf.placeholder(shape=(numFeatures,), dtype=tf.float32, name="meanIn")
+                    varianceIn = tf.placeholder(shape=(numFeatures,), dtype=tf.float32, name="varianceIn")
+
+                    mean, variance = self._getNormalizationVariables(numFeatures)
+                    assignOp = tf.group(mean.assign(meanIn), variance.assign(varianceIn), name="assignOp")
+
+                normalization = NormalizationTensors(meanIn, varianceIn, assignOp)
+
+        scope = tf.get_variable_scope().name
+        prunableKernels = self._getPrunableKernels(tf.get_default_graph(), scope + "/" if scope else "")
 
         return RegressorTensors(X_in,
                                 y_in,
                                 logits,
                                 mse,
                                 trainingOp,
-                                dropoutKeepProb)
+                                dropoutKeepProb,
+                                multiStep,
+                                accumulation,
+                                normalization,
+                                importance,
+                                prunableKernels,
+                                metrics,
+                                dropoutLogits)
+
+    def _buildMetricsGraph(self, loss, y_in, logits):
+        """
+        Builds streaming metrics which accumulate the mean loss and mean absolute error of the
+        training steps in local variables
+        """
+        with tf.variable_scope("trainingMetrics") as scope:
+            meanLoss, updateLoss = tf.metrics.mean(loss, name="meanLoss")
+            meanAbsoluteError, updateError = tf.metrics.mean_absolute_error(
+                y_in, tf.reshape(logits, [-1]), name="meanAbsoluteError")
+
+            values = {"loss": tf.identity(meanLoss, name="loss"),
+                      "mae": tf.identity(meanAbsoluteError, name="mae")}
+            updateOp = tf.group(updateLoss, updateError, name="updateOp")
+            resetOp = tf.variables_initializer(
+                tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES, scope=scope.name + "/"),
+                name="resetOp")
 
-    def _restoreGraph(self, graph):
-        return RegressorTensors(graph.get_tensor_by_name("inputs/X_in:0"),
+        return StreamingMetricsTensors(values, updateOp, resetOp)
+
+    def _buildAccumulationGraph(self, loss, optimizer):
+        """
+        Builds ops which sum the gradients of several batches in non-trainable variables, and which
+        apply the mean of the summed gradients.
+        """
+        with tf.name_scope("accumulate"):
+            gradsAndVars = [(grad, var) for grad, var in optimizer.compute_gradients(loss)
+                            if grad is not None]
+
+            accumulators = [tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype),
+                                        trainable=False,
+                                        name=var.op.name.replace("/", "_") + "_accumulator")
+                            for _, var in gradsAndVars]
+
+            accumulateOp = tf.group(*[accumulator.assign_add(grad)
+                                      for accumulator, (grad, _) in zip(accumulators, gradsAndVars)],
+                                    name="accumulateOp")
+
+            numAccumulated = tf.placeholder(shape=(), dtype=tf.float32, name="numAccumulated")
+            applyGradients = optimizer.apply_gradients(
+                [(accumulator / numAccumulated, var)
+                 for accumulator, (_, var) in zip(accumulators, gradsAndVars)])
+
+            with tf.control_dependencies([applyGradients]):
+                applyOp = tf.group(*[accumulator.assign(tf.zeros_like(accumulator))
+                                     for accumulator in accumulators],
+                                   name="applyOp")
+
+        return GradientAccumulationTensors(accumulateOp, applyOp, numAccumulated)
+
+    def _buildMultiStepGraph(self, numFeatures, optimizer, dropoutKeepProb=None):
+        """
+        Builds a loop which runs several training steps in a single call to sess.run. The batches
+        for every step are concatenated in X_steps and y_steps, and the rows for step i are
+        stepOffsets[i] to stepOffsets[i + 1]. Dropout is applied if dropoutKeepProb is provided.
+        """
+        with tf.name_scope("multiStep"):
+            X_steps = tf.placeholder(shape=(None, numFeatures), dtype=tf.float32, name="X_steps")
+            y_steps = tf.placeholder(shape=(None), dtype=tf.float32, name="y_steps")
+            stepOffsets = tf.placeholder(shape=(None,), dtype=tf.int32, name="stepOffsets")
+            numSteps = tf.shape(stepOffsets)[0] - 1
+
+            def trainStep(step, lossSum):
+                # Depending on the loop variables ensures this step reads the variables after the
+                # previous step has updated them
+                with tf.control_dependencies([step, lossSum]):
+                    start, end = stepOffsets[step], stepOffsets[step + 1]
+                    stepLogits = self._buildNetwork(X_steps[start:end], numFeatures, dropoutKeepProb)
+                    stepLoss = tf.reduce_mean(tf.square(stepLogits - y_steps[start:end]))
+                    stepTrainingOp = optimizer.minimize(stepLoss)
+
+                with tf.control_dependencies([stepTrainingOp]):
+                    return step + 1, lossSum + stepLoss
+
+            _, lossSum = tf.while_loop(lambda step, lossSum: step < numSteps,
+                                       trainStep,
+                                       [tf.constant(0), tf.constant(0.0)],
+                                       parallel_iterations=1)
+
+            meanLoss = tf.divide(lossSum, tf.cast(numSteps, tf.float32), name="meanLoss")
+
+        return MultiStepTensors(X_steps, y_steps, stepOffsets, meanLoss)
+
+    def _restoreGraph(self, graph, scope=""):
+        prefix = scope + "/" if scope else ""
+
+        try:
+            multiStep = MultiStepTensors(
+                graph.get_tensor_by_name(prefix + "multiStep/X_steps:0"),
+                graph.get_tensor_by_name(prefix + "multiStep/y_steps:0"),
+                graph.get_tensor_by_name(prefix + "multiStep/stepOffsets:0"),
+                graph.get_tensor_by_name(prefix + "multiStep/meanLoss:0"))
+        except KeyError:
+            # Models built without multiStepTraining
+            multiStep = None
+
+        accumulation = None
+        if self.accumulationSteps > 1:
+            accumulation = GradientAccumulationTensors(
+                graph.get_operation_by_name(prefix + "accumulate/accumulateOp"),
+                graph.get_operation_by_name(prefix + "accumulate/applyOp"),
+                graph.get_tensor_by_name(prefix + "accumulate/numAccumulated:0"))
+
+        try:
+            importance = ImportanceSamplingTensors(
+                graph.get_tensor_by_name(prefix + "importance/exampleWeights:0"),
+                graph.get_tensor_by_name(prefix + "importance/exampleLosses:0"),
+                graph.get_operation_by_name(prefix + "importance/trainingOp"))
+        except KeyError:
+            # Models built without importanceSampling
+            importance = None
+
+        try:
+            metrics = StreamingMetricsTensors(
+                {"loss": graph.get_tensor_by_name(prefix + "trainingMetrics/loss:0"),
+                 "mae": graph.get_tensor_by_name(prefix + "trainingMetrics/mae:0")},
+                graph.get_operation_by_name(prefix + "trainingMetrics/updateOp"),
+                graph.get_operation_by_name(prefix + "trainingMetrics/resetOp"))
+        except KeyError:
+            # Models saved before streaming metrics were supported
+            metrics = None
+
+        if self.sparseInput:
+            X_in = tf.SparseTensor(graph.get_tensor_by_name("inputs/X_in/indices:0"),
+                                   graph.get_tensor_by_name("inputs/X_in/values:0"),
+                                   graph.get_tensor_by_name("inputs/X_in/shape:0"))
+        else:
+            X_in = graph.get_tensor_by_name("inputs/X_in:0")
+
+        # The inputs are shared by every model trained by a ReplicatedRegressorTrainer, but each has
+        # its own logits in the collection
+        logits = [tensor for tensor in graph.get_collection("logits")
+                  if tensor.name.startswith(prefix)]
+        logits = logits[0] if logits else graph.get_tensor_by_name(prefix + "dnn/logits/BiasAdd:0")
+
+        dropoutLogits = [tensor for tensor in graph.get_collection("dropoutLogits")
+                         if tensor.name.startswith(prefix)]
+        dropoutLogits = dropoutLogits[0] if dropoutLogits else None
+
+        return RegressorTensors(X_in,
                                 graph.get_tensor_by_name("inputs/y_in:0"),
-                                graph.get_tensor_by_name("dnn/logits:0"),
-                                graph.get_tensor_by_name("loss/mse:0"),
-                                graph.get_operation_by_name("train/trainingOp"),
-                                graph.get_tensor_by_name("dnn/keep_prob:0"))
+                                logits,
+                                graph.get_tensor_by_name(prefix + "loss/mse:0"),
+                                graph.get_operation_by_name(prefix + "train/trainingOp"),
+                                graph.get_tensor_by_name(prefix + "dnn/keep_prob:0"),
+                                multiStep,
+                                accumulation,
+                                importance=importance,
+                                prunableKernels=self._getPrunableKernels(graph, prefix),
+                                metrics=metrics,
+                                dropoutLogits=dropoutLogits)
 
     def _buildHyperParamsDict(self):
-        return {"H": "_".join(str(value) for value in self.hiddenNeuronsList),
-                "I": self._mapInitializerName(self.initializer),
-                "D": str(self.dropoutRate)}
+        params = {"H": "_".join(str(value) for value in self.hiddenNeuronsList),
+                  "I": self._mapInitializerName(self.initializer),
+                  "D": str(self.dropoutRate)}
+
+        # Only added when used so that the names of existing dense models don't change
+        if self.sparseInput:
+            params["S"] = "1"
+
+        if self.accumulationSteps > 1:
+            params["A"] = str(self.accumulationSteps)
+
+        if self.normalizeInputs:
+            params["N"] = "1"
+
+        if self.applyDropout:
+            params["DA"] = "1"
+
+        return params
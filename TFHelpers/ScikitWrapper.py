@@ -1,11 +1,13 @@
 """
 Provides scikit-learn style wrappers for tensorflow models.
 """
+from datetime import datetime
 import sys
 import time
-from typing import Dict
+from typing import Dict, List
 
 import numpy as np
+import scipy.sparse
 
 from sklearn.base import BaseEstimator, RegressorMixin
 from sklearn.exceptions import NotFittedError
@@ -13,7 +15,10 @@ from sklearn.exceptions import NotFittedError
 import tensorflow as tf
 
 from TFHelpers.FilesAndLogging import CheckpointAndRestoreHelper, FileManager, TensorboardLogHelper
-from TFHelpers.TrainingHelpers import EarlyStoppingHelper, ProgressCalculator, TrainingValidator
+from TFHelpers.Serving import PredictionCache
+from TFHelpers.TrainingHelpers import buildAllocatorStats, EarlyStoppingHelper, MemoryTracker, \
+                                      ProgressCalculator, StreamingMoments, TrainingValidator, \
+                                      ValidationScheduler
 
 class SKTFWrapper(BaseEstimator, RegressorMixin):
     """
@@ -25,6 +30,9 @@ class SKTFWrapper(BaseEstimator, RegressorMixin):
 
     _session = None
 
+    # False when the session belongs to something else, such as a ReplicatedRegressorTrainer
+    _ownsSession = True
+
     def fit(self, X, y, X_valid, y_valid, numEpochs=1):
         """
         Build and train the graph here
@@ -42,9 +50,14 @@ class SKTFWrapper(BaseEstimator, RegressorMixin):
         raise NotImplementedError()
 
     def _closeSession(self):
-        """Ends the tensorflow session if one is open"""
-        if self._session:
+        """
+        Ends the tensorflow session if one is open. A session this model doesn't own is only
+        released, so that the other models using it can still predict.
+        """
+        if self._session and self._ownsSession:
             self._session.close()
+        elif self._session:
+            self._session = None
 
     def _mapInitializerName(self, initializer):
         """Maps initializer types to a short string suitable for the model's file name"""
@@ -57,6 +70,64 @@ class SKTFWrapper(BaseEstimator, RegressorMixin):
 
         return initString
 
+class MultiStepTensors:
+    """
+    Optional part of RegressorTensors for models which can run several training steps in a single
+    call to sess.run. The batches for all steps are concatenated and fed to X_in and y_in, and
+    stepOffsets contains the row each step starts at followed by the total number of rows. Evaluating
+    meanLoss runs all of the steps and returns the mean of their losses.
+    """
+    def __init__(self, X_in, y_in, stepOffsets, meanLoss):
+        self.X_in, self.y_in = X_in, y_in
+        self.stepOffsets = stepOffsets
+        self.meanLoss = meanLoss
+
+class GradientAccumulationTensors:
+    """
+    Optional part of RegressorTensors for models which accumulate gradients over several batches
+    before applying them. Running accumulateOp adds the gradients of the fed batch to the
+    accumulators, and running applyOp applies the accumulated gradients divided by the number of
+    batches fed to numAccumulated, then resets the accumulators.
+    """
+    def __init__(self, accumulateOp, applyOp, numAccumulated):
+        self.accumulateOp = accumulateOp
+        self.applyOp = applyOp
+        self.numAccumulated = numAccumulated
+
+class ImportanceSamplingTensors:
+    """
+    Optional part of RegressorTensors for models which support importance sampling. exampleLosses
+    is the loss of each example in the fed batch, and trainingOp minimises the mean of those losses
+    multiplied by the weights fed to exampleWeights.
+    """
+    def __init__(self, exampleWeights, exampleLosses, trainingOp):
+        self.exampleWeights = exampleWeights
+        self.exampleLosses = exampleLosses
+        self.trainingOp = trainingOp
+
+class NormalizationTensors:
+    """
+    Optional part of RegressorTensors for models which normalize their features in the graph.
+    Running assignOp stores the mean and variance of each feature fed to meanIn and varianceIn in
+    the graph's variables.
+    """
+    def __init__(self, meanIn, varianceIn, assignOp):
+        self.meanIn, self.varianceIn = meanIn, varianceIn
+        self.assignOp = assignOp
+
+class StreamingMetricsTensors:
+    """
+    Optional part of RegressorTensors for models which accumulate training metrics over an epoch.
+    updateOp is run alongside each training step, so the metrics cost no extra forward pass. values
+    is a dict of the tensors which read each metric, and must include "loss", and running resetOp
+    zeroes the accumulators. These are usually built from tf.metrics functions, whose variables are
+    local variables so they aren't saved in checkpoints.
+    """
+    def __init__(self, values: Dict[str, tf.Tensor], updateOp, resetOp):
+        self.values = values
+        self.updateOp = updateOp
+        self.resetOp = resetOp
+
 class RegressorTensors:
     """
     Derived classes of TFRegressor must provide this member, it is the interface between the
@@ -68,11 +139,65 @@ class RegressorTensors:
                  logits,
                  loss,
                  trainingOp,
-                 dropoutKeepProb):
+                 dropoutKeepProb,
+                 multiStep: MultiStepTensors=None,
+                 accumulation: GradientAccumulationTensors=None,
+                 normalization: NormalizationTensors=None,
+                 importance: ImportanceSamplingTensors=None,
+                 prunableKernels: List[tf.Variable]=None,
+                 metrics: StreamingMetricsTensors=None,
+                 dropoutLogits=None):
         self.X_in, self.y_in = X_in, y_in
         self.logits, self.loss = logits, loss
         self.trainingOp = trainingOp
         self.dropoutKeepProb = dropoutKeepProb
+        self.multiStep = multiStep
+        self.accumulation = accumulation
+        self.normalization = normalization
+        self.importance = importance
+        self.prunableKernels = prunableKernels
+        self.metrics = metrics
+        self.dropoutLogits = dropoutLogits
+
+def _metricsUpdateFetches(tensors: RegressorTensors) -> List[tf.Operation]:
+    """Returns the ops to fetch alongside a training step to update the streaming metrics"""
+    return [] if tensors.metrics is None else [tensors.metrics.updateOp]
+
+class StepCallables:
+    """
+    The training, loss and prediction steps of a model compiled once per session with
+    Session.make_callable, which skips the lookup and validation of feeds and fetches that sess.run
+    repeats on every call. Each batch is converted to the dtype of its placeholder, as sess.run would.
+
+    The training step also updates the model's streaming metrics, if it has any. Sparse
+    placeholders can't be fed to a callable, so X_in must be a dense placeholder.
+    """
+    def __init__(self, session, tensors: RegressorTensors, trainingOp):
+        if isinstance(tensors.X_in, tf.SparseTensor):
+            raise ValueError("StepCallables does not support sparse placeholders")
+
+        self._featureDtype = tensors.X_in.dtype.as_numpy_dtype
+        self._targetDtype = tensors.y_in.dtype.as_numpy_dtype
+
+        self._train = session.make_callable([trainingOp] + _metricsUpdateFetches(tensors),
+                                            [tensors.X_in, tensors.y_in, tensors.dropoutKeepProb])
+        self._loss = session.make_callable(tensors.loss, [tensors.X_in, tensors.y_in])
+        self._logits = session.make_callable(tensors.logits, [tensors.X_in])
+
+    def train(self, X_batch, y_batch, dropoutKeepProb: float) -> None:
+        """Runs a training step on the batch"""
+        self._train(np.asarray(X_batch, dtype=self._featureDtype),
+                    np.asarray(y_batch, dtype=self._targetDtype),
+                    dropoutKeepProb)
+
+    def loss(self, X_batch, y_batch) -> np.ndarray:
+        """Returns the loss of the batch without dropout"""
+        return self._loss(np.asarray(X_batch, dtype=self._featureDtype),
+                          np.asarray(y_batch, dtype=self._targetDtype))
+
+    def logits(self, X_batch) -> np.ndarray:
+        """Returns the predictions for the batch without dropout"""
+        return self._logits(np.asarray(X_batch, dtype=self._featureDtype))
 
 class TFRegressor(SKTFWrapper):
     """
@@ -91,7 +216,8 @@ class TFRegressor(SKTFWrapper):
                  initializer,
                  dropoutRate,
                  restoreFrom,
-                 outputLength):
+                 outputLength,
+                 accumulationSteps=1):
 
         # Scikit-learn's api demands that parameters in the constructor are assigned to members with
         # exactly the same name otherwise its clone method sets everything to None
@@ -103,6 +229,9 @@ class TFRegressor(SKTFWrapper):
         self.restoreFrom = restoreFrom
         self.outputLength = outputLength
 
+        # Each optimizer step uses accumulationSteps batches of batchSize rows
+        self.accumulationSteps = accumulationSteps
+
         self._session = None
         self._graph = tf.Graph()
 
@@ -112,6 +241,23 @@ class TFRegressor(SKTFWrapper):
         self._tensors = None
         self._init = None
         self._saver = None
+        self._stepCallables = None
+
+        # Set by ReplicatedRegressorTrainer so that all of its models read the same placeholders
+        self._sharedInputs = None
+
+        self._allocatorStats = {}
+        self._fitMemoryTracker = None
+        self._predictMemoryRecord = None
+
+        # None unless predict memory tracking is enabled, else whether to reset the peak RSS
+        self._predictMemoryResetPeak = None
+        self._earlyStoppingReport = None
+
+        # Incremented whenever the model's parameters are replaced, so cached predictions from
+        # previous parameters are never returned
+        self._modelVersion = 0
+        self._predictionCache = None
 
     def _buildGraph(self, numFeatures):
         """
@@ -122,15 +268,34 @@ class TFRegressor(SKTFWrapper):
         """
         raise NotImplementedError()
 
-    def _restoreGraph(self, graph):
+    def _restoreGraph(self, graph, scope=""):
         """
         Use graph.get_tensor_by_name("<name>:0") to collect the important tensors and return a
-        RegressorTensors object.
+        RegressorTensors object. scope is the variable scope the model was built in, which is set
+        for models trained by a ReplicatedRegressorTrainer.
 
         ** Derived classes should implement this if they intend to support restoration **
         """
         raise NotImplementedError()
 
+    def _buildInputs(self, numFeatures, sparse=False):
+        """
+        Creates the X_in and y_in placeholders for _buildGraph, X_in being a sparse placeholder if
+        sparse is True. When the model is being trained by a ReplicatedRegressorTrainer, the
+        placeholders shared by all of its models are returned instead.
+        """
+        if self._sharedInputs is not None:
+            return self._sharedInputs
+
+        with tf.name_scope("inputs"):
+            if sparse:
+                X_in = tf.sparse_placeholder(shape=(None, numFeatures), dtype=tf.float32, name="X_in")
+            else:
+                X_in = tf.placeholder(shape=(None, numFeatures), dtype=tf.float32, name="X_in")
+            y_in = tf.placeholder(shape=(None), dtype=tf.float32, name="y_in")
+
+        return X_in, y_in
+
     def _buildHyperParamsDict(self) -> Dict[str, str]:
         """
         Return a dict of strings, where the keys are around 1 to 4 character abbreviations of
@@ -158,127 +323,924 @@ class TFRegressor(SKTFWrapper):
         """
         pass
 
-    def fit(self, X, y, X_valid, y_valid, numEpochs=1):
-        """Fits the model on the training set"""
+    def _checkTensorsSupportFit(self, tensors, stepsPerRun, importanceSampler, pruner):
+        """Raises a ValueError if the model's tensors don't support the options passed to fit"""
+        if stepsPerRun > 1 and tensors.multiStep is None:
+            raise ValueError("stepsPerRun requires the model to provide MultiStepTensors")
+
+        if self.accumulationSteps > 1 and tensors.accumulation is None:
+            raise ValueError("accumulationSteps requires the model to provide "
+                             "GradientAccumulationTensors")
+
+        if importanceSampler is not None and tensors.importance is None:
+            raise ValueError("importanceSampler requires the model to provide "
+                             "ImportanceSamplingTensors")
+
+        if pruner is not None and tensors.prunableKernels is None:
+            raise ValueError("pruner requires the model to provide prunableKernels")
+
+    def fit(self,
+            X,
+            y,
+            X_valid,
+            y_valid,
+            numEpochs=1,
+            retentionPolicy=None,
+            validateEverySteps=None,
+            validateEverySeconds=None,
+            validationSubsample=None,
+            stepsPerRun=1,
+            checkpointEverySteps=None,
+            importanceSampler=None,
+            earlyStopping=None,
+            pruner=None,
+            histogramEvery=10):
+        """
+        Fits the model on the training set.
+
+        Provide a CheckpointRetentionPolicy in retentionPolicy to keep more than the latest
+        checkpoint, or to limit the disk space used by checkpoints.
+
+        By default the validation loss is checked once at the end of each epoch. Provide
+        validateEverySteps and/or validateEverySeconds to check it during the epoch instead, in which
+        case early stopping counts validation checks rather than epochs. Provide
+        validationSubsample to check the loss on a fixed random subset of that many rows of
+        X_valid, with a full pass only when the subset's loss improves.
+
+        Set stepsPerRun to run that many training steps in each call to sess.run, which reduces the
+        overhead per step for small models. The model must provide MultiStepTensors to support this.
+
+        If the model was constructed with accumulationSteps larger than 1, each step of training
+        runs on a batch of batchSize rows and the gradients are applied every accumulationSteps
+        steps. This can't be combined with stepsPerRun.
+
+        Provide an ImportanceSampler in importanceSampler to draw batches in proportion to an
+        estimate of each example's loss, rather than a shuffle of every example in each epoch. The
+        model must provide ImportanceSamplingTensors to support this.
+
+        Set checkpointEverySteps to also save a checkpoint every that many training steps within an
+        epoch, along with the order of the batches, the random state and the early stopping state.
+        Restoring the run then continues from exactly that step.
+
+        Provide an EarlyStoppingHelper in earlyStopping to use a different stopping policy, such as
+        a smoothed validation loss. It is reset at the start of each fit. The epochs and time saved
+        compared to the default policy are available from getEarlyStoppingReport.
+
+        Provide a MagnitudePruner in pruner to gradually zero the smallest weights of the kernels
+        listed in the model's prunableKernels. The sparsity of each kernel is logged each epoch.
+
+        Histograms in the HISTOGRAM_SUMMARIES collection are written every histogramEvery epochs,
+        the scalars every epoch, so logging doesn't slow down as the model grows.
+        """
+        # Check the options before anything is written to disk or built
+        if stepsPerRun > 1 and scipy.sparse.issparse(X):
+            raise ValueError("stepsPerRun does not support sparse features")
+
+        if self.accumulationSteps > 1 and stepsPerRun > 1:
+            raise ValueError("accumulationSteps can't be combined with stepsPerRun")
+
+        if importanceSampler is not None and (stepsPerRun > 1 or self.accumulationSteps > 1):
+            raise ValueError("importanceSampler can't be combined with stepsPerRun or "
+                             "accumulationSteps")
+
+        if pruner is not None and (stepsPerRun > 1 or self.accumulationSteps > 1 or
+                                   importanceSampler is not None):
+            raise ValueError("pruner can't be combined with stepsPerRun, accumulationSteps or "
+                             "importanceSampler")
+
+        # A new graph can be checked against the options before the run is recorded, a restored
+        # one only once it has been loaded
+        self._sharedInputs = None
+        if self.restoreFrom is None:
+            with self._graph.as_default():
+                tensors = self._buildGraph(X.shape[1])
+                init = tf.global_variables_initializer()
+
+            self._checkTensorsSupportFit(tensors, stepsPerRun, importanceSampler, pruner)
+            self._tensors, self._init = tensors, init
+
         self._closeSession()
+        self._modelVersion += 1
 
         # This must be initialised during fit for sklearn's grid search to call it at the correct
         # time
         self._fileManager = FileManager(self._buildModelNameStr(), self.restoreFrom)
+        bestLossVal = np.infty
+        scope = ""
+        if self.restoreFrom is None:
+            self._fileManager.updateRunIndex({"type": self.__class__.__name__,
+                                              "hyperParams": self._buildHyperParamsDict(),
+                                              "startTime": datetime.utcnow().isoformat(),
+                                              "epochs": 0,
+                                              "finished": False})
+        else:
+            previousRun = self._fileManager.getRunIndex().readRuns().get(
+                self._fileManager.getModelName() + "/" + self._fileManager.getRunName(), {})
+            if previousRun.get("bestLossVal") is not None:
+                bestLossVal = previousRun["bestLossVal"]
 
-        with self._graph.as_default():
-            if self.restoreFrom is None:
-                self._tensors = self._buildGraph(X.shape[1])
-                self._init = tf.global_variables_initializer()
+            # Set if the run was trained by a ReplicatedRegressorTrainer
+            scope = previousRun.get("scope", "")
 
-        stoppingHelper = EarlyStoppingHelper()
+            self._fileManager.updateRunIndex({"finished": False})
+
+        stoppingHelper = EarlyStoppingHelper(scope=scope + "/" if scope else None) \
+                         if earlyStopping is None else earlyStopping
+        stoppingHelper.reset()
         restoreHelper = CheckpointAndRestoreHelper(self._fileManager.getModelDirAndPrefix(),
                                                    self.restoreFrom is not None,
-                                                   self._graph)
+                                                   self._graph,
+                                                   retentionPolicy)
 
         tensorboardHelper = TensorboardLogHelper(self._fileManager.getModelDir(),
                                                  self._graph,
                                                  ["LossTrain", "LossVal", "BatchTimeAvg"],
-                                                 self.restoreFrom is not None)
+                                                 self.restoreFrom is not None,
+                                                 histogramEvery=histogramEvery)
 
         self._session = tf.Session(graph=self._graph)
+        self._ownsSession = True
+        self._stepCallables = None
 
         trainingValidator = TrainingValidator(self._graph, self._session)
-        with self._session.as_default() as sess:
+        with self._graph.as_default(), self._session.as_default() as sess:
             if self.restoreFrom is None:
                 startEpoch = 0
                 self._init.run()
+
+                # Restored models already have their statistics in the checkpoint
+                if self._tensors.normalization is not None:
+                    self._initNormalization(sess, self._featureMoments(X))
             else:
                 startEpoch = restoreHelper.restoreFromCheckpoint(sess)
                 tensorboardHelper.setIteration(startEpoch)
 
+                if scope:
+                    # The checkpoint only holds this model, but the graph holds every model it was
+                    # trained with, which are initialised so that checks on every variable can run
+                    sess.run(tf.variables_initializer([var for var in tf.global_variables()
+                                                       if not var.op.name.startswith(scope + "/")]))
+
                 # This call to restore the graph doesn't need to be done inside the session,
                 # may be better to move it outside the session
                 try:
-                    self._tensors = self._restoreGraph(self._graph)
+                    self._tensors = self._restoreGraph(self._graph, scope)
                 except KeyError as err:
                     print([n.name for n in self._graph.as_graph_def().node])
                     print("\n" + str(err))
                     print("\nThe available tensors/ops have been printed above this error")
                     raise RuntimeError("Model failed to restore")
 
+                self._checkTensorsSupportFit(self._tensors, stepsPerRun, importanceSampler, pruner)
+
+            if importanceSampler is not None:
+                importanceSampler.start(X.shape[0])
+
+            trainingOp = self._tensors.trainingOp
+            if pruner is not None:
+                trainingOp = pruner.build(self._tensors.prunableKernels, trainingOp)
+                pruner.start(sess)
+
+            # Built after the pruner so that the training step runs the masked training op
+            self._stepCallables = self._buildStepCallables(sess, trainingOp)
+            metricsFetches = _metricsUpdateFetches(self._tensors)
+
+            self._allocatorStats = buildAllocatorStats()
+            self._fitMemoryTracker = MemoryTracker(self._allocatorStats)
+            self._fitMemoryTracker.trackBuffer("validation", [X_valid, y_valid], persistent=True)
+
+            validationScheduler = ValidationScheduler(validateEverySteps, validateEverySeconds)
+            subsampleIndicies = None
+            if validationSubsample is not None and validationSubsample < X_valid.shape[0]:
+                subsampleIndicies = np.sort(np.random.choice(X_valid.shape[0],
+                                                             validationSubsample,
+                                                             replace=False))
+                self._fitMemoryTracker.trackBuffer("validationSubsample",
+                                                   [X_valid[subsampleIndicies],
+                                                    y_valid[subsampleIndicies]],
+                                                   persistent=True)
+
+            lossVal = np.nan
+            resumeState = restoreHelper.getResumeState()
+            if resumeState is not None:
+                stoppingHelper.setState(resumeState["earlyStopping"])
+                validationScheduler.setState(resumeState["validationScheduler"])
+                subsampleIndicies = resumeState["validationSubsample"]
+                lossVal = resumeState["lossVal"]
+                np.random.set_state(resumeState["randomState"])
+
+                if importanceSampler is not None:
+                    importanceSampler.setState(resumeState["importanceSampler"])
+
+                if pruner is not None:
+                    pruner.setState(resumeState["pruner"])
+
+            checksAtStart = stoppingHelper.getSavingsReport()["checks"]
+            epochsCompleted = 0
+            shouldStop = False
+            stepsSinceCheckpoint = 0
+            numAccumulated = 0
             progressCalc = ProgressCalculator(numEpochs - startEpoch)
             progressCalc.start()
+            trainingStart = time.time()
+            validationScheduler.start()
+            self._fitMemoryTracker.start()
             for epoch in range(startEpoch, numEpochs):
-                randomIndicies = np.random.permutation(len(X))
-                NUM_BATCHES = len(X) // self.batchSize
+                NUM_BATCHES = X.shape[0] // self.batchSize
+
+                startStep = 0
+                lossValThisEpoch = None
+                if resumeState is not None and epoch == startEpoch:
+                    # Continue the interrupted epoch with the same order of batches
+                    randomIndicies = resumeState["permutation"]
+                    startStep = resumeState["step"]
+                    lossValThisEpoch = resumeState["lossValThisEpoch"]
+                else:
+                    randomIndicies = np.random.permutation(X.shape[0])
+
+                # The metrics of an interrupted epoch only cover the steps since it was restored
+                if self._tensors.metrics is not None:
+                    sess.run(self._tensors.metrics.resetOp)
 
                 batchTimes = []
-                for batchNumber, batchIndicies in enumerate(np.array_split(randomIndicies, NUM_BATCHES)):
+                shouldStop = False
+                batches = np.array_split(randomIndicies, NUM_BATCHES)
+                for runStart in range(startStep, NUM_BATCHES, stepsPerRun):
                     batchStart = time.time()
 
-                    X_batch, y_batch = X[batchIndicies], y[batchIndicies]
+                    runBatches = batches[runStart:runStart + stepsPerRun]
+                    if stepsPerRun == 1:
+                        batchIndicies = runBatches[0]
+                        if importanceSampler is not None:
+                            batchIndicies, exampleWeights = importanceSampler.sampleBatch(len(batchIndicies))
+                        X_batch, y_batch = X[batchIndicies], y[batchIndicies]
 
-                    feed_dict = {self._tensors.X_in: X_batch,
-                                 self._tensors.y_in: y_batch,
-                                 self._tensors.dropoutKeepProb: 1 - self.dropoutRate}
+                        feed_dict = {self._tensors.X_in: self._featureFeed(X_batch),
+                                     self._tensors.y_in: y_batch,
+                                     self._tensors.dropoutKeepProb: 1 - self.dropoutRate}
 
-                    sess.run(self._tensors.trainingOp, feed_dict=feed_dict)
+                        if self.accumulationSteps > 1:
+                            sess.run([self._tensors.accumulation.accumulateOp] + metricsFetches,
+                                     feed_dict=feed_dict)
+                            numAccumulated += 1
+                            if numAccumulated == self.accumulationSteps:
+                                self._applyAccumulatedGradients(sess, numAccumulated)
+                                numAccumulated = 0
+                        elif importanceSampler is not None:
+                            # The losses of the forward pass refresh the sampler's estimates
+                            importance = self._tensors.importance
+                            feed_dict[importance.exampleWeights] = exampleWeights
+                            _, exampleLosses = sess.run([importance.trainingOp, importance.exampleLosses] +
+                                                        metricsFetches,
+                                                        feed_dict=feed_dict)[:2]
+                            importanceSampler.update(batchIndicies, exampleLosses)
+                        else:
+                            if self._stepCallables is not None:
+                                self._stepCallables.train(feed_dict[self._tensors.X_in],
+                                                          y_batch,
+                                                          1 - self.dropoutRate)
+                            else:
+                                sess.run([trainingOp] + metricsFetches, feed_dict=feed_dict)
 
-                    batchTimes.append(time.time() - batchStart)
-                    print("Batch:", batchNumber, "/", NUM_BATCHES, "{0:.4f}".format(batchTimes[-1]) + "s", end="\r")
+                            if pruner is not None:
+                                pruner.step(sess, epoch * NUM_BATCHES + runStart + 1)
+                        self._fitMemoryTracker.trackBuffer("batch", [feed_dict[self._tensors.X_in],
+                                                                     y_batch])
+                    else:
+                        lossTrain = self._runMultipleSteps(sess, X, y, runBatches)
+
+                    # Each step in a run is assumed to take the same time
+                    batchTimes.extend([(time.time() - batchStart) / len(runBatches)] * len(runBatches))
+                    print("Batch:", runStart + len(runBatches) - 1, "/", NUM_BATCHES, "{0:.4f}".format(batchTimes[-1]) + "s", end="\r")
+
+                    if validationScheduler.step(len(runBatches)):
+                        checkLossVal, shouldStop = self._checkValidation(X_valid,
+                                                                         y_valid,
+                                                                         subsampleIndicies,
+                                                                         stoppingHelper)
+                        if checkLossVal is not None:
+                            lossVal = lossValThisEpoch = checkLossVal
+
+                        if shouldStop:
+                            break
+
+                    # The last step of an epoch is followed by a full checkpoint instead
+                    stepsSinceCheckpoint += len(runBatches)
+                    nextStep = runStart + len(runBatches)
+                    if checkpointEverySteps is not None and numAccumulated == 0 and \
+                       stepsSinceCheckpoint >= checkpointEverySteps and nextStep < NUM_BATCHES:
+                        restoreHelper.saveResumeState(
+                            sess,
+                            epoch,
+                            epoch * NUM_BATCHES + nextStep,
+                            {"step": nextStep,
+                             "permutation": randomIndicies,
+                             "randomState": np.random.get_state(),
+                             "earlyStopping": stoppingHelper.getState(),
+                             "validationScheduler": validationScheduler.getState(),
+                             "validationSubsample": subsampleIndicies,
+                             "lossVal": lossVal,
+                             "lossValThisEpoch": lossValThisEpoch,
+                             "importanceSampler": None if importanceSampler is None
+                                                  else importanceSampler.getState(),
+                             "pruner": None if pruner is None else pruner.getState()})
+                        stepsSinceCheckpoint = 0
+
+                # Apply the gradients of any batches left over at the end of the epoch
+                if numAccumulated > 0:
+                    self._applyAccumulatedGradients(sess, numAccumulated)
+                    numAccumulated = 0
+
+                if validationScheduler.isPerEpoch():
+                    checkLossVal, shouldStop = self._checkValidation(X_valid,
+                                                                     y_valid,
+                                                                     subsampleIndicies,
+                                                                     stoppingHelper)
+                    if checkLossVal is not None:
+                        lossVal = lossValThisEpoch = checkLossVal
 
-                # Calculate and log the losses for this epoch
-                lossTrain = self._tensors.loss.eval(feed_dict=feed_dict)
-                lossVal = self._evalLossBatched(X_valid, y_valid)
+                # Calculate and log the losses for this epoch, lossVal is the most recent full
+                # validation loss. The multi step loop doesn't update the streaming metrics, so its
+                # training loss is the mean loss of the last run
+                if stepsPerRun == 1:
+                    if self._tensors.metrics is not None:
+                        metricsTrain = sess.run(self._tensors.metrics.values)
+                        lossTrain = metricsTrain.pop("loss")
+                        tensorboardHelper.writeValues({"TrainMetrics/" + name: value
+                                                       for name, value in metricsTrain.items()})
+                    else:
+                        lossTrain = self._tensors.loss.eval(feed_dict=feed_dict)
+                self._fitMemoryTracker.trackBuffer("earlyStoppingSnapshot",
+                                                   stoppingHelper.bestModelParams)
+                memoryRecord = self._fitMemoryTracker.record(sess, epoch=epoch)
+                tensorboardHelper.writeValues({"Memory/" + name: value
+                                               for name, value in memoryRecord.items()
+                                               if name != "epoch"})
+                if pruner is not None:
+                    tensorboardHelper.writeValues({"Pruning/" + name: sparsity
+                                                   for name, sparsity in pruner.getSparsity(sess).items()})
                 tensorboardHelper.writeSummary(sess, [lossTrain, lossVal, np.average(batchTimes)])
                 progressCalc.updateInterval(1)
+                epochsCompleted += 1
                 print("\033[K" + "Epoch: {0}\tValidation loss: {1}\tTime Remaining: {2}".format(
                     epoch, lossVal, progressCalc.getTimeStampRemaining()))
 
-                restoreHelper.saveCheckpoint(sess, epoch)
+                restoreHelper.saveCheckpoint(sess, epoch, lossValThisEpoch)
+                stepsSinceCheckpoint = 0
+
+                indexUpdate = {"epochs": epoch + 1}
+                if lossValThisEpoch is not None:
+                    bestLossVal = min(bestLossVal, float(lossValThisEpoch))
+                    indexUpdate.update({"lossVal": float(lossValThisEpoch), "bestLossVal": bestLossVal})
+                self._fileManager.updateRunIndex(indexUpdate)
 
                 if epoch < 2:
                     trainingValidator.validate(lossVal)
 
                 self._onEpochComplete(epoch)
 
-                # This must be the last thing done in an epoch
-                if stoppingHelper.shouldStop(lossVal):
+                if shouldStop:
                     print("Early stopping at epoch: ", epoch)
                     break
 
-            stoppingHelper.restoreBestModelParams()
+            # The best parameters may be from before the final masks, which would undo the pruning
+            if stoppingHelper.restoreBestModelParams() and pruner is not None:
+                pruner.applyMasks(sess)
             tensorboardHelper.close()
 
+        self._earlyStoppingReport = self._buildEarlyStoppingReport(stoppingHelper,
+                                                                   shouldStop,
+                                                                   checksAtStart,
+                                                                   epochsCompleted,
+                                                                   numEpochs - startEpoch - epochsCompleted,
+                                                                   time.time() - trainingStart)
+        print("Early stopping saved {0:.1f} epochs and {1:.0f}s compared to a patience of {2}".format(
+            self._earlyStoppingReport["epochsSaved"],
+            self._earlyStoppingReport["secondsSaved"],
+            stoppingHelper.MAX_CHECKS_WITHOUT_PROGRESS))
+
+        self._fileManager.updateRunIndex({"finished": True, "earlyStopping": self._earlyStoppingReport})
+
         print("Time taken:", progressCalc.timeTaken())
 
-    def predict(self, X):
-        """Returns the model's predictions for the provided data"""
+    def predict(self, X, batchSize=None):
+        """
+        Returns the model's predictions for the provided data. batchSize defaults to the batch size
+        used for training.
+
+        If the prediction cache is enabled, only the rows which aren't cached are run through the
+        model.
+        """
         if not self._session:
             raise NotFittedError("This", self.__class__.__name__, "instance is not fitted yet")
 
-        BATCH_SIZE = self.batchSize
-        if len(X) < self.batchSize:
-            BATCH_SIZE = len(X)
+        if self._predictionCache is None or scipy.sparse.issparse(X):
+            return self._predictBatched(X, batchSize)
+
+        self._predictionCache.setModelIdentity(self._getModelIdentity())
+        keys, cached = self._predictionCache.lookupRows(X)
 
-        NUM_BATCHES = len(X) // BATCH_SIZE
-        indicies = np.arange(len(X))
         predictions = np.zeros((X.shape[0], self.outputLength))
+        for row, prediction in cached.items():
+            predictions[row, :] = prediction
+
+        # Repeated rows within X only need to be predicted once
+        missRows = {}
+        for row, key in enumerate(keys):
+            if row not in cached:
+                missRows.setdefault(key, []).append(row)
+
+        if missRows:
+            uniqueRows = [rows[0] for rows in missRows.values()]
+            missPredictions = self._predictBatched(X[uniqueRows], batchSize)
+
+            for (key, rows), prediction in zip(missRows.items(), missPredictions):
+                predictions[rows, :] = prediction
+                # Copied so the cache doesn't keep the whole array of predictions alive
+                self._predictionCache.put(key, prediction.copy())
+
+        return predictions
+
+    def predict_distribution(self, X, numSamples=50, batchSize=None):
+        """
+        Returns the mean and variance of numSamples predictions for each row of X with dropout
+        enabled, as an estimate of the model's uncertainty (Monte Carlo dropout).
+
+        The samples of a batch are predicted together by tiling the batch, so each call to sess.run
+        predicts several samples. Each call uses at most batchSize rows in total, which defaults to
+        the batch size used for training, so memory use doesn't grow with numSamples.
+
+        The samples are taken from the model's dropoutLogits if it has them, else from its logits.
+        """
+        if not self._session:
+            raise NotFittedError("This", self.__class__.__name__, "instance is not fitted yet")
+
+        if numSamples < 1:
+            raise ValueError("numSamples must be larger than zero")
+
+        BATCH_SIZE = self.batchSize if batchSize is None else batchSize
+        ROWS_PER_BATCH = min(max(BATCH_SIZE // numSamples, 1), X.shape[0])
+        NUM_BATCHES = -(-X.shape[0] // ROWS_PER_BATCH)
+
+        # With more samples than rows in a batch, each row's samples are split over several calls
+        SAMPLES_PER_CALL = min(max(BATCH_SIZE // ROWS_PER_BATCH, 1), numSamples)
+
+        mean = np.zeros((X.shape[0], self.outputLength))
+        variance = np.zeros((X.shape[0], self.outputLength))
+
+        sampledLogits = self._tensors.logits if self._tensors.dropoutLogits is None \
+                        else self._tensors.dropoutLogits
 
         with self._session.as_default():
-            for batchIndicies in np.array_split(indicies, NUM_BATCHES):
+            for batchIndicies in np.array_split(np.arange(X.shape[0]), NUM_BATCHES):
                 X_batch = X[batchIndicies, :]
-                predictions[batchIndicies, :] = self._tensors.logits.eval(feed_dict={self._tensors.X_in: X_batch})
+
+                samples = []
+                for firstSample in range(0, numSamples, SAMPLES_PER_CALL):
+                    numTiles = min(SAMPLES_PER_CALL, numSamples - firstSample)
+                    X_tiled = scipy.sparse.vstack([X_batch] * numTiles) \
+                              if scipy.sparse.issparse(X_batch) else np.tile(X_batch, (numTiles, 1))
+
+                    callSamples = sampledLogits.eval(
+                        feed_dict={self._tensors.X_in: self._featureFeed(X_tiled),
+                                   self._tensors.dropoutKeepProb: 1 - self.dropoutRate})
+
+                    # The tiled rows are ordered by sample and then by row
+                    samples.append(np.reshape(callSamples,
+                                              (numTiles, len(batchIndicies), self.outputLength)))
+
+                samples = np.concatenate(samples, axis=0)
+                mean[batchIndicies, :] = np.mean(samples, axis=0)
+                variance[batchIndicies, :] = np.var(samples, axis=0)
+
+        return mean, variance
+
+    def enablePredictionCache(self, maxBytes: int=64 * 1024 ** 2) -> PredictionCache:
+        """
+        Caches predictions by a hash of each row of features, evicting the least recently used
+        predictions to keep the cache within maxBytes. The cache is cleared automatically when the
+        model is refit or restored. Sparse features are never cached.
+
+        Returns the cache so that its counters can be inspected.
+        """
+        self._predictionCache = PredictionCache(maxBytes)
+        return self._predictionCache
+
+    def disablePredictionCache(self) -> None:
+        """Removes the prediction cache, if one was enabled"""
+        self._predictionCache = None
+
+    def enablePredictMemoryTracking(self, resetPeak: bool=False) -> None:
+        """
+        Records the memory used by each call to predict in getMemoryReport. This reads the memory
+        usage of the process and makes an extra call to sess.run for the allocator stats, so is
+        disabled by default. Set resetPeak to reset the peak resident set size of the process at the
+        start of each call, which also affects any other measurements of the peak.
+        """
+        self._predictMemoryResetPeak = resetPeak
+
+    def disablePredictMemoryTracking(self) -> None:
+        """Stops recording the memory used by predict"""
+        self._predictMemoryResetPeak = None
+
+    def _getModelIdentity(self) -> str:
+        """Returns a string which changes whenever the model's parameters are replaced"""
+        return "{0}:{1}".format(self._fileManager.getModelDir(), self._modelVersion)
+
+    def _predictBatched(self, X, batchSize=None):
+        """Runs the model on X in batches, batchSize defaults to the batch size used for training"""
+        BATCH_SIZE = self.batchSize if batchSize is None else batchSize
+        if X.shape[0] < BATCH_SIZE:
+            BATCH_SIZE = X.shape[0]
+
+        NUM_BATCHES = X.shape[0] // BATCH_SIZE
+        indicies = np.arange(X.shape[0])
+        predictions = np.zeros((X.shape[0], self.outputLength))
+
+        memoryTracker = None
+        if self._predictMemoryResetPeak is not None:
+            memoryTracker = MemoryTracker(self._allocatorStats, self._predictMemoryResetPeak)
+            memoryTracker.start()
+            memoryTracker.trackBuffer("predictions", predictions)
+
+        with self._session.as_default() as sess:
+            for batchIndicies in np.array_split(indicies, NUM_BATCHES):
+                X_batch = self._featureFeed(X[batchIndicies, :])
+                if memoryTracker is not None:
+                    memoryTracker.trackBuffer("batch", X_batch)
+                if self._stepCallables is not None and not scipy.sparse.issparse(X):
+                    predictions[batchIndicies, :] = self._stepCallables.logits(X_batch)
+                else:
+                    predictions[batchIndicies, :] = self._tensors.logits.eval(
+                        feed_dict={self._tensors.X_in: X_batch})
+
+            if memoryTracker is not None:
+                self._predictMemoryRecord = memoryTracker.record(sess, numRows=X.shape[0])
 
         return predictions
 
+    def getEarlyStoppingReport(self) -> Dict[str, object]:
+        """
+        Returns how many validation checks, epochs and seconds the last call to fit saved by
+        stopping early, compared to the default policy of maxChecksWithoutProgress checks without a
+        lower validation loss. Returns None if fit hasn't been called.
+        """
+        return self._earlyStoppingReport
+
+    def _buildEarlyStoppingReport(self,
+                                  stoppingHelper,
+                                  stopped,
+                                  checksAtStart,
+                                  epochsCompleted,
+                                  epochsRemaining,
+                                  secondsTaken):
+        """
+        Converts the checks saved by the early stopping helper into epochs and seconds using the
+        average cost of a check in this call to fit. The default policy can't train for more than
+        the remaining epochs either, and nothing is saved if training wasn't stopped early.
+        """
+        savings = stoppingHelper.getSavingsReport()
+        checks = savings["checks"] - checksAtStart
+        checksSaved = savings["checksSaved"] if stopped else 0
+
+        epochsSaved = 0.0
+        secondsSaved = 0.0
+        if checks > 0 and epochsCompleted > 0:
+            epochsSaved = min(checksSaved * epochsCompleted / checks, epochsRemaining)
+            secondsSaved = epochsSaved * secondsTaken / epochsCompleted
+
+        return {"checks": savings["checks"],
+                "checksSaved": checksSaved,
+                "epochsSaved": float(epochsSaved),
+                "secondsSaved": float(secondsSaved),
+                "extrapolatedStop": savings["extrapolatedStop"]}
+
+    def getMemoryReport(self) -> Dict[str, object]:
+        """
+        Returns the memory used by the last calls to fit and predict. "fit" is a list with a record
+        for each epoch, and "predict" is a single record, or None if predict hasn't been called
+        since enablePredictMemoryTracking.
+
+        Each record contains the peak and current resident set size of the process in bytes, the
+        largest size of each host buffer in bytes, eg. "batchBytes", and tensorflow's allocator stats
+        if they are available on this device.
+        """
+        return {"fit": [] if self._fitMemoryTracker is None else list(self._fitMemoryTracker.records),
+                "predict": self._predictMemoryRecord}
+
+    def _featureFeed(self, X_batch):
+        """
+        Returns the value to feed to X_in for a batch of features. Scipy sparse matrices are fed as a
+        tf.SparseTensorValue so that they are never densified, in which case X_in must be a
+        tf.sparse_placeholder.
+        """
+        if scipy.sparse.issparse(X_batch):
+            X_batch = X_batch.tocoo()
+            return tf.SparseTensorValue(np.stack([X_batch.row, X_batch.col], axis=1).astype(np.int64),
+                                        X_batch.data.astype(np.float32),
+                                        np.array(X_batch.shape, dtype=np.int64))
+
+        return X_batch
+
+    def _buildStepCallables(self, sess, trainingOp) -> StepCallables:
+        """
+        Returns the step callables for the session, or None if the model has sparse inputs, in
+        which case every step uses sess.run
+        """
+        if isinstance(self._tensors.X_in, tf.SparseTensor):
+            return None
+
+        return StepCallables(sess, self._tensors, trainingOp)
+
+    def _runMultipleSteps(self, sess, X, y, batches):
+        """
+        Runs a training step for each batch in a single call to sess.run, and returns the mean
+        training loss of the steps.
+        """
+        indicies = np.concatenate(batches)
+        stepOffsets = np.cumsum([0] + [len(batch) for batch in batches])
+
+        X_steps, y_steps = X[indicies], y[indicies]
+        if self._fitMemoryTracker is not None:
+            self._fitMemoryTracker.trackBuffer("batch", [X_steps, y_steps])
+
+        multiStep = self._tensors.multiStep
+        return sess.run(multiStep.meanLoss, feed_dict={multiStep.X_in: X_steps,
+                                                       multiStep.y_in: y_steps,
+                                                       multiStep.stepOffsets: stepOffsets,
+                                                       self._tensors.dropoutKeepProb: 1 - self.dropoutRate})
+
+    def _featureMoments(self, X):
+        """Calculates the mean and variance of each feature in a single pass over X in batches"""
+        moments = StreamingMoments()
+        for start in range(0, X.shape[0], self.batchSize):
+            moments.update(X[start:start + self.batchSize])
+
+        return moments
+
+    def _initNormalization(self, sess, moments):
+        """Stores the mean and variance of each feature in the graph"""
+        normalization = self._tensors.normalization
+        sess.run(normalization.assignOp, feed_dict={normalization.meanIn: moments.mean,
+                                                    normalization.varianceIn: moments.getVariance()})
+
+    def _applyAccumulatedGradients(self, sess, numAccumulated):
+        """Applies the mean of the gradients accumulated over numAccumulated batches"""
+        accumulation = self._tensors.accumulation
+        sess.run(accumulation.applyOp, feed_dict={accumulation.numAccumulated: numAccumulated})
+
+    def _checkValidation(self, X_valid, y_valid, subsampleIndicies, stoppingHelper):
+        """
+        Evaluates the validation loss and updates the early stopping helper. Returns the full
+        validation loss, or None if it wasn't evaluated, and whether training should stop.
+
+        If subsampleIndicies is provided early stopping uses the loss of that subset, and the full
+        validation loss is only evaluated when the subset's loss improves.
+        """
+        if subsampleIndicies is None:
+            lossVal = self._evalLossBatched(X_valid, y_valid)
+            return lossVal, stoppingHelper.shouldStop(lossVal)
+
+        lossSubsample = self._evalLossBatched(X_valid[subsampleIndicies], y_valid[subsampleIndicies])
+        shouldStop = stoppingHelper.shouldStop(lossSubsample)
+
+        lossVal = None
+        if stoppingHelper.improvedLastCheck:
+            lossVal = self._evalLossBatched(X_valid, y_valid)
+
+        return lossVal, shouldStop
+
     def _evalLossBatched(self, X, y):
         """Do validation in batches in case the dataset would need 10's of GB"""
-        NUM_BATCHES = len(X) // self.batchSize
-        indicies = np.arange(len(X))
-        losses = np.zeros(len(X))
+        NUM_BATCHES = max(X.shape[0] // self.batchSize, 1)
+        indicies = np.arange(X.shape[0])
+        losses = np.zeros(X.shape[0])
 
         for batchIndicies in np.array_split(indicies, NUM_BATCHES):
             X_batch = X[batchIndicies, :]
             y_batch = y[batchIndicies]
 
-            losses[batchIndicies] = self._tensors.loss.eval(feed_dict={self._tensors.X_in: X_batch,
-                                                                       self._tensors.y_in: y_batch})
+            if self._stepCallables is not None and not scipy.sparse.issparse(X):
+                losses[batchIndicies] = self._stepCallables.loss(X_batch, y_batch)
+            else:
+                losses[batchIndicies] = self._tensors.loss.eval(feed_dict={self._tensors.X_in: self._featureFeed(X_batch),
+                                                                           self._tensors.y_in: y_batch})
 
         return np.average(losses)
+
+class ReplicatedRegressorTrainer:
+    """
+    Trains several TFRegressor models side by side in a single graph and session, which is much
+    faster than training small models one after another, eg. for a grid search over
+    hyperparameters.
+
+    Each model is built in its own variable scope on the same input placeholders, and every training
+    step feeds each batch once and runs all of the models in a single call to sess.run. Each model
+    still gets its own run directory, tensorboard log, checkpoints and early stopping. As the saved
+    graph of each run contains every model, the scope and tensor names of the run's own model are
+    recorded in the run index.
+
+    The models must all use the same batch size, and restoring from a previous run is not
+    supported. After fit the models share the trainer's session, so can each be used to predict
+    until close is called. Fitting one of the models again doesn't affect the others.
+    """
+    def __init__(self, estimators: List[TFRegressor]):
+        if len(set(estimator.batchSize for estimator in estimators)) > 1:
+            raise ValueError("All models must use the same batchSize")
+
+        if any(estimator.restoreFrom is not None for estimator in estimators):
+            raise ValueError("Restoring replicated models is not supported")
+
+        if any(estimator.accumulationSteps > 1 for estimator in estimators):
+            raise ValueError("Gradient accumulation is not supported for replicated models")
+
+        modelNames = [estimator._buildModelNameStr() for estimator in estimators]
+        if len(set(modelNames)) < len(modelNames):
+            raise ValueError("Each model must have different hyperparameters")
+
+        self._estimators = estimators
+        self._batchSize = estimators[0].batchSize
+        self._graph = None
+        self._session = None
+        self._inputs = None
+
+    def close(self):
+        """Ends the session shared by the models, after which none of them can predict"""
+        if self._session:
+            self._session.close()
+
+    def _scope(self, replica: int) -> str:
+        """Returns the variable scope of a replica"""
+        return "replica_{0}".format(replica)
+
+    def _feedDict(self, replicas: List[int], X_batch, y_batch=None, training: bool=False):
+        """Builds a feed_dict which feeds the batch once to the inputs shared by the replicas"""
+        X_in, y_in = self._inputs
+        feed_dict = {X_in: self._estimators[0]._featureFeed(X_batch)}
+
+        if y_batch is not None:
+            feed_dict[y_in] = y_batch
+
+        if training:
+            for replica in replicas:
+                feed_dict[self._estimators[replica]._tensors.dropoutKeepProb] = \
+                    1 - self._estimators[replica].dropoutRate
+
+        return feed_dict
+
+    def _evalLossesBatched(self, replicas: List[int], X, y) -> List[float]:
+        """Evaluates the loss of each replica on X and y, sharing each batch between replicas"""
+        NUM_BATCHES = max(X.shape[0] // self._batchSize, 1)
+        losses = np.zeros((len(replicas), X.shape[0]))
+
+        for batchIndicies in np.array_split(np.arange(X.shape[0]), NUM_BATCHES):
+            feed_dict = self._feedDict(replicas,
+                                       X[batchIndicies, :].astype(np.float32),
+                                       y[batchIndicies].astype(np.float32))
+
+            batchLosses = self._session.run([self._estimators[replica]._tensors.loss
+                                             for replica in replicas], feed_dict=feed_dict)
+            losses[:, batchIndicies] = np.array(batchLosses).reshape(-1, 1)
+
+        return np.average(losses, axis=1)
+
+    def fit(self, X, y, X_valid, y_valid, numEpochs=1, histogramEvery=10):
+        """
+        Fits every model on the training set. Histograms are written every histogramEvery epochs.
+        """
+        self.close()
+        self._graph = tf.Graph()
+        for estimator in self._estimators:
+            estimator._closeSession()
+            estimator._modelVersion += 1
+            estimator._sharedInputs = None
+            estimator._graph = self._graph
+            estimator._fileManager = FileManager(estimator._buildModelNameStr())
+            estimator._fileManager.updateRunIndex({"type": estimator.__class__.__name__,
+                                                   "hyperParams": estimator._buildHyperParamsDict(),
+                                                   "startTime": datetime.utcnow().isoformat(),
+                                                   "epochs": 0,
+                                                   "finished": False})
+
+        with self._graph.as_default():
+            self._inputs = self._estimators[0]._buildInputs(X.shape[1], scipy.sparse.issparse(X))
+
+            for replica, estimator in enumerate(self._estimators):
+                estimator._sharedInputs = self._inputs
+                with tf.variable_scope(self._scope(replica)):
+                    estimator._tensors = estimator._buildGraph(X.shape[1])
+
+            init = tf.global_variables_initializer()
+
+        for replica, estimator in enumerate(self._estimators):
+            runFields = {"scope": self._scope(replica),
+                         "outputName": estimator._tensors.logits.name}
+            if not scipy.sparse.issparse(X):
+                runFields["inputName"] = self._inputs[0].name
+
+            estimator._fileManager.updateRunIndex(runFields)
+
+        stoppingHelpers, restoreHelpers, tensorboardHelpers = [], [], []
+        for replica, estimator in enumerate(self._estimators):
+            scope = self._scope(replica)
+            stoppingHelpers.append(EarlyStoppingHelper(scope=scope + "/"))
+            restoreHelpers.append(CheckpointAndRestoreHelper(
+                estimator._fileManager.getModelDirAndPrefix(),
+                False,
+                self._graph,
+                varList=self._graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=scope + "/")))
+            tensorboardHelpers.append(TensorboardLogHelper(estimator._fileManager.getModelDir(),
+                                                           self._graph,
+                                                           ["LossTrain", "LossVal", "BatchTimeAvg"],
+                                                           False,
+                                                           scope,
+                                                           histogramEvery=histogramEvery))
+
+        self._session = tf.Session(graph=self._graph)
+        for estimator in self._estimators:
+            estimator._session = self._session
+            estimator._ownsSession = False
+
+            # Used by each model's predict after training, the replicas are trained together here
+            estimator._stepCallables = estimator._buildStepCallables(self._session,
+                                                                     estimator._tensors.trainingOp)
+
+        bestLossVals = [np.infty] * len(self._estimators)
+        activeReplicas = list(range(len(self._estimators)))
+        with self._graph.as_default(), self._session.as_default() as sess:
+            sess.run(init)
+
+            # Every model sees the same features, so their statistics only need calculating once
+            normalized = [estimator for estimator in self._estimators
+                          if estimator._tensors.normalization is not None]
+            if normalized:
+                moments = normalized[0]._featureMoments(X)
+                for estimator in normalized:
+                    estimator._initNormalization(sess, moments)
+
+            progressCalc = ProgressCalculator(numEpochs)
+            progressCalc.start()
+            for epoch in range(numEpochs):
+                randomIndicies = np.random.permutation(X.shape[0])
+                NUM_BATCHES = X.shape[0] // self._batchSize
+
+                for replica in activeReplicas:
+                    if self._estimators[replica]._tensors.metrics is not None:
+                        sess.run(self._estimators[replica]._tensors.metrics.resetOp)
+
+                batchTimes = []
+                for batchNumber, batchIndicies in enumerate(np.array_split(randomIndicies, NUM_BATCHES)):
+                    batchStart = time.time()
+
+                    feed_dict = self._feedDict(activeReplicas,
+                                               X[batchIndicies].astype(np.float32),
+                                               y[batchIndicies].astype(np.float32),
+                                               training=True)
+
+                    sess.run([[self._estimators[replica]._tensors.trainingOp] +
+                              _metricsUpdateFetches(self._estimators[replica]._tensors)
+                              for replica in activeReplicas], feed_dict=feed_dict)
+
+                    batchTimes.append(time.time() - batchStart)
+                    print("Batch:", batchNumber, "/", NUM_BATCHES, "{0:.4f}".format(batchTimes[-1]) + "s", end="\r")
+
+                # Calculate and log the losses for this epoch, from the streaming metrics where the
+                # model provides them
+                lossesTrain = sess.run([self._estimators[replica]._tensors.loss
+                                        if self._estimators[replica]._tensors.metrics is None
+                                        else self._estimators[replica]._tensors.metrics.values["loss"]
+                                        for replica in activeReplicas], feed_dict=feed_dict)
+                lossesVal = self._evalLossesBatched(activeReplicas, X_valid, y_valid)
+                progressCalc.updateInterval(1)
+                print("\033[K" + "Epoch: {0}\tBest validation loss: {1}\tTime Remaining: {2}".format(
+                    epoch, np.min(lossesVal), progressCalc.getTimeStampRemaining()))
+
+                for replica, lossTrain, lossVal in zip(list(activeReplicas), lossesTrain, lossesVal):
+                    estimator = self._estimators[replica]
+
+                    tensorboardHelpers[replica].writeSummary(sess, [lossTrain, lossVal, np.average(batchTimes)])
+                    restoreHelpers[replica].saveCheckpoint(sess, epoch, lossVal)
+
+                    bestLossVals[replica] = min(bestLossVals[replica], float(lossVal))
+                    estimator._fileManager.updateRunIndex({"epochs": epoch + 1,
+                                                           "lossVal": float(lossVal),
+                                                           "bestLossVal": bestLossVals[replica]})
+
+                    estimator._onEpochComplete(epoch)
+
+                    if stoppingHelpers[replica].shouldStop(lossVal):
+                        print("Early stopping", estimator._buildModelNameStr(), "at epoch:", epoch)
+                        activeReplicas.remove(replica)
+
+                if not activeReplicas:
+                    break
+
+            for replica, estimator in enumerate(self._estimators):
+                stoppingHelpers[replica].restoreBestModelParams()
+                tensorboardHelpers[replica].close()
+                estimator._fileManager.updateRunIndex({"finished": True})
+
+                # Fitting the model on its own builds its own inputs
+                estimator._sharedInputs = None
+
+        print("Time taken:", progressCalc.timeTaken())
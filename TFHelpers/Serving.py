@@ -0,0 +1,154 @@
+"""
+Tools for serving predictions from trained models.
+"""
+
+from collections import OrderedDict
+import hashlib
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+class PredictionCache:
+    """
+    A least recently used cache of predictions keyed by a hash of each row of features. The memory
+    used by the cached predictions and their keys is bounded by maxBytes.
+
+    Predictions are only valid for the model which produced them, so provide the identity of the
+    model to setModelIdentity before using the cache. The cache is cleared whenever this changes, eg.
+    when the model is refit or restored.
+    """
+    # Approximate memory used by each entry on top of its key and prediction
+    ENTRY_OVERHEAD_BYTES = 200
+
+    # Arrays which aren't C contiguous are copied this many rows at a time to be hashed
+    HASH_CHUNK_ROWS = 4096
+
+    # Multipliers of the splitmix64 finalizer, which mixes each word of a row into its hash
+    _MIX_MULTIPLIERS = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+    _MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+
+    def __init__(self, maxBytes: int=64 * 1024 ** 2):
+        if maxBytes <= 0:
+            raise ValueError("maxBytes must be larger than zero")
+
+        self._maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._currentBytes = 0
+        self._modelIdentity = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def setModelIdentity(self, modelIdentity: str) -> None:
+        """Clears the cache if modelIdentity is different to the identity it was last set to"""
+        if modelIdentity != self._modelIdentity:
+            self.clear()
+            self._modelIdentity = modelIdentity
+
+    def clear(self) -> None:
+        """Removes every entry, the counters are not reset"""
+        self._entries.clear()
+        self._currentBytes = 0
+
+    def hashRows(self, X: np.ndarray) -> List[bytes]:
+        """
+        Returns a 16 byte key for each row of X. Every row of a C contiguous array is hashed at once,
+        other arrays are copied and hashed a chunk of rows at a time. The dtype and number of columns
+        are included in each key so that rows with the same bytes but a different interpretation
+        don't collide.
+        """
+        if X.flags.c_contiguous:
+            return self._hashContiguousRows(X)
+
+        keys = []
+        for start in range(0, X.shape[0], self.HASH_CHUNK_ROWS):
+            keys.extend(self._hashContiguousRows(
+                np.ascontiguousarray(X[start:start + self.HASH_CHUNK_ROWS])))
+
+        return keys
+
+    def _hashContiguousRows(self, X: np.ndarray) -> List[bytes]:
+        """
+        Hashes each row of a C contiguous array as two 64 bit hashes, which are seeded from the
+        SHA-256 hash of the format and then mix in each 64 bit word of the row in turn. Each step is
+        done for every row at once.
+        """
+        rowFormat = "{0}:{1}".format(X.dtype.str, X.shape[1]).encode()
+        seeds = np.frombuffer(hashlib.sha256(rowFormat).digest()[:16], dtype=np.uint64)
+
+        rowBytes = X.view(np.uint8).reshape(X.shape[0], X.dtype.itemsize * X.shape[1])
+        if rowBytes.shape[1] % 8:
+            # Padding is unambiguous as every row of the format has the same length
+            padded = np.zeros((X.shape[0], rowBytes.shape[1] + 8 - rowBytes.shape[1] % 8),
+                              dtype=np.uint8)
+            padded[:, :rowBytes.shape[1]] = rowBytes
+            rowBytes = padded
+
+        words = rowBytes.view(np.uint64)
+        hashes = np.tile(seeds, (X.shape[0], 1))
+        for column in range(words.shape[1]):
+            hashes ^= words[:, column, None]
+            hashes ^= hashes >> self._MIX_SHIFTS[0]
+            hashes *= self._MIX_MULTIPLIERS[0]
+            hashes ^= hashes >> self._MIX_SHIFTS[1]
+            hashes *= self._MIX_MULTIPLIERS[1]
+            hashes ^= hashes >> self._MIX_SHIFTS[2]
+
+        return hashes.view(np.dtype((np.void, 16))).ravel().tolist()
+
+    def get(self, key: bytes):
+        """Returns the cached prediction for key, or None if it isn't cached"""
+        prediction = self._entries.get(key)
+        if prediction is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+        return prediction
+
+    def put(self, key: bytes, prediction: np.ndarray) -> None:
+        """Caches a prediction, evicting the least recently used entries to stay within maxBytes"""
+        entryBytes = self._entryBytes(key, prediction)
+        if entryBytes > self._maxBytes:
+            return
+
+        if key in self._entries:
+            self._currentBytes -= self._entryBytes(key, self._entries.pop(key))
+
+        self._entries[key] = prediction
+        self._currentBytes += entryBytes
+
+        while self._currentBytes > self._maxBytes:
+            evictedKey, evictedPrediction = self._entries.popitem(last=False)
+            self._currentBytes -= self._entryBytes(evictedKey, evictedPrediction)
+            self.evictions += 1
+
+    def lookupRows(self, X: np.ndarray) -> Tuple[List[bytes], Dict[int, np.ndarray]]:
+        """
+        Returns the key for each row of X, and a dict of row index to cached prediction for the rows
+        which are cached.
+        """
+        keys = self.hashRows(X)
+        cached = {}
+        for row, key in enumerate(keys):
+            prediction = self.get(key)
+            if prediction is not None:
+                cached[row] = prediction
+
+        return keys, cached
+
+    def getStats(self) -> Dict[str, Any]:
+        """Returns the counters and the current size of the cache"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._currentBytes,
+                "maxBytes": self._maxBytes}
+
+    def _entryBytes(self, key: bytes, prediction: np.ndarray) -> int:
+        return len(key) + prediction.nbytes + self.ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,99 @@
+"""
+Shares datasets between processes without each process holding its own copy, eg. when several
+models are trained on the same data in parallel worker processes.
+"""
+
+import atexit
+import os
+import re
+import shutil
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+def _defaultSharedDir() -> str:
+    """Returns /dev/shm where POSIX shared memory is mounted, otherwise the temporary directory"""
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) \
+           else tempfile.gettempdir()
+
+class SharedDatasetBroker:
+    """
+    Writes numpy arrays once to memory mapped files, by default in /dev/shm so they are held in
+    shared memory rather than on disk. Worker processes attach to the arrays by name using
+    attachSharedArrays and the handle of this broker, which gives them read only views of the same
+    memory rather than copies.
+
+    The process which created the broker owns the files and removes them when close is called, when
+    used as a context manager, or when the process exits.
+    """
+    def __init__(self, rootDir: str=None):
+        self._dir = tempfile.mkdtemp(prefix="TFHelpers-shared-",
+                                     dir=_defaultSharedDir() if rootDir is None else rootDir)
+        self._ownerPid = os.getpid()
+        self._names = []
+
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def getHandle(self) -> str:
+        """Returns the string that worker processes need to attach to the shared arrays"""
+        return self._dir
+
+    def getNames(self) -> List[str]:
+        """Returns the names of the arrays that have been shared"""
+        return list(self._names)
+
+    def share(self, name: str, array) -> np.ndarray:
+        """
+        Copies a dense array into shared memory under name and returns a read only view of the
+        shared copy, which can be used in place of the original array in this process.
+        """
+        if not re.match(r"^[A-Za-z0-9_\-]+$", name):
+            raise ValueError("Array names may only contain letters, numbers, underscores and hyphens")
+
+        if name in self._names:
+            raise ValueError("An array has already been shared as {0}".format(name))
+
+        path = os.path.join(self._dir, name + ".npy")
+
+        # Written to a temporary file first so a worker never attaches to a partial array
+        tempPath = path + ".tmp"
+        with open(tempPath, "wb") as f:
+            np.save(f, np.asarray(array), allow_pickle=False)
+        os.replace(tempPath, path)
+
+        self._names.append(name)
+
+        return np.load(path, mmap_mode="r")
+
+    def shareArrays(self, **arrays) -> Dict[str, np.ndarray]:
+        """Shares each keyword argument under its name, eg. shareArrays(X=X, y=y)"""
+        return {name: self.share(name, array) for name, array in arrays.items()}
+
+    def close(self) -> None:
+        """
+        Removes the shared arrays. Views which are already attached remain valid until they are
+        released, but no new workers can attach. Does nothing in processes other than the owner.
+        """
+        if os.getpid() != self._ownerPid:
+            return
+
+        shutil.rmtree(self._dir, ignore_errors=True)
+        self._names = []
+
+def attachSharedArrays(handle: str, names: List[str]=None) -> Dict[str, np.ndarray]:
+    """
+    Returns read only views of the arrays shared by the SharedDatasetBroker with the given handle,
+    keyed by name. Provide names to only attach to some of the arrays.
+    """
+    if names is None:
+        names = sorted(fileName[:-len(".npy")] for fileName in os.listdir(handle)
+                       if fileName.endswith(".npy"))
+
+    return {name: np.load(os.path.join(handle, name + ".npy"), mmap_mode="r") for name in names}
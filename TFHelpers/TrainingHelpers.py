@@ -3,6 +3,8 @@ Utilities that are useful during the training phase, such calculating the time r
 stopping.
 """
 import datetime
+import os
+import sys
 import time
 from typing import Any, Dict
 import warnings
@@ -11,19 +13,289 @@ import numpy as np
 
 import tensorflow as tf
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# The graph collection holding the ops built by buildAllocatorStats, in the order of
+# ALLOCATOR_STATS_NAMES
+ALLOCATOR_STATS = "allocatorStats"
+ALLOCATOR_STATS_NAMES = ["allocatorBytesInUse", "allocatorMaxBytesInUse", "allocatorBytesLimit"]
+
+def _maxRSSFromRusage() -> int:
+    """
+    Returns the peak resident set size reported by getrusage in bytes, or 0 on platforms without
+    getrusage
+    """
+    if resource is None:
+        return 0
+
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, Linux reports kilobytes
+    return maxRSS if sys.platform == "darwin" else maxRSS * 1024
+
+def getCurrentRSSBytes() -> int:
+    """Returns the current resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not available outside of Linux, the peak is the best estimate we have
+        return _maxRSSFromRusage()
+
+def getPeakRSSBytes() -> int:
+    """
+    Returns the peak resident set size of this process in bytes, since the process started or
+    resetPeakRSS was last called.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    return _maxRSSFromRusage()
+
+def resetPeakRSS() -> bool:
+    """
+    Resets the peak resident set size to the current resident set size. This is only supported on
+    Linux, returns False if the peak could not be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+def getBufferBytes(value) -> int:
+    """
+    Returns the number of bytes held by the arrays in value, which may be a numpy array, a scipy
+    sparse matrix, a tf.SparseTensorValue, or a list, tuple or dict of these.
+    """
+    if value is None:
+        return 0
+
+    if isinstance(value, dict):
+        return sum(getBufferBytes(item) for item in value.values())
+
+    if isinstance(value, (list, tuple)):
+        return sum(getBufferBytes(item) for item in value)
+
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+
+    # Scipy sparse matrices keep their values in several arrays depending on the format
+    return sum(int(getattr(value, name).nbytes) for name in ["data", "indices", "indptr", "row", "col"]
+               if hasattr(value, name))
+
+def buildAllocatorStats() -> Dict[str, tf.Tensor]:
+    """
+    Returns ops in the default graph which report the memory used by tensorflow's allocator for the
+    device they are placed on. The ops are only added the first time this is called for a graph, and
+    are found in the ALLOCATOR_STATS collection after that. Returns an empty dict if this build of
+    tensorflow doesn't provide them.
+    """
+    graph = tf.get_default_graph()
+    existing = graph.get_collection(ALLOCATOR_STATS)
+    if existing:
+        return dict(zip(ALLOCATOR_STATS_NAMES, existing))
+
+    try:
+        memoryStats = tf.contrib.memory_stats
+    except (AttributeError, ImportError):
+        return {}
+
+    # Absolute name scope, so the ops are shared wherever this is called from
+    with tf.name_scope("memoryStats/"):
+        stats = [memoryStats.BytesInUse(), memoryStats.MaxBytesInUse(), memoryStats.BytesLimit()]
+
+    for stat in stats:
+        graph.add_to_collection(ALLOCATOR_STATS, stat)
+
+    return dict(zip(ALLOCATOR_STATS_NAMES, stats))
+
+class MemoryTracker:
+    """
+    Records the memory used during each interval of work, eg. each epoch of training. Each record
+    contains the peak and current resident set size of the process, the largest size seen for each
+    named host buffer, and tensorflow's allocator stats if allocatorStats is provided (see
+    buildAllocatorStats).
+
+    The peak resident set size is reset at the start of each interval if resetPeak is True, which
+    also affects any other measurements of the process's peak. Otherwise each record contains the
+    peak of the process so far.
+    """
+
+    def __init__(self, allocatorStats: Dict[str, tf.Tensor]=None, resetPeak: bool=True):
+        self._allocatorStats = {} if allocatorStats is None else allocatorStats
+        self._resetPeak = resetPeak
+        self._bufferBytes = {}
+        self._persistentBufferBytes = {}
+        self.records = []
+
+    def start(self) -> None:
+        """
+        Resets the peak resident set size if resetPeak was set, and the sizes of buffers which aren't
+        persistent. Call this before each interval.
+        """
+        if self._resetPeak:
+            resetPeakRSS()
+
+        self._bufferBytes = {}
+
+    def trackBuffer(self, name: str, value, persistent: bool=False) -> None:
+        """
+        Records the size of a host buffer, keeping the largest size seen for each name. Set
+        persistent for buffers which live for every interval, eg. a validation set, so they only
+        need to be tracked once.
+        """
+        bufferBytes = self._persistentBufferBytes if persistent else self._bufferBytes
+        bufferBytes[name] = max(bufferBytes.get(name, 0), getBufferBytes(value))
+
+    def record(self, sess=None, **fields) -> Dict[str, Any]:
+        """
+        Ends the current interval, returning its record and adding it to records. Any keyword
+        arguments are added to the record, eg. the epoch number. A new interval is then started.
+        """
+        record = dict(fields)
+        record["peakRSSBytes"] = getPeakRSSBytes()
+        record["currentRSSBytes"] = getCurrentRSSBytes()
+        record.update({name + "Bytes": size for name, size in self._persistentBufferBytes.items()})
+        record.update({name + "Bytes": size for name, size in self._bufferBytes.items()})
+
+        if sess is not None and self._allocatorStats:
+            try:
+                record.update({name: int(value)
+                               for name, value in sess.run(self._allocatorStats).items()})
+            except tf.errors.OpError:
+                # The stats aren't available for every device, so don't try again
+                self._allocatorStats = {}
+
+        self.records.append(record)
+        self.start()
+
+        return record
+
+class StreamingMoments:
+    """
+    Calculates the mean and variance of each column of a dataset in a single pass over batches of
+    its rows, so the whole dataset never needs to be copied. Batches are combined using the parallel
+    algorithm of Chan et al. which is numerically stable.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._sumSquaredDiffs = None
+
+    def update(self, batch) -> None:
+        """Adds a batch of rows to the statistics"""
+        batch = np.asarray(batch, dtype=np.float64)
+        batchCount = batch.shape[0]
+        if batchCount == 0:
+            return
+
+        batchMean = batch.mean(axis=0)
+        batchSumSquaredDiffs = np.square(batch - batchMean).sum(axis=0)
+
+        if self.count == 0:
+            self.count = batchCount
+            self.mean = batchMean
+            self._sumSquaredDiffs = batchSumSquaredDiffs
+            return
+
+        totalCount = self.count + batchCount
+        delta = batchMean - self.mean
+        self.mean = self.mean + delta * batchCount / totalCount
+        self._sumSquaredDiffs = self._sumSquaredDiffs + batchSumSquaredDiffs + \
+                                np.square(delta) * self.count * batchCount / totalCount
+        self.count = totalCount
+
+    def getVariance(self) -> np.ndarray:
+        """Returns the population variance of each column"""
+        if self.count == 0:
+            raise RuntimeError("update must be called before the variance can be calculated")
+
+        return self._sumSquaredDiffs / self.count
+
 class EarlyStoppingHelper:
-    """Contains most of the functionality needed to implement early stopping."""
+    """
+    Contains most of the functionality needed to implement early stopping.
+
+    By default progress is a validation loss lower than any before it. Noisy losses can instead be
+    smoothed with an exponential moving average ("ema") or the median of a window of recent checks
+    ("median"), and minDelta and relativeDelta set how much lower a loss must be to count as
+    progress. The best model parameters are always those with the lowest unsmoothed loss.
+
+    Set extrapolationWindow to also stop once a straight line fitted to that many recent smoothed
+    losses predicts they won't make progress within the remaining patience.
+
+    The default policy is run alongside whichever is chosen, so that getSavingsReport can report
+    how many checks were saved compared to it.
+    """
+
+    SMOOTHING_TYPES = (None, "ema", "median")
+
+    def __init__(self,
+                 maxChecksWithoutProgress: int=20,
+                 scope: str=None,
+                 smoothing: str=None,
+                 smoothingWindow: int=5,
+                 minDelta: float=0.0,
+                 relativeDelta: float=0.0,
+                 extrapolationWindow: int=None):
+        """
+        Provide scope to only save and restore the variables within that scope, for example if
+        several models share a graph.
+        """
+        if smoothing not in self.SMOOTHING_TYPES:
+            raise ValueError("smoothing must be one of {0}".format(self.SMOOTHING_TYPES))
+
+        if smoothingWindow < 1:
+            raise ValueError("smoothingWindow must be larger than zero")
+
+        if minDelta < 0 or relativeDelta < 0:
+            raise ValueError("minDelta and relativeDelta must not be negative")
+
+        if extrapolationWindow is not None and extrapolationWindow < 2:
+            raise ValueError("extrapolationWindow must be at least 2")
 
-    def __init__(self, maxChecksWithoutProgress: int=20):
         self.MAX_CHECKS_WITHOUT_PROGRESS = maxChecksWithoutProgress
+        self._scope = scope
+        self._smoothing = smoothing
+        self._smoothingWindow = smoothingWindow
+        self._minDelta = minDelta
+        self._relativeDelta = relativeDelta
+        self._extrapolationWindow = extrapolationWindow
 
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets every loss seen so far, so the helper can be reused for another run"""
         self.bestLossVal = np.infty
         self.checksSinceLastProgress = 0
         self.bestModelParams = None
+        self.improvedLastCheck = False
+
+        self._losses = []
+        self._smoothedLosses = []
+        self._bestSmoothedLossVal = np.infty
+        self._extrapolatedStop = False
+
+        # The default policy of patience on the raw loss, used to report the checks saved
+        self._baselineChecksSinceLastProgress = 0
+        self._baselineStopCheck = None
 
     def _getModelParams(self) -> Dict[str, Any]:
         """Returns a dictionary of tf.GraphKeys.GLOBAL_VARIABLES"""
-        gvars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        gvars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=self._scope)
         return {gvar.op.name: value
                 for gvar, value in zip(gvars, tf.get_default_session().run(gvars))}
 
@@ -46,17 +318,118 @@ class EarlyStoppingHelper:
 
         return success
 
+    def getState(self) -> Dict[str, Any]:
+        """Returns the state needed to continue early stopping with setState, eg. after a restart"""
+        return {"bestLossVal": self.bestLossVal,
+                "checksSinceLastProgress": self.checksSinceLastProgress,
+                "bestModelParams": self.bestModelParams,
+                "losses": list(self._losses),
+                "smoothedLosses": list(self._smoothedLosses),
+                "bestSmoothedLossVal": self._bestSmoothedLossVal,
+                "baselineChecksSinceLastProgress": self._baselineChecksSinceLastProgress,
+                "baselineStopCheck": self._baselineStopCheck}
+
+    def setState(self, state: Dict[str, Any]) -> None:
+        """Restores the state returned by getState"""
+        self.bestLossVal = state["bestLossVal"]
+        self.checksSinceLastProgress = state["checksSinceLastProgress"]
+        self.bestModelParams = state["bestModelParams"]
+
+        # Not present in the state of runs saved before the smoothed policies were added
+        self._losses = list(state.get("losses", []))
+        self._smoothedLosses = list(state.get("smoothedLosses", []))
+        self._bestSmoothedLossVal = state.get("bestSmoothedLossVal", self.bestLossVal)
+        self._baselineChecksSinceLastProgress = state.get("baselineChecksSinceLastProgress",
+                                                          self.checksSinceLastProgress)
+        self._baselineStopCheck = state.get("baselineStopCheck")
+
     def shouldStop(self, lossVal: float) -> bool:
         """Returns True if you should stop. Check this at the end of each epoch."""
+        self._losses.append(lossVal)
 
-        if lossVal < self.bestLossVal:
+        self.improvedLastCheck = lossVal < self.bestLossVal
+        if self.improvedLastCheck:
             self.bestLossVal = lossVal
-            self.checksSinceLastProgress = 0
             self.bestModelParams = self._getModelParams()
+            self._baselineChecksSinceLastProgress = 0
+        else:
+            self._baselineChecksSinceLastProgress += 1
+
+        if self._baselineStopCheck is None and \
+           self._baselineChecksSinceLastProgress > self.MAX_CHECKS_WITHOUT_PROGRESS:
+            self._baselineStopCheck = len(self._losses)
+
+        smoothedLossVal = self._smooth(lossVal)
+        self._smoothedLosses.append(smoothedLossVal)
+
+        if smoothedLossVal < self._bestSmoothedLossVal - self._getThreshold():
+            self._bestSmoothedLossVal = smoothedLossVal
+            self.checksSinceLastProgress = 0
         else:
             self.checksSinceLastProgress += 1
 
-        return self.checksSinceLastProgress > self.MAX_CHECKS_WITHOUT_PROGRESS
+        self._extrapolatedStop = self.checksSinceLastProgress > 0 and self._isImprovementNegligible()
+
+        return self.checksSinceLastProgress > self.MAX_CHECKS_WITHOUT_PROGRESS or \
+               self._extrapolatedStop
+
+    def getSavingsReport(self) -> Dict[str, Any]:
+        """
+        Compares the checks made so far with the number the default policy of
+        maxChecksWithoutProgress checks without a lower loss would have made. If that policy
+        wouldn't have stopped yet it would have needed at least enough checks to run out of
+        patience, so checksSaved is a lower bound, and it is negative if that policy would have
+        stopped sooner.
+        """
+        numChecks = len(self._losses)
+        if self._baselineStopCheck is not None:
+            baselineChecks = self._baselineStopCheck
+        else:
+            baselineChecks = numChecks + self.MAX_CHECKS_WITHOUT_PROGRESS + 1 - \
+                             self._baselineChecksSinceLastProgress
+
+        return {"checks": numChecks,
+                "baselineChecks": baselineChecks,
+                "checksSaved": baselineChecks - numChecks,
+                "extrapolatedStop": self._extrapolatedStop}
+
+    def _smooth(self, lossVal: float) -> float:
+        """Returns the smoothed loss including lossVal, which has already been added to the losses"""
+        if self._smoothing == "ema":
+            if not self._smoothedLosses:
+                return lossVal
+
+            # The usual span parameterisation, so a window of N is comparable to an N check median
+            alpha = 2 / (self._smoothingWindow + 1)
+            return alpha * lossVal + (1 - alpha) * self._smoothedLosses[-1]
+
+        if self._smoothing == "median":
+            return float(np.median(self._losses[-self._smoothingWindow:]))
+
+        return lossVal
+
+    def _getThreshold(self) -> float:
+        """Returns how much the smoothed loss must decrease by to count as progress"""
+        if not np.isfinite(self._bestSmoothedLossVal):
+            return self._minDelta
+
+        return max(self._minDelta, self._relativeDelta * abs(self._bestSmoothedLossVal))
+
+    def _isImprovementNegligible(self) -> bool:
+        """
+        Fits a straight line to the recent smoothed losses, and returns True if it predicts the best
+        smoothed loss won't be beaten by more than the threshold before patience runs out.
+        """
+        if self._extrapolationWindow is None or len(self._smoothedLosses) < self._extrapolationWindow:
+            return False
+
+        recent = self._smoothedLosses[-self._extrapolationWindow:]
+        slope = np.polyfit(np.arange(len(recent)), recent, 1)[0]
+
+        remainingChecks = self.MAX_CHECKS_WITHOUT_PROGRESS + 1 - self.checksSinceLastProgress
+        predictedLossVal = recent[-1] + min(slope, 0.0) * remainingChecks
+
+        return bool(self._bestSmoothedLossVal - predictedLossVal <= self._getThreshold())
 
 class ProgressCalculator:
     """
@@ -123,6 +496,292 @@ class ProgressCalculator:
         timestamp = datetime.timedelta(seconds=timeSinceStart)
         return str(timestamp)
 
+class ValidationScheduler:
+    """
+    Decides when validation should be run during training. Validation can be due after a number of
+    training steps, after a number of seconds, or whichever comes first if both are provided. If
+    neither is provided validation is run once at the end of each epoch.
+    """
+
+    def __init__(self, everySteps: int=None, everySeconds: float=None):
+        if everySteps is not None and everySteps < 1:
+            raise ValueError("everySteps must be larger than zero")
+
+        if everySeconds is not None and everySeconds <= 0:
+            raise ValueError("everySeconds must be larger than zero")
+
+        self._everySteps = everySteps
+        self._everySeconds = everySeconds
+        self._stepsSinceCheck = 0
+        self._lastCheckTime = 0
+
+    def isPerEpoch(self) -> bool:
+        """Returns True if validation should only be run at the end of each epoch"""
+        return self._everySteps is None and self._everySeconds is None
+
+    def start(self) -> None:
+        """Records the current time as the time of the last check. Call this before training."""
+        self._stepsSinceCheck = 0
+        self._lastCheckTime = time.time()
+
+    def getState(self) -> Dict[str, Any]:
+        """Returns the state needed to continue the schedule with setState, eg. after a restart"""
+        return {"stepsSinceCheck": self._stepsSinceCheck}
+
+    def setState(self, state: Dict[str, Any]) -> None:
+        """Restores the state returned by getState, the timer is restarted"""
+        self._stepsSinceCheck = state["stepsSinceCheck"]
+        self._lastCheckTime = time.time()
+
+    def step(self, numSteps: int=1) -> bool:
+        """
+        Call this after each training step, or after several steps providing the number completed.
+        Returns True if validation is due, in which case the counters are reset.
+        """
+        if self.isPerEpoch():
+            return False
+
+        self._stepsSinceCheck += numSteps
+
+        isDue = (self._everySteps is not None and self._stepsSinceCheck >= self._everySteps) or \
+                (self._everySeconds is not None and
+                 time.time() - self._lastCheckTime >= self._everySeconds)
+
+        if isDue:
+            self.start()
+
+        return isDue
+
+class ImportanceSampler:
+    """
+    Draws training batches in proportion to an estimate of each example's loss, so that more steps
+    are spent on the examples the model predicts badly. Each example drawn is given a weight which
+    keeps the weighted mean loss of a batch an unbiased estimate of the mean loss over every
+    example.
+
+    The estimates are a moving average of the losses seen in training steps, examples that haven't
+    been seen yet use the mean of those that have. A fraction uniformMix of each batch's probability
+    is spread uniformly so no example is starved. The probabilities are recalculated every
+    refreshEvery batches, as this takes time proportional to the number of examples.
+    """
+
+    def __init__(self, smoothing: float=0.5, uniformMix: float=0.1, refreshEvery: int=10):
+        if not 0 <= smoothing < 1:
+            raise ValueError("smoothing must be at least 0 and less than 1")
+
+        if not 0 < uniformMix <= 1:
+            raise ValueError("uniformMix must be larger than 0 and no larger than 1")
+
+        if refreshEvery < 1:
+            raise ValueError("refreshEvery must be larger than zero")
+
+        self._smoothing = smoothing
+        self._uniformMix = uniformMix
+        self._refreshEvery = refreshEvery
+
+        self._losses = None
+        self._seen = None
+        self._probabilities = None
+        self._cumulative = None
+        self._batchesSinceRefresh = 0
+
+    def start(self, numExamples: int) -> None:
+        """Resets the estimates for a dataset of numExamples examples. Call this before training."""
+        self._losses = np.zeros(numExamples)
+        self._seen = np.zeros(numExamples, dtype=bool)
+        self._refresh()
+
+    def getState(self) -> Dict[str, Any]:
+        """Returns the state needed to continue sampling with setState, eg. after a restart"""
+        return {"losses": self._losses, "seen": self._seen}
+
+    def setState(self, state: Dict[str, Any]) -> None:
+        """Restores the state returned by getState"""
+        self._losses = state["losses"]
+        self._seen = state["seen"]
+        self._refresh()
+
+    def sampleBatch(self, batchSize: int):
+        """
+        Returns the indicies of a batch of examples drawn with replacement, and the weight each
+        example's loss should be multiplied by.
+        """
+        if self._batchesSinceRefresh >= self._refreshEvery:
+            self._refresh()
+        self._batchesSinceRefresh += 1
+
+        indicies = np.searchsorted(self._cumulative,
+                                   np.random.rand(batchSize) * self._cumulative[-1],
+                                   side="right")
+        indicies = np.minimum(indicies, len(self._losses) - 1)
+
+        weights = 1 / (len(self._losses) * self._probabilities[indicies])
+
+        return indicies, weights.astype(np.float32)
+
+    def update(self, indicies, losses) -> None:
+        """Updates the estimates with the losses of a batch, eg. from the training step"""
+        previous = np.where(self._seen[indicies], self._losses[indicies], losses)
+        self._losses[indicies] = self._smoothing * previous + (1 - self._smoothing) * losses
+        self._seen[indicies] = True
+
+    def _refresh(self) -> None:
+        """Recalculates the probability of drawing each example from the current estimates"""
+        estimates = self._losses.copy()
+        if self._seen.any():
+            estimates[~self._seen] = self._losses[self._seen].mean()
+
+        total = estimates.sum()
+        if total > 0:
+            self._probabilities = (1 - self._uniformMix) * estimates / total + \
+                                  self._uniformMix / len(estimates)
+        else:
+            self._probabilities = np.full(len(estimates), 1 / len(estimates))
+
+        self._cumulative = np.cumsum(self._probabilities)
+        self._batchesSinceRefresh = 0
+
+class MagnitudePruner:
+    """
+    Gradually zeroes the smallest weights of a model's kernels during training. The fraction of each
+    kernel which is zero follows the polynomial schedule of Zhu and Gupta, rising quickly from zero
+    at beginStep and levelling off at targetSparsity at endStep.
+
+    Every pruneEverySteps steps the weights with the smallest magnitudes are masked. The mask is
+    applied after every training step by the op returned from build, so the optimizer can't revive
+    weights which have been pruned. Masks are held in local variables rather than being saved,
+    since they can be recovered from which weights are zero.
+    """
+
+    def __init__(self,
+                 targetSparsity: float=0.8,
+                 beginStep: int=0,
+                 endStep: int=1000,
+                 pruneEverySteps: int=100,
+                 exponent: float=3.0):
+        if not 0 <= targetSparsity < 1:
+            raise ValueError("targetSparsity must be at least 0 and less than 1")
+
+        if beginStep < 0 or endStep <= beginStep:
+            raise ValueError("endStep must be larger than beginStep, which must not be negative")
+
+        if pruneEverySteps < 1:
+            raise ValueError("pruneEverySteps must be larger than zero")
+
+        self._targetSparsity = targetSparsity
+        self._beginStep = beginStep
+        self._endStep = endStep
+        self._pruneEverySteps = pruneEverySteps
+        self._exponent = exponent
+
+        self._kernels = []
+        self._masks = []
+        self._maskIn = []
+        self._assignMaskOps = []
+        self._applyMaskOp = None
+        self._lastPruneStep = None
+
+    def getSparsityAtStep(self, step: int) -> float:
+        """Returns the fraction of each kernel which should be zero after step"""
+        if step < self._beginStep:
+            return 0.0
+
+        progress = min((step - self._beginStep) / (self._endStep - self._beginStep), 1.0)
+        return self._targetSparsity * (1 - (1 - progress) ** self._exponent)
+
+    def build(self, kernels, trainingOp):
+        """
+        Builds the masks for kernels in the default graph, and returns an op which runs trainingOp
+        and then applies the masks. Run the returned op in place of trainingOp.
+        """
+        self._kernels = list(kernels)
+        with tf.name_scope("pruning"):
+            self._masks = [tf.Variable(tf.ones(kernel.shape, dtype=kernel.dtype.base_dtype),
+                                       trainable=False,
+                                       collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                       name=kernel.op.name.replace("/", "_") + "_mask")
+                           for kernel in self._kernels]
+            self._maskIn = [tf.placeholder(shape=mask.shape, dtype=mask.dtype.base_dtype)
+                            for mask in self._masks]
+            self._assignMaskOps = [mask.assign(maskIn) for mask, maskIn in zip(self._masks, self._maskIn)]
+
+            self._applyMaskOp = self._buildApplyMasks("applyMaskOp")
+
+            # The kernels must be read after the training step has updated them
+            with tf.control_dependencies([trainingOp]):
+                maskedTrainingOp = self._buildApplyMasks("maskedTrainingOp")
+
+        return maskedTrainingOp
+
+    def start(self, sess) -> None:
+        """
+        Initialises the masks from the weights which are already zero, so a restored model which
+        was pruned stays pruned. Call this after the model's variables have been initialised.
+        """
+        sess.run(tf.variables_initializer(self._masks))
+        self._setMasks(sess, [kernel != 0 for kernel in sess.run(self._kernels)])
+        self._lastPruneStep = None
+
+    def getState(self) -> Dict[str, Any]:
+        """Returns the state needed to continue pruning with setState, eg. after a restart"""
+        return {"lastPruneStep": self._lastPruneStep}
+
+    def setState(self, state: Dict[str, Any]) -> None:
+        """Restores the state returned by getState, the masks are recovered by start"""
+        self._lastPruneStep = state["lastPruneStep"]
+
+    def step(self, sess, globalStep: int) -> bool:
+        """
+        Call this after each training step with the number of steps taken so far. Recalculates the
+        masks if pruning is due, and returns True if it was.
+        """
+        if globalStep < self._beginStep:
+            return False
+
+        if self._lastPruneStep is not None and (self._lastPruneStep >= self._endStep or
+                                                globalStep - self._lastPruneStep < self._pruneEverySteps):
+            return False
+
+        sparsity = self.getSparsityAtStep(globalStep)
+        masks = []
+        for kernel in sess.run(self._kernels):
+            numPruned = int(sparsity * kernel.size)
+            if numPruned == 0:
+                masks.append(np.ones(kernel.shape, dtype=bool))
+                continue
+
+            # Weights which have already been pruned are zero, so they always stay pruned
+            magnitudes = np.abs(kernel)
+            threshold = np.partition(magnitudes, numPruned - 1, axis=None)[numPruned - 1]
+            masks.append(magnitudes > threshold)
+
+        self._setMasks(sess, masks)
+        sess.run(self._applyMaskOp)
+        self._lastPruneStep = globalStep
+
+        return True
+
+    def applyMasks(self, sess) -> None:
+        """
+        Multiplies each kernel by its mask. Call this after replacing the kernels with values saved
+        earlier in pruning, such as the best parameters kept by early stopping.
+        """
+        sess.run(self._applyMaskOp)
+
+    def getSparsity(self, sess) -> Dict[str, float]:
+        """Returns the fraction of each kernel's weights which are zero, keyed by variable name"""
+        return {kernel.op.name: float(np.mean(value == 0))
+                for kernel, value in zip(self._kernels, sess.run(self._kernels))}
+
+    def _buildApplyMasks(self, name):
+        """Returns an op which multiplies each kernel by its mask"""
+        return tf.group(*[kernel.assign(kernel * mask) for kernel, mask in zip(self._kernels, self._masks)],
+                        name=name)
+
+    def _setMasks(self, sess, masks) -> None:
+        sess.run(self._assignMaskOps, feed_dict={maskIn: mask.astype(maskIn.dtype.as_numpy_dtype)
+                                                 for maskIn, mask in zip(self._maskIn, masks)})
+
 class TrainingValidator:
     """
     Performs simple checks on the model during training to ensure that the model is training
@@ -0,0 +1,85 @@
+"""
+Tests for functionality in the Benchmarking module.
+"""
+
+import pytest
+
+from sklearn.datasets import make_regression
+import tensorflow as tf
+
+from TFHelpers.Benchmarking import BatchSizeTuner, measureStepOverhead
+from TFHelpers.SKTFModels import BasicRegressor
+
+class Test_BatchSizeTuner:
+    """
+    Tests for the BatchSizeTuner class.
+    """
+    def test_Tune(self):
+        """
+        Tests that each candidate that fits in the data is measured and a recommendation is made
+        from the measured candidates.
+        """
+        X, y = make_regression(1000, 20, random_state=42)
+        model = BasicRegressor(hiddenNeuronsList=[10, 5])
+
+        tuner = BatchSizeTuner(model, [16, 64, 256, 2048], warmupSteps=1, measureSteps=5)
+        report = tuner.tune(X, y)
+
+        assert [result["batchSize"] for result in report.results] == [16, 64, 256]
+        assert all(result["trainSamplesPerSec"] > 0 for result in report.results)
+        assert report.recommendedTrainingBatchSize in [16, 64, 256]
+        assert report.recommendedInferenceBatchSize in [16, 64, 256]
+        assert "Recommended training batch size" in str(report)
+
+    def test_NothingWithinBudget(self):
+        """
+        Tests that an exception is raised if no candidates fit within the memory budget.
+        """
+        X, y = make_regression(100, 20, random_state=42)
+        model = BasicRegressor()
+
+        tuner = BatchSizeTuner(model, [16, 32], memoryBudgetBytes=-1, warmupSteps=1, measureSteps=1)
+        with pytest.raises(RuntimeError):
+            tuner.tune(X, y)
+
+    def test_PeakNotReset(self, monkeypatch):
+        """
+        Tests that a warning is given when the peak can't be reset, and that the previous peak of
+        the process isn't counted against the budget.
+        """
+        monkeypatch.setattr("TFHelpers.Benchmarking.resetPeakRSS", lambda: False)
+        X, y = make_regression(100, 20, random_state=42)
+        model = BasicRegressor()
+
+        tuner = BatchSizeTuner(model, [16], memoryBudgetBytes=2 ** 30, warmupSteps=1, measureSteps=1)
+        with pytest.warns(RuntimeWarning):
+            report = tuner.tune(X, y)
+
+        assert report.results[0]["withinBudget"]
+
+class Test_MeasureStepOverhead:
+    """
+    Tests for the measureStepOverhead function.
+    """
+    def test_Measure(self):
+        """
+        Tests that each step is timed with both feed_dict and the step callables.
+        """
+        X, y = make_regression(1000, 20, random_state=42)
+        model = BasicRegressor(hiddenNeuronsList=[10, 5])
+
+        results = measureStepOverhead(model, X, y, batchSize=1, warmupSteps=2, measureSteps=10)
+
+        assert [result["step"] for result in results] == ["train", "loss", "predict"]
+        assert all(result["feedDictSeconds"] > 0 and result["callableSeconds"] > 0
+                   for result in results)
+
+    def test_SparseInput(self):
+        """
+        Tests that sparse inputs are rejected, as they can't be fed to a callable.
+        """
+        X, y = make_regression(100, 20, random_state=42)
+        model = BasicRegressor(sparseInput=True)
+
+        with pytest.raises(ValueError):
+            measureStepOverhead(model, X, y, warmupSteps=1, measureSteps=1)
@@ -12,7 +12,9 @@ import time
 import tensorflow as tf
 from tensorboard.backend.event_processing import event_accumulator
 
-from TFHelpers.FilesAndLogging import CheckpointAndRestoreHelper, FileManager, TensorboardLogHelper
+from TFHelpers.FilesAndLogging import CheckpointAndRestoreHelper, CheckpointRetentionPolicy, FileManager, \
+                                      findBestCheckpoint, HISTOGRAM_SUMMARIES, RunIndex, \
+                                      TensorboardLogHelper
 
 class Test_CheckpointAndRestoreHelper:
     """
@@ -143,6 +145,153 @@ class Test_CheckpointAndRestoreHelper:
                                                        True,
                                                        tf.get_default_graph())
 
+    def test_RetainBestCheckpoints(self, request):
+        """
+        Tests that the best checkpoints and the latest checkpoint are kept, and that restoring
+        uses the best checkpoint.
+        """
+        tf.reset_default_graph()
+        A = tf.Variable(0, dtype=tf.float32, name="A")
+        epochIn = tf.placeholder(dtype=tf.float32)
+        A_mod = A.assign(epochIn)
+        init = tf.global_variables_initializer()
+
+        fileManager = FileManager(request.node.name, None)
+        restoreHelper = CheckpointAndRestoreHelper(fileManager.getModelDirAndPrefix(),
+                                                   False,
+                                                   tf.get_default_graph(),
+                                                   CheckpointRetentionPolicy(keepBestK=2))
+
+        LOSSES = [5, 3, 4, 6]
+        with tf.Session() as sess:
+            init.run()
+            for epoch, loss in enumerate(LOSSES):
+                A_mod.eval(feed_dict={epochIn: epoch})
+                restoreHelper.saveCheckpoint(sess, epoch, loss)
+
+            # Epoch 0 should have been pruned
+            MODEL_DIR = pathlib.Path(fileManager.getModelDir())
+            assert not glob.glob(str(MODEL_DIR / "model.ckpt-0.*"))
+            for epoch in [1, 2, 3]:
+                assert os.path.isfile(str(MODEL_DIR / "model.ckpt-{0}.index".format(epoch)))
+
+            assert restoreHelper.getBestCheckpointPath() == str(MODEL_DIR / "model.ckpt-1")
+            assert findBestCheckpoint(fileManager.getModelDirAndPrefix()) == str(MODEL_DIR / "model.ckpt-1")
+            assert restoreHelper.restoreFromCheckpoint(sess) == 2
+            assert A.eval() == 1
+
+    def test_RunByteBudget(self, request):
+        """
+        Tests that checkpoints other than the best are pruned when the run exceeds its budget.
+        """
+        tf.reset_default_graph()
+        A = tf.Variable(10, dtype=tf.float32)
+        init = tf.global_variables_initializer()
+
+        fileManager = FileManager(request.node.name, None)
+        restoreHelper = CheckpointAndRestoreHelper(fileManager.getModelDirAndPrefix(),
+                                                   False,
+                                                   tf.get_default_graph(),
+                                                   CheckpointRetentionPolicy(keepBestK=3,
+                                                                             maxRunBytes=1))
+
+        with tf.Session() as sess:
+            init.run()
+            for epoch, loss in enumerate([3, 2, 1, 4]):
+                restoreHelper.saveCheckpoint(sess, epoch, loss)
+
+        MODEL_DIR = pathlib.Path(fileManager.getModelDir())
+        assert sorted(path.name for path in MODEL_DIR.glob("model.ckpt-*.index")) == ["model.ckpt-2.index"]
+
+    def test_TreeByteBudget(self, request):
+        """
+        Tests that the tree budget only prunes other runs once they have finished, and warns if the
+        budget can't be met.
+        """
+        tf.reset_default_graph()
+        A = tf.Variable(10, dtype=tf.float32)
+        init = tf.global_variables_initializer()
+
+        otherManager = FileManager(request.node.name + "Other", None)
+        otherHelper = CheckpointAndRestoreHelper(otherManager.getModelDirAndPrefix(),
+                                                 False,
+                                                 tf.get_default_graph(),
+                                                 CheckpointRetentionPolicy(keepBestK=3))
+        with tf.Session() as sess:
+            init.run()
+            for epoch, loss in enumerate([3, 2, 1, 4]):
+                otherHelper.saveCheckpoint(sess, epoch, loss)
+        otherManager.updateRunIndex({"finished": False})
+
+        OTHER_DIR = pathlib.Path(otherManager.getModelDir())
+        OTHER_CHECKPOINTS = sorted(path.name for path in OTHER_DIR.glob("model.ckpt-*.index"))
+        assert len(OTHER_CHECKPOINTS) == 4
+
+        fileManager = FileManager(request.node.name, None)
+        restoreHelper = CheckpointAndRestoreHelper(fileManager.getModelDirAndPrefix(),
+                                                   False,
+                                                   tf.get_default_graph(),
+                                                   CheckpointRetentionPolicy(keepBestK=3,
+                                                                             maxTreeBytes=1))
+        with tf.Session() as sess:
+            init.run()
+
+            # The other run is still training so it must not be pruned
+            with pytest.warns(RuntimeWarning):
+                restoreHelper.saveCheckpoint(sess, 0, 1)
+            assert sorted(path.name for path in OTHER_DIR.glob("model.ckpt-*.index")) == OTHER_CHECKPOINTS
+
+            otherManager.updateRunIndex({"finished": True})
+            with pytest.warns(RuntimeWarning):
+                restoreHelper.saveCheckpoint(sess, 1, 2)
+
+        # Only the best and latest checkpoints of each run are kept
+        assert sorted(path.name for path in OTHER_DIR.glob("model.ckpt-*.index")) == \
+            ["model.ckpt-2.index", "model.ckpt-3.index"]
+        MODEL_DIR = pathlib.Path(fileManager.getModelDir())
+        assert sorted(path.name for path in MODEL_DIR.glob("model.ckpt-*.index")) == \
+            ["model.ckpt-0.index", "model.ckpt-1.index"]
+
+    def test_ResumeMidEpoch(self, request):
+        """
+        Tests that a checkpoint saved part way through an epoch is restored along with its state,
+        and is removed once the epoch completes.
+        """
+        tf.reset_default_graph()
+        A = tf.Variable(0, dtype=tf.float32, name="A")
+        valueIn = tf.placeholder(dtype=tf.float32)
+        A_mod = A.assign(valueIn)
+        init = tf.global_variables_initializer()
+
+        fileManager = FileManager(request.node.name, None)
+        restoreHelper = CheckpointAndRestoreHelper(fileManager.getModelDirAndPrefix(),
+                                                   False,
+                                                   tf.get_default_graph())
+
+        with tf.Session() as sess:
+            init.run()
+            restoreHelper.saveCheckpoint(sess, 0)
+            for step in [1, 2]:
+                A_mod.eval(feed_dict={valueIn: step})
+                restoreHelper.saveResumeState(sess, 1, step, {"step": step})
+
+        # Only the latest mid-epoch checkpoint is kept
+        MODEL_DIR = pathlib.Path(fileManager.getModelDir())
+        assert [path.name for path in MODEL_DIR.glob("model.resume-*.index")] == ["model.resume-2.index"]
+
+        tf.reset_default_graph()
+        restoreHelper = CheckpointAndRestoreHelper(fileManager.getModelDirAndPrefix(),
+                                                   True,
+                                                   tf.get_default_graph())
+        with tf.Session() as sess:
+            assert restoreHelper.restoreFromCheckpoint(sess) == 1
+            assert restoreHelper.getResumeState() == {"step": 2}
+            assert tf.get_default_graph().get_tensor_by_name("A:0").eval() == 2
+
+            restoreHelper.saveCheckpoint(sess, 1)
+
+        assert not list(MODEL_DIR.glob("model.resume*"))
+
 class Test_FileManager:
     """
     Tests for the FileManager class.
@@ -169,6 +318,72 @@ class Test_FileManager:
         assert manager.getModelDir() == os.getcwd() + "/models/TestRegressor/" +  RESTORE_FROM
         assert manager.getModelDirAndPrefix() == os.getcwd() + "/models/TestRegressor/" + RESTORE_FROM + "/model"
 
+    def test_UpdateRunIndex(self, request):
+        """
+        Tests that a run can be added to the run index and then updated.
+        """
+        MODEL_NAME = request.node.name
+        manager = FileManager(MODEL_NAME)
+
+        manager.updateRunIndex({"hyperParams": {"H": "10"}, "epochs": 0})
+        manager.updateRunIndex({"epochs": 1, "bestLossVal": 5.0})
+
+        runs = manager.getRunIndex().readRuns()
+        run = runs[MODEL_NAME + "/" + manager.getRunName()]
+
+        assert run["hyperParams"] == {"H": "10"}
+        assert run["epochs"] == 1
+        assert run["bestLossVal"] == 5.0
+
+class Test_RunIndex:
+    """
+    Tests for the RunIndex class.
+    """
+    def test_MergeAndCompact(self, tmpdir):
+        """
+        Tests that later records override earlier ones, and that compacting the index keeps the
+        merged records.
+        """
+        index = RunIndex(str(tmpdir / "runIndex.jsonl"))
+
+        index.updateRun("ModelA", "20180101-1200", {"epochs": 1, "lossVal": 10.0})
+        index.updateRun("ModelB", "20180101-1200", {"epochs": 1})
+        index.updateRun("ModelA", "20180101-1200", {"epochs": 2})
+
+        expected = {"ModelA/20180101-1200": {"modelName": "ModelA",
+                                             "run": "20180101-1200",
+                                             "epochs": 2,
+                                             "lossVal": 10.0},
+                    "ModelB/20180101-1200": {"modelName": "ModelB",
+                                             "run": "20180101-1200",
+                                             "epochs": 1}}
+        assert index.readRuns() == expected
+
+        index.compact()
+        assert index.readRuns() == expected
+        with open(index.getPath()) as f:
+            assert len(f.readlines()) == 2
+
+    def test_CompactWhenFinished(self, tmpdir):
+        """
+        The index should be compacted when a run finishes, so it doesn't grow with every epoch.
+        """
+        index = RunIndex(str(tmpdir / "runIndex.jsonl"))
+
+        for epoch in range(10):
+            index.updateRun("ModelA", "20180101-1200", {"epochs": epoch + 1})
+        index.updateRun("ModelB", "20180101-1200", {"epochs": 1})
+        with open(index.getPath()) as f:
+            assert len(f.readlines()) == 11
+
+        index.updateRun("ModelA", "20180101-1200", {"finished": True})
+        with open(index.getPath()) as f:
+            assert len(f.readlines()) == 2
+
+        runs = index.readRuns()
+        assert runs["ModelA/20180101-1200"]["epochs"] == 10
+        assert runs["ModelA/20180101-1200"]["finished"]
+
 class Test_TensorboardLogHelper:
     """
     Tests for the TensorboardLogHelper class.
@@ -246,6 +461,37 @@ class Test_TensorboardLogHelper:
         assert ea.Scalars("TensorboardLogHelper/dynamic_1")[0].value == 5
 
 
+    def test_HistogramFrequency(self, request):
+        """
+        Tests that summaries in the histogram collection are written less often than the scalars.
+        """
+        tf.reset_default_graph()
+
+        A = tf.Variable([1, 2, 3], dtype=tf.float32, name="A")
+        tf.summary.histogram("weights", A, collections=[HISTOGRAM_SUMMARIES])
+        init = tf.global_variables_initializer()
+
+        MODEL_DIR = request.node.name
+        START_DATETIME = datetime.utcnow().strftime("%Y%m%d-%H%M")
+        manager = FileManager(MODEL_DIR)
+        logHelper = TensorboardLogHelper(manager.getModelDir(),
+                                         tf.get_default_graph(),
+                                         ["dynamic"],
+                                         False,
+                                         histogramEvery=3)
+
+        with tf.Session() as sess:
+            init.run()
+            for iteration in range(7):
+                logHelper.writeSummary(sess, [float(iteration)])
+
+        logHelper.close()
+
+        ea = event_accumulator.EventAccumulator(str(pathlib.Path.cwd() / "models" / MODEL_DIR / START_DATETIME))
+        ea.Reload()
+        assert len(ea.Scalars("TensorboardLogHelper/dynamic_1")) == 7
+        assert [event.step for event in ea.Histograms("weights")] == [0, 3, 6]
+
     def test_RestoreIncorrectSummaries(self, request):
         """
         Tests that an exception is thrown if a summary name is provided which couldn't be found in
@@ -0,0 +1,146 @@
+"""
+Tests for functionality in the GraphTools module.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from sklearn.datasets import make_regression
+from sklearn.model_selection import train_test_split
+import tensorflow as tf
+
+from TFHelpers.GraphTools import compareNumpyExport, compareSparseExport, exportNumpyModel, \
+                                 exportSparseModel, ModelCostReport
+from TFHelpers.NumpyInference import NumpyRegressor
+from TFHelpers.SKTFModels import BasicRegressor
+from TFHelpers.TrainingHelpers import MagnitudePruner
+
+class Test_ModelCostReport:
+    """
+    Tests for the ModelCostReport class.
+    """
+    def test_FromRegressor(self):
+        """
+        Tests the parameters and FLOPs counted for each layer of a fitted model, and that latency is
+        measured for each batch size.
+        """
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100)
+        model.fit(X_train, y_train, X_val, y_val, 1)
+
+        report = ModelCostReport.fromRegressor(model, batchSize=32)
+        layers = report.getLayers()
+        assert [layer["layer"] for layer in layers] == ["dnn/dense", "dnn/dense_1", "dnn/logits"]
+        assert [layer["parameters"] for layer in layers] == [210, 55, 6]
+        assert [layer["flopsPerRow"] for layer in layers] == [410, 105, 11]
+        assert layers[0]["activationBytes"] == 32 * 10 * 4
+
+        totals = report.getTotals()
+        assert totals["parameters"] == 271
+        assert totals["flops"] == 526 * 32
+
+        latencies = report.measureLatency([1, 8], warmupRuns=1, measureRuns=3)
+        assert [latency["batchSize"] for latency in latencies] == [1, 8]
+        assert json.loads(report.toJSON())["latency"][1]["batchSize"] == 8
+        assert "FLOPs per row: 526" in str(report)
+
+class Test_SparseExport:
+    """
+    Tests for exporting pruned models in a sparse form.
+    """
+    def test_ExportAndCompare(self, tmpdir):
+        """
+        Prunes a model while fitting, then checks the exported sparse model predicts the same as the
+        dense frozen graph.
+        """
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100)
+        model.fit(X_train, y_train, X_val, y_val, 3,
+                  pruner=MagnitudePruner(0.5, beginStep=0, endStep=1, pruneEverySteps=1))
+
+        path = str(tmpdir / "sparse.npz")
+        summary = exportSparseModel(model, path)
+        assert [layer["shape"] for layer in summary["layers"]] == [[20, 10], [10, 5], [5, 1]]
+        assert [layer["nonZero"] for layer in summary["layers"]] == [100, 25, 3]
+
+        comparison = compareSparseExport(model, path, X_val, y_val, [1, 8], warmupRuns=1, measureRuns=3)
+        assert comparison["maxAbsDifference"] < 1e-3
+        assert comparison["sparse"]["mse"] == pytest.approx(comparison["dense"]["mse"], rel=1e-4)
+        assert [latency["batchSize"] for latency in comparison["sparse"]["latency"]] == [1, 8]
+        assert np.isfinite(comparison["dense"]["latency"][0]["latencyMs"])
+
+class Test_NumpyExport:
+    """
+    Tests for exporting models for NumpyInference.
+    """
+    def test_ExportAndCompare(self, tmpdir):
+        """
+        The numpy forward pass should predict the same as the model.
+        """
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100)
+        model.fit(X_train, y_train, X_val, y_val, 1)
+
+        path = str(tmpdir / "model.npw")
+        summary = exportNumpyModel(model, path)
+        assert [layer["shape"] for layer in summary["layers"]] == [[20, 10], [10, 5], [5, 1]]
+
+        assert np.allclose(NumpyRegressor(path).predict(X_val), model.predict(X_val), rtol=1e-4, atol=1e-3)
+
+        comparison = compareNumpyExport(model, path, X_val, batchSizes=[1, 8], warmupRuns=1, measureRuns=3)
+        assert comparison["withinTolerance"]
+        assert [latency["batchSize"] for latency in comparison["numpy"]] == [1, 8]
+        assert [latency["batchSize"] for latency in comparison["tensorflow"]] == [1, 8]
+
+    def test_ExportWithDropout(self, tmpdir):
+        """
+        A model trained with dropout should export and report the costs of its layers without the
+        dropout ops.
+        """
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100, dropoutRate=0.5, applyDropout=True)
+        model.fit(X_train, y_train, X_val, y_val, 1)
+
+        path = str(tmpdir / "model.npw")
+        summary = exportNumpyModel(model, path)
+        assert [layer["shape"] for layer in summary["layers"]] == [[20, 10], [10, 5], [5, 1]]
+        assert np.allclose(NumpyRegressor(path).predict(X_val), model.predict(X_val), rtol=1e-4, atol=1e-3)
+
+        layers = ModelCostReport.fromRegressor(model, batchSize=32).getLayers()
+        assert [layer["layer"] for layer in layers] == ["dnn/dense", "dnn/dense_1", "dnn/logits"]
+
+    def test_ExportNormalized(self, tmpdir):
+        """
+        The normalization of the inputs should be folded into the first layer when exporting.
+        """
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X = X * 1000 + 500
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100, normalizeInputs=True)
+        model.fit(X_train, y_train, X_val, y_val, 1)
+
+        path = str(tmpdir / "model.npw")
+        summary = exportNumpyModel(model, path)
+        assert [layer["shape"] for layer in summary["layers"]] == [[20, 10], [10, 5], [5, 1]]
+        assert np.allclose(NumpyRegressor(path).predict(X_val), model.predict(X_val), rtol=1e-4, atol=1e-3)
+
+        sparsePath = str(tmpdir / "sparse.npz")
+        exportSparseModel(model, sparsePath)
+        assert compareSparseExport(model, sparsePath, X_val, batchSizes=[1], warmupRuns=1,
+                                   measureRuns=1)["maxAbsDifference"] < 1e-3
@@ -0,0 +1,52 @@
+"""
+Tests for functionality in the HyperparameterSearch module.
+"""
+
+import pytest
+
+from sklearn.datasets import make_regression
+from sklearn.model_selection import train_test_split
+import tensorflow as tf
+
+from TFHelpers.HyperparameterSearch import SuccessiveHalvingSearch
+from TFHelpers.SKTFModels import BasicRegressor
+
+class Test_SuccessiveHalvingSearch:
+    """
+    Tests for the SuccessiveHalvingSearch class.
+    """
+    def test_InvalidSearch(self):
+        """
+        Tests that invalid budgets and duplicate models are rejected.
+        """
+        with pytest.raises(ValueError):
+            SuccessiveHalvingSearch([BasicRegressor()], reductionFactor=1)
+
+        with pytest.raises(ValueError):
+            SuccessiveHalvingSearch([BasicRegressor()], minEpochs=4, maxEpochs=2)
+
+        with pytest.raises(ValueError):
+            SuccessiveHalvingSearch([BasicRegressor(), BasicRegressor()])
+
+    def test_Search(self):
+        """
+        Tests that the survivors of each rung are resumed with a larger budget until one remains.
+        """
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        estimators = [BasicRegressor(learningRate=learningRate, batchSize=100, hiddenNeuronsList=[10])
+                      for learningRate in [0.1, 0.01, 0.001, 0.0001]]
+        search = SuccessiveHalvingSearch(estimators, minEpochs=1, maxEpochs=3, reductionFactor=2)
+        assert search.getRungEpochs() == [1, 2, 3]
+
+        best = search.fit(X_train, y_train, X_val, y_val)
+
+        assert [result["rung"] for result in search.results] == [0, 0, 0, 0, 1, 1, 2]
+        assert search.getTotalEpochs() == 4 + 2 + 1
+        assert best is search.bestEstimator
+        assert best.predict(X_val).shape == (len(X_val), 1)
+
+        # The best model continued in the run directory created in the first rung
+        assert best.restoreFrom in [result["run"] for result in search.results[:4]]
+        assert "bestLossVal" in str(search)
@@ -0,0 +1,86 @@
+"""
+Tests for functionality in the LogAggregation module.
+"""
+
+import os
+
+import tensorflow as tf
+
+from TFHelpers.FilesAndLogging import TensorboardLogHelper
+from TFHelpers.LogAggregation import EventFileAggregator, buildLogdirList, filterLeaderboard, \
+                                     formatLeaderboard, sortLeaderboard
+
+class Test_EventFileAggregator:
+    """
+    Tests for the EventFileAggregator class.
+    """
+    def test_Aggregate(self, tmpdir):
+        """
+        Tests that the metrics written by TensorboardLogHelper are summarised for each run, and
+        that a second aggregation uses the cache.
+        """
+        MODELS_DIR = str(tmpdir / "models")
+        LOSSES_VAL = {"ModelA": [5.0, 3.0, 4.0], "ModelB": [2.0, 1.0, 1.5]}
+
+        for modelName, lossesVal in LOSSES_VAL.items():
+            tf.reset_default_graph()
+            logDir = os.path.join(MODELS_DIR, modelName, "20180101-1200")
+            logHelper = TensorboardLogHelper(logDir,
+                                             tf.get_default_graph(),
+                                             ["LossTrain", "LossVal", "BatchTimeAvg"],
+                                             False)
+
+            with tf.Session() as sess:
+                for lossVal in lossesVal:
+                    logHelper.writeSummary(sess, [lossVal * 2, lossVal, 0.5])
+
+            logHelper.close()
+
+        aggregator = EventFileAggregator(MODELS_DIR, numWorkers=2)
+        rows = sortLeaderboard(aggregator.aggregate())
+
+        assert [row["modelName"] for row in rows] == ["ModelB", "ModelA"]
+        assert rows[0]["epochs"] == 3
+        assert rows[0]["bestLossVal"] == 1.0
+        assert rows[0]["finalLossVal"] == 1.5
+        assert rows[0]["finalLossTrain"] == 3.0
+        assert rows[0]["meanBatchTimeAvg"] == 0.5
+        assert rows[1]["bestLossVal"] == 3.0
+
+        assert os.path.isfile(os.path.join(MODELS_DIR, EventFileAggregator.CACHE_FILENAME))
+        assert sortLeaderboard(aggregator.aggregate()) == rows
+
+class Test_Leaderboard:
+    """
+    Tests for the functions which sort, filter and format leaderboard rows.
+    """
+    ROWS = [{"modelName": "ModelA", "run": "1", "logDir": "models/ModelA/1", "bestLossVal": 2.0},
+            {"modelName": "ModelB", "run": "1", "logDir": "models/ModelB/1", "bestLossVal": None},
+            {"modelName": "ModelC", "run": "1", "logDir": "models/ModelC/1", "bestLossVal": 1.0}]
+
+    def test_SortAndFilter(self):
+        """
+        Tests that rows without a value are sorted last, and that filtering is applied before
+        limiting the number of rows.
+        """
+        rows = sortLeaderboard(self.ROWS)
+        assert [row["modelName"] for row in rows] == ["ModelC", "ModelA", "ModelB"]
+
+        rows = sortLeaderboard(self.ROWS, descending=True)
+        assert [row["modelName"] for row in rows] == ["ModelA", "ModelC", "ModelB"]
+
+        rows = filterLeaderboard(sortLeaderboard(self.ROWS),
+                                 lambda row: row["modelName"] != "ModelC",
+                                 1)
+        assert [row["modelName"] for row in rows] == ["ModelA"]
+
+    def test_Format(self):
+        """
+        Tests the table and logdir strings.
+        """
+        table = formatLeaderboard(self.ROWS, ["modelName", "bestLossVal"])
+        assert table.splitlines()[0].split() == ["modelName", "bestLossVal"]
+        assert table.splitlines()[1].split() == ["ModelA", "2"]
+        assert len(table.splitlines()) == 4
+
+        assert buildLogdirList(self.ROWS[:2]) == "ModelA/1:models/ModelA/1,ModelB/1:models/ModelB/1"
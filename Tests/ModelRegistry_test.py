@@ -0,0 +1,198 @@
+"""
+Tests for functionality in the ModelRegistry module.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from sklearn.datasets import make_regression
+from sklearn.model_selection import train_test_split
+import tensorflow as tf
+
+from TFHelpers.ModelRegistry import ModelRegistry
+from TFHelpers.SKTFModels import BasicRegressor
+
+class _BlockingRegistry(ModelRegistry):
+    """A registry whose first load waits for releaseLoad to be set"""
+    def __init__(self, *args, **kwargs):
+        ModelRegistry.__init__(self, *args, **kwargs)
+        self.loadStarted = threading.Event()
+        self.releaseLoad = threading.Event()
+
+    def _load(self, key):
+        self.loadStarted.set()
+        self.releaseLoad.wait()
+        return ModelRegistry._load(self, key)
+
+class Test_ModelRegistry:
+    """
+    Tests for the ModelRegistry class.
+    """
+    def _fitModel(self):
+        """Returns a fitted model and its validation features"""
+        tf.reset_default_graph()
+        X, y = make_regression(1000, 20, random_state=42)
+        X_train, X_val, y_train, y_val = train_test_split(X, y, train_size=0.8, random_state=42)
+
+        model = BasicRegressor(hiddenNeuronsList=[10, 5], batchSize=100)
+        model.fit(X_train, y_train, X_val, y_val, 1)
+
+        return model, X_val
+
+    def _metaPath(self, model):
+        """Returns the absolute path to the model's meta graph"""
+        return os.path.abspath(model._fileManager.getModelDirAndPrefix() + ".ckpt.meta")
+
+    def test_PredictAndEvict(self):
+        """
+        Models should be loaded from the models directory on demand, and the least recently used
+        model evicted when there are more than maxModels.
+        """
+        model, X_val = self._fitModel()
+        modelName = model._fileManager.getModelName()
+        key = modelName + "/" + model._fileManager.getRunName()
+
+        registry = ModelRegistry(maxModels=1)
+        assert np.allclose(registry.predict(key, X_val), model.predict(X_val), rtol=1e-5)
+        registry.predict(key, X_val[:1])
+        assert registry.isLoaded(key)
+
+        # The model name alone serves its latest run
+        registry.predict(modelName, X_val[:1])
+        assert registry.isLoaded(modelName)
+        assert not registry.isLoaded(key)
+
+        stats = registry.getStats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["evictions"] == 1
+        assert stats["loads"] == 2
+        assert stats["maxLoadSeconds"] > 0
+        assert stats["models"] == [modelName]
+
+        with pytest.raises(KeyError):
+            registry.predict("NoSuchModel/20180101-1200", X_val)
+        assert registry.getStats()["loadFailures"] == 1
+
+        registry.close()
+        assert registry.getStats()["models"] == []
+
+    def test_MaxBytes(self):
+        """
+        The least recently used models should be evicted to keep the loaded models within maxBytes.
+        """
+        model, X_val = self._fitModel()
+
+        registry = ModelRegistry()
+        registry.register("first", self._metaPath(model))
+        registry.preload("first")
+        modelBytes = registry.getStats()["bytes"]
+        registry.close()
+        assert modelBytes > 0
+
+        # Room for two models but not three
+        registry = ModelRegistry(maxBytes=int(modelBytes * 2.5))
+        for key in ["first", "second", "third"]:
+            registry.register(key, self._metaPath(model))
+
+        registry.preload("first")
+        registry.preload("second")
+        registry.predict("first", X_val[:1])
+        registry.preload("third")
+
+        stats = registry.getStats()
+        assert stats["models"] == ["first", "third"]
+        assert stats["evictions"] == 1
+        assert stats["bytes"] == modelBytes * 2
+        assert stats["bytes"] <= stats["maxBytes"]
+
+        registry.close()
+
+    def test_EvictWhileInUse(self):
+        """
+        A model evicted while a prediction is using it should only be closed once it's released.
+        """
+        model, X_val = self._fitModel()
+
+        registry = ModelRegistry()
+        registry.register("customer", self._metaPath(model))
+
+        loaded = registry._acquire("customer")
+        registry.evict("customer")
+        assert not registry.isLoaded("customer")
+
+        # Still usable by the prediction which acquired it
+        loaded.session.run(loaded.outputTensor, feed_dict={loaded.inputTensor: X_val[:1]})
+
+        registry._release(loaded)
+        with pytest.raises(RuntimeError):
+            loaded.session.run(loaded.outputTensor, feed_dict={loaded.inputTensor: X_val[:1]})
+
+    def test_ConcurrentLoads(self):
+        """
+        Concurrent requests for a model which isn't loaded should share a single load.
+        """
+        model, X_val = self._fitModel()
+
+        registry = ModelRegistry()
+        registry.register("customer", self._metaPath(model))
+
+        results = [None] * 8
+        def predict(index):
+            results[index] = registry.predict("customer", X_val)
+
+        threads = [threading.Thread(target=predict, args=(index,)) for index in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = registry.getStats()
+        assert stats["loads"] == 1
+        assert stats["misses"] == 1
+        assert stats["hits"] + stats["sharedLoads"] == len(results) - 1
+        assert all(np.allclose(result, results[0]) for result in results)
+
+        registry.close()
+
+    def test_RegisterDuringLoad(self):
+        """
+        A model loaded from a key's previous path should answer the request which loaded it, but
+        not be kept once the key has been registered again.
+        """
+        model, X_val = self._fitModel()
+
+        registry = _BlockingRegistry()
+        registry.register("customer", self._metaPath(model))
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(registry.predict("customer", X_val)))
+        thread.start()
+        registry.loadStarted.wait()
+
+        registry.register("customer", self._metaPath(model))
+        registry.releaseLoad.set()
+        thread.join()
+
+        assert len(results) == 1
+        assert not registry.isLoaded("customer")
+
+        # The next request loads the newly registered path
+        registry.predict("customer", X_val)
+        assert registry.isLoaded("customer")
+        assert registry.getStats()["loads"] == 2
+
+        registry.close()
+
+    def test_InvalidArguments(self):
+        """
+        The memory budget and maximum number of models must be positive.
+        """
+        with pytest.raises(ValueError):
+            ModelRegistry(maxBytes=0)
+
+        with pytest.raises(ValueError):
+            ModelRegistry(maxModels=0)
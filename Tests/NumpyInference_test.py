@@ -0,0 +1,66 @@
+"""
+Tests for functionality in the NumpyInference module.
+"""
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from TFHelpers.NumpyInference import ALIGNMENT, NumpyRegressor, writeWeightFile
+
+class Test_NumpyRegressor:
+    """
+    Tests for writing weight files and predicting with the NumpyRegressor class.
+    """
+    def test_Predict(self, tmpdir):
+        """
+        Predictions should match the same forward pass calculated directly.
+        """
+        np.random.seed(42)
+        kernel1, bias1 = np.random.randn(4, 3), np.random.randn(3)
+        kernel2 = np.random.randn(3, 1)
+
+        path = str(tmpdir / "model.npw")
+        fileBytes = writeWeightFile(path, [{"kernel": kernel1, "bias": bias1, "activation": "Relu"},
+                                           {"kernel": kernel2, "bias": None, "activation": ""}])
+        assert fileBytes % ALIGNMENT == 0
+
+        model = NumpyRegressor(path)
+        assert model.getNumFeatures() == 4
+
+        X = np.random.randn(10, 4)
+        expected = np.dot(np.maximum(np.dot(X, kernel1) + bias1, 0), kernel2)
+        predictions = model.predict(X)
+
+        assert predictions.shape == (10, 1)
+        assert predictions.dtype == np.float32
+        assert np.allclose(predictions, expected, atol=1e-5)
+
+        # A single row can be provided without a batch dimension
+        assert np.allclose(model.predict(X[0]), expected[:1], atol=1e-5)
+
+    def test_InvalidFiles(self, tmpdir):
+        """
+        Files which weren't written by writeWeightFile, and unsupported activations, should raise an
+        exception.
+        """
+        path = str(tmpdir / "model.npw")
+        with open(path, "wb") as f:
+            f.write(b"not a weight file")
+
+        with pytest.raises(ValueError):
+            NumpyRegressor(path)
+
+        with pytest.raises(ValueError):
+            writeWeightFile(path, [{"kernel": np.ones((2, 1)), "bias": None, "activation": "Swish"}])
+
+    def test_NoTensorflowImport(self):
+        """
+        Loading the module shouldn't import tensorflow.
+        """
+        subprocess.check_call([sys.executable,
+                               "-c",
+                               "import sys, TFHelpers.NumpyInference; "
+                               "assert 'tensorflow' not in sys.modules"])
@@ -2,15 +2,49 @@
 Tests for functionality in the ScikitWrapper module.
 """
 
+import glob
+import os
+
+import numpy as np
 import pytest
+import scipy.sparse
 
 from sklearn.datasets import make_regression
 from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 import tensorflow as tf
 
-from TFHelpers.ScikitWrapper import SKTFWrapper
+from TFHelpers.ScikitWrapper import ReplicatedRegressorTrainer, SKTFWrapper
 from TFHelpers.SKTFModels import BasicRegressor
+from TFHelpers.TrainingHelpers import EarlyStoppingHelper, ImportanceSampler, MagnitudePruner
+
+def _makeData():
+    """
+    Resets the default graph and returns X_train, X_val, y_train, y_val for a regression problem
+    with 20 features, 800 training rows and 200 validation rows
+    """
+    tf.reset_default_graph()
+    X, y = make_regression(1000, 20, random_state=42)
+    return train_test_split(X, y, train_size=0.8, random_state=42)
+
+def _makeModel(**hyperParams):
+    """
+    Returns a BasicRegressor with the hyperparameters shared by most tests, which are overridden by
+    hyperParams. With a batch size of 100 each epoch of _makeData's training set is 8 steps.
+    """
+    params = {"learningRate": 0.01, "batchSize": 100, "dropoutRate": 0.0, "hiddenNeuronsList": [10, 5]}
+    params.update(hyperParams)
+    return BasicRegressor(**params)
+
+def _readRun(model):
+    """Returns the run index entry for the model's last fit"""
+    fileManager = model._fileManager
+    return fileManager.getRunIndex().readRuns()[fileManager.getModelName() + "/" +
+                                                fileManager.getRunName()]
+
+def _isLearning(model, X_val, y_val) -> bool:
+    """Returns True if the model does better than predicting zeros"""
+    return mean_squared_error(y_val, model.predict(X_val)) < np.mean(np.square(y_val))
 
 class Test_SKTFWrapper:
     """
@@ -49,3 +83,378 @@ class Test_SKTFWrapper:
         y_pred = model.predict(X_val)
 
         assert mean_squared_error(y_val, y_pred) == pytest.approx(38300, 300)
+
+    def test_BasicRegressor_ValidationCadence(self):
+        """
+        Validating every few steps should make several validation checks in each epoch.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 2,
+                  validateEverySteps=3,
+                  validationSubsample=50)
+
+        # 16 steps in total, so at least 5 checks rather than 1 per epoch
+        assert model.getEarlyStoppingReport()["checks"] >= 16 // 3
+        assert _readRun(model)["epochs"] == 2
+        assert _isLearning(model, X_val, y_val)
+
+    def test_BasicRegressor_EarlyStoppingPolicy(self):
+        """
+        Train a TFRegressor model with a stopping policy that requires a large decrease in the loss,
+        and check the epochs saved are reported.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 10,
+                  earlyStopping=EarlyStoppingHelper(1, smoothing="ema", minDelta=1e9))
+
+        report = model.getEarlyStoppingReport()
+        assert report["checks"] == 3
+        assert report["epochsSaved"] > 0
+
+        run = _readRun(model)
+        assert run["epochs"] == 3
+        assert run["earlyStopping"] == report
+
+    def test_BasicRegressor_MultipleStepsPerRun(self):
+        """
+        Train a TFRegressor model running several training steps in each call to sess.run.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel(multiStepTraining=True)
+        model.fit(X_train, y_train, X_val, y_val, 5, stepsPerRun=3)
+
+        # The loop trains the same variables which predict uses
+        assert _isLearning(model, X_val, y_val)
+        assert _readRun(model)["epochs"] == 5
+
+        # The loop is only built when it's asked for
+        model = _makeModel()
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1, stepsPerRun=3)
+        assert not any(op.name.startswith("multiStep/") for op in model._graph.get_operations())
+
+        # The options are checked before the run is recorded or a session is created
+        assert model._fileManager is None
+        assert model._session is None
+        assert model._tensors is None
+
+    def test_BasicRegressor_GradientAccumulation(self):
+        """
+        Train a TFRegressor model accumulating the gradients of several small batches per step.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel(batchSize=25, accumulationSteps=4)
+        model.fit(X_train, y_train, X_val, y_val, 5)
+
+        assert _isLearning(model, X_val, y_val)
+
+        # 32 batches per epoch, so every accumulated gradient has been applied and reset
+        accumulators = [variable for variable in model._graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+                        if variable.op.name.endswith("_accumulator")]
+        assert accumulators
+        assert all(not np.any(value) for value in model._session.run(accumulators))
+
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1, stepsPerRun=3)
+
+    def test_BasicRegressor_PredictDistribution(self):
+        """
+        Predictions sampled with dropout should vary, and without dropout the mean of the
+        distribution should match predict, including when the samples are split over several calls.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel(dropoutRate=0.5, applyDropout=True)
+        model.fit(X_train, y_train, X_val, y_val, 2)
+
+        # The predictions don't depend on the dropout keep probability
+        assert model._tensors.dropoutLogits is not model._tensors.logits
+        assert model.predict(X_val) == pytest.approx(model.predict(X_val))
+
+        mean, variance = model.predict_distribution(X_val, numSamples=30)
+        assert mean.shape == variance.shape == (len(X_val), 1)
+        assert np.all(variance > 0)
+
+        # More samples than the batch size, so each row's samples need several calls
+        model.dropoutRate = 0.0
+        mean, variance = model.predict_distribution(X_val, numSamples=20, batchSize=7)
+        assert mean == pytest.approx(model.predict(X_val), rel=1e-4)
+        assert variance == pytest.approx(np.zeros_like(variance), abs=1e-4)
+
+        with pytest.raises(ValueError):
+            model.predict_distribution(X_val, numSamples=0)
+
+    def test_BasicRegressor_NormalizeInputs(self):
+        """
+        The feature statistics should be stored in the graph and applied to unscaled features.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+        X_train, X_val = X_train * 1000 + 500, X_val * 1000 + 500
+
+        model = _makeModel(normalizeInputs=True)
+        model.fit(X_train, y_train, X_val, y_val, 5)
+
+        variables = {variable.op.name: variable
+                     for variable in model._graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)}
+        mean, variance = model._session.run([variables["normalization/mean"],
+                                             variables["normalization/variance"]])
+        assert mean == pytest.approx(X_train.mean(axis=0), rel=1e-4)
+        assert variance == pytest.approx(X_train.var(axis=0), rel=1e-4)
+
+        assert _isLearning(model, X_val, y_val)
+
+        with pytest.raises(ValueError):
+            BasicRegressor(sparseInput=True, normalizeInputs=True)._buildGraph(20)
+
+    def test_BasicRegressor_ImportanceSampling(self):
+        """
+        Train a TFRegressor model drawing batches in proportion to each example's loss.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel(importanceSampling=True)
+        sampler = ImportanceSampler()
+        model.fit(X_train, y_train, X_val, y_val, 5, importanceSampler=sampler)
+
+        assert _isLearning(model, X_val, y_val)
+
+        # The losses of the training steps were fed back to the sampler
+        state = sampler.getState()
+        assert np.any(state["seen"])
+        assert np.all(state["losses"][state["seen"]] > 0)
+
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1,
+                      stepsPerRun=3,
+                      importanceSampler=ImportanceSampler())
+
+        # The weighted training op is only built when it's asked for
+        model = _makeModel()
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1, importanceSampler=ImportanceSampler())
+        assert not any(op.name.startswith("importance/") for op in model._graph.get_operations())
+
+    def test_BasicRegressor_Pruning(self):
+        """
+        The model should keep its final sparsity after early stopping restores its best parameters,
+        even when those are from before pruning finished.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        # Pruning starts after 5 epochs and is heavy enough that the best validation loss is likely
+        # to be from before it
+        model = _makeModel()
+        pruner = MagnitudePruner(0.9, beginStep=40, endStep=64, pruneEverySteps=8)
+        model.fit(X_train, y_train, X_val, y_val, 10, pruner=pruner)
+
+        sparsity = pruner.getSparsity(model._session)
+        for kernel in model._tensors.prunableKernels:
+            numElements = kernel.shape.num_elements()
+            assert sparsity[kernel.op.name] >= int(0.9 * numElements) / numElements
+
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1, stepsPerRun=3, pruner=MagnitudePruner())
+
+    def test_BasicRegressor_MemoryReport(self):
+        """
+        Memory usage should be reported for each epoch of fit, and for predict once it's enabled.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 2)
+        model.predict(X_val)
+        assert model.getMemoryReport()["predict"] is None
+
+        model.enablePredictMemoryTracking()
+        model.predict(X_val)
+
+        report = model.getMemoryReport()
+        assert [record["epoch"] for record in report["fit"]] == [0, 1]
+        assert report["fit"][0]["batchBytes"] == X_train[:100].nbytes + y_train[:100].nbytes
+        assert report["fit"][0]["validationBytes"] == X_val.nbytes + y_val.nbytes
+        assert report["fit"][0]["earlyStoppingSnapshotBytes"] > 0
+        assert report["predict"]["numRows"] == len(X_val)
+
+    def test_BasicRegressor_PredictionCache(self):
+        """
+        Cached predictions should match uncached predictions, and be invalidated by refitting.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 2)
+        expected = model.predict(X_val)
+
+        cache = model.enablePredictionCache()
+        assert model.predict(X_val) == pytest.approx(expected)
+        assert model.predict(np.concatenate([X_val[:10], X_val[:10]])) == \
+               pytest.approx(np.concatenate([expected[:10], expected[:10]]))
+        assert cache.getStats()["hits"] == 20
+
+        model.fit(X_train, y_train, X_val, y_val, 1)
+        model.predict(X_val[:10])
+        assert cache.getStats()["entries"] == 10
+
+    def test_BasicRegressor_SparseInput(self):
+        """
+        Train a TFRegressor model on a sparse matrix without densifying it.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+        X_train[np.abs(X_train) < 1] = 0
+        X_val[np.abs(X_val) < 1] = 0
+        X_train, X_val = scipy.sparse.csr_matrix(X_train), scipy.sparse.csr_matrix(X_val)
+
+        model = _makeModel(sparseInput=True)
+        model.fit(X_train, y_train, X_val, y_val, 5)
+
+        assert model.predict(X_val).shape == (X_val.shape[0], 1)
+        assert _isLearning(model, X_val, y_val)
+
+        # The features are fed to a sparse placeholder, which can't be fed to a callable
+        assert isinstance(model._tensors.X_in, tf.SparseTensor)
+        assert model._stepCallables is None
+
+        with pytest.raises(ValueError):
+            model.fit(X_train, y_train, X_val, y_val, 1, stepsPerRun=3)
+
+    def test_BasicRegressor_StepCallables(self):
+        """
+        Tests that the step callables are built for dense inputs and give the same results as
+        sess.run.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 2)
+
+        assert model._stepCallables is not None
+
+        with model._session.as_default():
+            logits = model._tensors.logits.eval(feed_dict={model._tensors.X_in: X_val})
+            loss = model._tensors.loss.eval(feed_dict={model._tensors.X_in: X_val,
+                                                       model._tensors.y_in: y_val})
+
+        assert model.predict(X_val) == pytest.approx(logits, rel=1e-5)
+        assert model._stepCallables.loss(X_val, y_val) == pytest.approx(loss, rel=1e-5)
+
+    def test_BasicRegressor_StreamingMetrics(self):
+        """
+        Tests that the training metrics are accumulated during the last epoch, and that once reset
+        they match the loss and mean absolute error of the batches they were updated with.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        model = _makeModel()
+        model.fit(X_train, y_train, X_val, y_val, 2)
+
+        metrics = model._tensors.metrics
+        sess = model._session
+        values = sess.run(metrics.values)
+        assert values["loss"] > 0 and np.isfinite(values["loss"])
+        assert values["mae"] > 0 and np.isfinite(values["mae"])
+
+        feed_dict = {model._tensors.X_in: X_val, model._tensors.y_in: y_val}
+        sess.run(metrics.resetOp)
+        sess.run(metrics.updateOp, feed_dict=feed_dict)
+        values = sess.run(metrics.values)
+
+        y_pred = model.predict(X_val)
+        assert values["loss"] == pytest.approx(sess.run(model._tensors.loss, feed_dict=feed_dict), rel=1e-4)
+        assert values["mae"] == pytest.approx(np.mean(np.abs(y_val - y_pred[:, 0])), rel=1e-4)
+
+    def test_BasicRegressor_RestoresBestParams(self):
+        """
+        After fit the model should have the parameters of the epoch with the lowest validation loss,
+        not those of the last epoch.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+        tf.set_random_seed(42)
+
+        # A large learning rate makes the validation loss oscillate between epochs
+        model = _makeModel(learningRate=1.0)
+        model.fit(X_train, y_train, X_val, y_val, 10)
+
+        with model._session.as_default():
+            assert model._evalLossBatched(X_val, y_val) == pytest.approx(_readRun(model)["bestLossVal"],
+                                                                         rel=1e-5)
+
+class Test_ReplicatedRegressorTrainer:
+    """
+    Tests for the ReplicatedRegressorTrainer class.
+    """
+    def test_InvalidReplicas(self):
+        """
+        Replicas with different batch sizes or identical hyperparameters can't be trained together.
+        """
+        with pytest.raises(ValueError):
+            ReplicatedRegressorTrainer([BasicRegressor(batchSize=100), BasicRegressor(batchSize=200)])
+
+        with pytest.raises(ValueError):
+            ReplicatedRegressorTrainer([BasicRegressor(), BasicRegressor()])
+
+    def test_TrainReplicas(self):
+        """
+        Train several BasicRegressor models in one graph and check they each train and save their
+        own files.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        models = [_makeModel(learningRate=learningRate, hiddenNeuronsList=hiddenNeuronsList)
+                  for learningRate, hiddenNeuronsList in [(0.01, [10, 5]), (0.001, [10, 5]), (0.01, [8])]]
+        trainer = ReplicatedRegressorTrainer(models)
+        trainer.fit(X_train, y_train, X_val, y_val, 3)
+
+        # The batches are fed once to placeholders shared by all of the replicas
+        placeholders = [op.name for op in models[0]._graph.get_operations() if op.type == "Placeholder"]
+        assert placeholders.count("inputs/X_in") == 1
+        assert not [name for name in placeholders if name.endswith("X_in") and name != "inputs/X_in"]
+
+        predictions = []
+        for model in models:
+            assert _isLearning(model, X_val, y_val)
+            assert glob.glob(os.path.join(model._fileManager.getModelDir(), "model.ckpt.index"))
+            predictions.append(model.predict(X_val))
+
+        # Each replica trained its own parameters with its own hyperparameters
+        bestLossVals = [_readRun(model)["bestLossVal"] for model in models]
+        assert len(set(bestLossVals)) == len(models)
+        for index in range(1, len(models)):
+            assert not np.allclose(predictions[0], predictions[index])
+
+        # Fitting one of the models on its own leaves the others with the shared session
+        models[0].fit(X_train, y_train, X_val, y_val, 1)
+        assert np.allclose(models[1].predict(X_val), predictions[1])
+
+        trainer.close()
+        assert models[0].predict(X_val).shape == predictions[0].shape
+
+    def test_RestoreReplica(self):
+        """
+        The saved graph of each replica contains every replica, so restoring a replica's run should
+        use its own tensors rather than the first replica's.
+        """
+        X_train, X_val, y_train, y_val = _makeData()
+
+        models = [_makeModel(learningRate=learningRate) for learningRate in [0.01, 0.001]]
+        trainer = ReplicatedRegressorTrainer(models)
+        trainer.fit(X_train, y_train, X_val, y_val, 2)
+        trainer.close()
+
+        run = _readRun(models[1])
+        assert run["scope"] == "replica_1"
+        assert run["outputName"] == models[1]._tensors.logits.name
+        assert all(model._sharedInputs is None for model in models)
+
+        tf.reset_default_graph()
+        restored = _makeModel(learningRate=0.001, restoreFrom=models[1]._fileManager.getRunName())
+        restored.fit(X_train, y_train, X_val, y_val, 3)
+
+        assert restored._tensors.logits.name == run["outputName"]
+        assert _isLearning(restored, X_val, y_val)
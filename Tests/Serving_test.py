@@ -0,0 +1,74 @@
+"""
+Tests for functionality in the Serving module.
+"""
+
+import numpy as np
+import pytest
+
+from TFHelpers.Serving import PredictionCache
+
+class Test_PredictionCache:
+    """
+    Tests for the PredictionCache class.
+    """
+    def test_HitsAndMisses(self):
+        """
+        Identical rows should share a key, and counters should record each lookup.
+        """
+        cache = PredictionCache()
+        cache.setModelIdentity("model:1")
+
+        X = np.array([[1.0, 2.0], [3.0, 4.0], [1.0, 2.0]])
+        keys = cache.hashRows(X)
+        assert keys[0] == keys[2]
+        assert keys[0] != keys[1]
+
+        # The same bytes with a different dtype should not collide
+        assert cache.hashRows(X.astype(np.float32))[0] != keys[0]
+
+        # Non-contiguous arrays should have the same keys as contiguous ones
+        assert cache.hashRows(np.asfortranarray(X)) == keys
+        assert cache.hashRows(np.hstack([X, X])[:, :2]) == keys
+        assert len(set(cache.hashRows(np.arange(30.0, dtype=np.float32).reshape(10, 3)))) == 10
+
+        cache.put(keys[0], np.array([5.0]))
+        _, cached = cache.lookupRows(X)
+        assert list(cached.keys()) == [0, 2]
+        assert cache.getStats()["hits"] == 2
+        assert cache.getStats()["misses"] == 1
+
+    def test_Eviction(self):
+        """
+        The least recently used entries should be evicted to stay within the memory budget.
+        """
+        entryBytes = 16 + 8 + PredictionCache.ENTRY_OVERHEAD_BYTES
+        cache = PredictionCache(entryBytes * 2)
+        keys = cache.hashRows(np.arange(3.0).reshape(3, 1))
+
+        cache.put(keys[0], np.array([0.0]))
+        cache.put(keys[1], np.array([1.0]))
+        cache.get(keys[0])
+        cache.put(keys[2], np.array([2.0]))
+
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert cache.getStats()["evictions"] == 1
+        assert cache.getStats()["bytes"] <= entryBytes * 2
+
+    def test_ModelIdentity(self):
+        """
+        The cache should be cleared when the model identity changes.
+        """
+        cache = PredictionCache()
+        cache.setModelIdentity("model:1")
+        key = cache.hashRows(np.ones((1, 2)))[0]
+        cache.put(key, np.array([1.0]))
+
+        cache.setModelIdentity("model:1")
+        assert cache.get(key) is not None
+
+        cache.setModelIdentity("model:2")
+        assert cache.get(key) is None
+
+        with pytest.raises(ValueError):
+            PredictionCache(0)
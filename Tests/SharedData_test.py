@@ -0,0 +1,60 @@
+"""
+Tests for functionality in the SharedData module.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import pytest
+
+from TFHelpers.SharedData import attachSharedArrays, SharedDatasetBroker
+
+def _sumSharedArray(handle, name):
+    """Attaches to a shared array in a worker process"""
+    return float(attachSharedArrays(handle, [name])[name].sum())
+
+class Test_SharedDatasetBroker:
+    """
+    Tests for the SharedDatasetBroker class.
+    """
+    def test_ShareAndAttach(self, tmpdir):
+        """
+        Attached arrays should be read only views with the shared values.
+        """
+        X = np.arange(12, dtype=np.float32).reshape(4, 3)
+        y = np.arange(4, dtype=np.float64)
+
+        with SharedDatasetBroker(str(tmpdir)) as broker:
+            shared = broker.shareArrays(X=X, y=y)
+            assert np.array_equal(shared["X"], X)
+
+            attached = attachSharedArrays(broker.getHandle())
+            assert sorted(attached.keys()) == ["X", "y"]
+            assert np.array_equal(attached["y"], y)
+            assert attached["X"].dtype == np.float32
+
+            with pytest.raises(ValueError):
+                attached["X"][0, 0] = 1
+
+            with pytest.raises(ValueError):
+                broker.share("X", X)
+
+            with pytest.raises(ValueError):
+                broker.share("../X", X)
+
+            handle = broker.getHandle()
+
+        assert not os.path.exists(handle)
+
+    def test_WorkerProcesses(self, tmpdir):
+        """
+        Worker processes should be able to attach to the arrays by name.
+        """
+        with SharedDatasetBroker(str(tmpdir)) as broker:
+            broker.share("X", np.ones((100, 10)))
+
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                sums = list(executor.map(_sumSharedArray, [broker.getHandle()] * 4, ["X"] * 4))
+
+        assert sums == [1000.0] * 4
@@ -3,13 +3,17 @@ Tests for functionality in the TrainingHelpers module.
 """
 
 import time
+import numpy as np
 import pytest
+import scipy.sparse
 
 from sklearn.datasets import make_regression
 
 import tensorflow as tf
 
-from TFHelpers.TrainingHelpers import ProgressCalculator, EarlyStoppingHelper, TrainingValidator
+from TFHelpers.TrainingHelpers import buildAllocatorStats, getBufferBytes, ImportanceSampler, MagnitudePruner, \
+                                      MemoryTracker, ProgressCalculator, EarlyStoppingHelper, \
+                                      StreamingMoments, TrainingValidator, ValidationScheduler
 
 class Test_ProgressCalculator_InvalidBehaviour:
     """
@@ -260,6 +264,319 @@ class Test_EarlyStoppingHelper:
             assert A.eval() == 5
             assert B.eval() == 15
 
+    def test_InvalidPolicy(self):
+        """
+        Invalid policy settings should raise an exception.
+        """
+        with pytest.raises(ValueError):
+            EarlyStoppingHelper(smoothing="mean")
+
+        with pytest.raises(ValueError):
+            EarlyStoppingHelper(smoothingWindow=0)
+
+        with pytest.raises(ValueError):
+            EarlyStoppingHelper(minDelta=-1)
+
+        with pytest.raises(ValueError):
+            EarlyStoppingHelper(extrapolationWindow=1)
+
+    def test_MinDelta(self):
+        """
+        Small decreases in the loss shouldn't count as progress, and the checks saved compared to
+        the default policy should be reported.
+        """
+        stoppingHelper = EarlyStoppingHelper(2, minDelta=0.5)
+
+        tf.reset_default_graph()
+        with tf.Session():
+            assert [stoppingHelper.shouldStop(loss) for loss in [10, 9.8, 9.7, 9.6]] == \
+                   [False, False, False, True]
+
+        # The default policy would have needed at least 3 more checks without a lower loss
+        assert stoppingHelper.bestLossVal == 9.6
+        assert stoppingHelper.getSavingsReport()["checksSaved"] == 3
+
+    def test_MedianSmoothing(self):
+        """
+        A noisy loss which occasionally reaches a new low should stop with a smoothed policy, but
+        not with the default policy.
+        """
+        losses = [10, 8, 6, 5] + [loss for step in range(1, 20) for loss in (6, 5 - 0.1 * step)]
+
+        tf.reset_default_graph()
+        with tf.Session():
+            stoppingHelper = EarlyStoppingHelper(3)
+            assert not any(stoppingHelper.shouldStop(loss) for loss in losses)
+
+            stoppingHelper = EarlyStoppingHelper(3, smoothing="median", smoothingWindow=3, minDelta=0.2)
+            stops = [stoppingHelper.shouldStop(loss) for loss in losses[:10]]
+
+        assert stops == [False] * 9 + [True]
+        assert stoppingHelper.bestLossVal == pytest.approx(4.7)
+        assert stoppingHelper.getSavingsReport()["checksSaved"] == 4
+
+    def test_Extrapolation(self):
+        """
+        A loss which is decreasing too slowly to make progress within the patience should stop as
+        soon as there has been a check without progress.
+        """
+        losses = [10, 5, 2, 1] + [1 - 0.001 * step for step in range(1, 30)]
+
+        tf.reset_default_graph()
+        with tf.Session():
+            stoppingHelper = EarlyStoppingHelper(20, minDelta=0.1, extrapolationWindow=3)
+            stops = [stoppingHelper.shouldStop(loss) for loss in losses[:6]]
+
+        assert stops == [False] * 5 + [True]
+        assert stoppingHelper.getSavingsReport()["extrapolatedStop"]
+
+    def test_Reset(self):
+        """
+        Reset should forget the losses seen so far.
+        """
+        stoppingHelper = EarlyStoppingHelper(1)
+
+        tf.reset_default_graph()
+        with tf.Session():
+            assert [stoppingHelper.shouldStop(loss) for loss in [1, 2, 3]] == [False, False, True]
+            stoppingHelper.reset()
+            assert not stoppingHelper.shouldStop(4)
+
+        assert stoppingHelper.getSavingsReport()["checks"] == 1
+
+class Test_ValidationScheduler:
+    """
+    Tests that the ValidationScheduler signals validation at the correct times.
+    """
+    def test_InvalidIntervals(self):
+        """
+        ValidationScheduler should raise an exception for intervals which are not positive.
+        """
+        with pytest.raises(ValueError):
+            ValidationScheduler(everySteps=0)
+
+        with pytest.raises(ValueError):
+            ValidationScheduler(everySeconds=-1)
+
+    def test_PerEpoch(self):
+        """
+        Without any intervals validation is never due during an epoch.
+        """
+        scheduler = ValidationScheduler()
+        scheduler.start()
+
+        assert scheduler.isPerEpoch()
+        assert not any(scheduler.step() for _ in range(100))
+
+    def test_EverySteps(self):
+        """
+        Validation should be due every N steps.
+        """
+        scheduler = ValidationScheduler(everySteps=3)
+        scheduler.start()
+
+        assert not scheduler.isPerEpoch()
+        assert [scheduler.step() for _ in range(7)] == [False, False, True, False, False, True, False]
+
+    def test_EverySeconds(self):
+        """
+        Validation should be due once the interval has elapsed since the last check.
+        """
+        scheduler = ValidationScheduler(everySeconds=0.5)
+        scheduler.start()
+
+        assert not scheduler.step()
+        time.sleep(0.51)
+        assert scheduler.step()
+        assert not scheduler.step()
+
+class Test_MemoryTracker:
+    """
+    Tests for the MemoryTracker class and getBufferBytes.
+    """
+    def test_BufferBytes(self):
+        """
+        Buffer sizes should include every array in containers and sparse matrices.
+        """
+        dense = np.zeros((10, 4), dtype=np.float32)
+        sparse = scipy.sparse.csr_matrix(np.eye(4, dtype=np.float32))
+
+        assert getBufferBytes(dense) == 160
+        assert getBufferBytes(sparse) == sparse.data.nbytes + sparse.indices.nbytes + \
+                                         sparse.indptr.nbytes
+        assert getBufferBytes({"a": dense, "b": [dense, None]}) == 320
+
+    def test_Records(self):
+        """
+        Each record should contain the largest size seen for each buffer in that interval.
+        """
+        tracker = MemoryTracker()
+        tracker.start()
+        tracker.trackBuffer("batch", np.zeros(100, dtype=np.float64))
+        tracker.trackBuffer("batch", np.zeros(10, dtype=np.float64))
+
+        record = tracker.record(epoch=0)
+        assert record["epoch"] == 0
+        assert record["batchBytes"] == 800
+        assert record["peakRSSBytes"] > 0
+
+        # A new interval starts after each record
+        assert "batchBytes" not in tracker.record(epoch=1)
+        assert len(tracker.records) == 2
+
+    def test_WithoutResettingPeak(self, monkeypatch):
+        """
+        The peak resident set size should only be reset if it was asked for.
+        """
+        resets = []
+        monkeypatch.setattr("TFHelpers.TrainingHelpers.resetPeakRSS", lambda: resets.append(1))
+
+        tracker = MemoryTracker(resetPeak=False)
+        tracker.start()
+        assert tracker.record()["peakRSSBytes"] > 0
+        assert not resets
+
+        MemoryTracker().start()
+        assert len(resets) == 1
+
+    def test_AllocatorStatsBuiltOnce(self):
+        """
+        The allocator stats ops should only be added to a graph once, however many times they're
+        asked for.
+        """
+        graph = tf.Graph()
+        with graph.as_default():
+            stats = buildAllocatorStats()
+            numOps = len(graph.get_operations())
+
+            with tf.variable_scope("replica_0"):
+                assert buildAllocatorStats() == stats
+            assert len(graph.get_operations()) == numOps
+
+        with tf.Graph().as_default():
+            otherStats = buildAllocatorStats()
+            assert all(otherStats[name] is not stats[name] for name in stats)
+
+class Test_StreamingMoments:
+    """
+    Tests for the StreamingMoments class.
+    """
+    def test_MatchesNumpy(self):
+        """
+        Combining uneven batches should give the same result as numpy on the whole dataset.
+        """
+        data = np.random.RandomState(42).normal(1000, 5, (1003, 4))
+
+        moments = StreamingMoments()
+        for start in range(0, len(data), 100):
+            moments.update(data[start:start + 100])
+
+        assert moments.count == 1003
+        assert moments.mean == pytest.approx(data.mean(axis=0))
+        assert moments.getVariance() == pytest.approx(data.var(axis=0))
+
+        with pytest.raises(RuntimeError):
+            StreamingMoments().getVariance()
+
+class Test_ImportanceSampler:
+    """
+    Tests for the ImportanceSampler class.
+    """
+    def test_InvalidArguments(self):
+        """
+        Invalid settings should raise an exception.
+        """
+        with pytest.raises(ValueError):
+            ImportanceSampler(smoothing=1)
+
+        with pytest.raises(ValueError):
+            ImportanceSampler(uniformMix=0)
+
+        with pytest.raises(ValueError):
+            ImportanceSampler(refreshEvery=0)
+
+    def test_SamplesHighLosses(self):
+        """
+        Examples with higher losses should be drawn more often, and the weighted mean of the losses
+        should be an unbiased estimate of the mean loss.
+        """
+        np.random.seed(42)
+        losses = np.ones(100)
+        losses[:10] = 100
+
+        sampler = ImportanceSampler(smoothing=0, refreshEvery=1)
+        sampler.start(100)
+        sampler.update(np.arange(100), losses)
+
+        estimates = []
+        highLossDraws = 0
+        for _ in range(2000):
+            indicies, weights = sampler.sampleBatch(32)
+            highLossDraws += np.sum(indicies < 10)
+            estimates.append(np.mean(weights * losses[indicies]))
+
+        # The first 10 examples hold over 90% of the loss
+        assert highLossDraws / (2000 * 32) > 0.8
+        assert np.mean(estimates) == pytest.approx(np.mean(losses), rel=0.02)
+
+class Test_MagnitudePruner:
+    """
+    Tests for the MagnitudePruner class.
+    """
+    def test_InvalidArguments(self):
+        """
+        Invalid settings should raise an exception.
+        """
+        with pytest.raises(ValueError):
+            MagnitudePruner(targetSparsity=1)
+
+        with pytest.raises(ValueError):
+            MagnitudePruner(beginStep=10, endStep=10)
+
+        with pytest.raises(ValueError):
+            MagnitudePruner(pruneEverySteps=0)
+
+    def test_Schedule(self):
+        """
+        The sparsity should rise from zero at beginStep to the target at endStep.
+        """
+        pruner = MagnitudePruner(0.8, beginStep=10, endStep=110)
+        sparsities = [pruner.getSparsityAtStep(step) for step in range(0, 200, 10)]
+
+        assert sparsities[:2] == [0, 0]
+        assert sparsities[-10:] == [pytest.approx(0.8)] * 10
+        assert all(later >= earlier for earlier, later in zip(sparsities, sparsities[1:]))
+
+    def test_Prune(self):
+        """
+        The smallest weights should be pruned, and should stay zero after further training steps.
+        """
+        tf.reset_default_graph()
+        kernel = tf.Variable(np.arange(1, 11, dtype=np.float32).reshape(2, 5))
+        trainingOp = kernel.assign_add(tf.ones((2, 5)))
+
+        pruner = MagnitudePruner(0.5, beginStep=0, endStep=10, pruneEverySteps=10)
+        maskedTrainingOp = pruner.build([kernel], trainingOp)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            pruner.start(sess)
+
+            # The schedule's sparsity is zero at beginStep
+            assert pruner.step(sess, 0)
+            assert pruner.getSparsity(sess) == {kernel.op.name: 0.0}
+
+            assert not pruner.step(sess, 5)
+            assert pruner.step(sess, 10)
+            assert np.array_equal(kernel.eval(), [[0, 0, 0, 0, 0], [6, 7, 8, 9, 10]])
+
+            sess.run(maskedTrainingOp)
+            assert np.array_equal(kernel.eval(), [[0, 0, 0, 0, 0], [7, 8, 9, 10, 11]])
+
+            # Pruning has finished once endStep is reached
+            assert not pruner.step(sess, 20)
+            assert pruner.getSparsity(sess) == {kernel.op.name: 0.5}
+
 class Test_TrainingValidator:
     """
     Tests that the TrainingValidator is able to raise the correct warnings.